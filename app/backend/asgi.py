@@ -0,0 +1,600 @@
+"""Async (ASGI) serving mode.
+
+    uvicorn asgi:app --app-dir app/backend --port 5000
+
+The endpoints that spend their time waiting on upstreams run on the event
+loop: hospital search (Nominatim behind the shared token bucket, OpenRouter),
+dispute analysis and letters (AsyncOpenAI, including SSE streaming), plus
+/health, /health/upstreams and /metrics. A slow model call holds a socket
+and a coroutine rather than a thread, so one process keeps as many in
+flight as the connection pools allow.
+
+CPU-bound work (pdfplumber, policy indexing, the pre-screen) and the
+thread-pooled website checks run in the threadpool; bills and policies of
+PDF_PARALLEL_MIN_PAGES pages or more are split across the pdf_extract
+process pool from there. Every other route (batch, jobs, admin) is
+the Flask app, mounted through a2wsgi. Configuration, caches and the pure
+helpers all come from server.py, so both modes return the same responses.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+import async_http
+import http_client
+import metrics
+import profiling
+import server
+from server import DisputeError, HospitalSearchError
+
+# Threads for PDF parsing, SQLite writes and URL checks (anyio's default is 40)
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "40"))
+# Requests beyond the pool size wait for a connection instead of opening more
+ASYNC_POOL_MAX_CONNECTIONS = int(os.getenv("ASYNC_POOL_MAX_CONNECTIONS", "200"))
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+clients = {}  # upstream name -> async client, opened by the lifespan
+
+
+def _transport(name):
+    inner = async_http.pooled_transport(max_connections=ASYNC_POOL_MAX_CONNECTIONS)
+    if server.upstream_cassette is None:
+        return inner
+    return server.cassette.AsyncCassetteTransport(server.upstream_cassette, name, inner=inner)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_THREADS
+    clients["nominatim"] = async_http.AsyncUpstreamClient("nominatim", transport=_transport("nominatim"))
+    clients["openrouter"] = async_http.AsyncUpstreamClient(
+        "openrouter", retry_methods=("POST",), transport=_transport("openrouter")
+    )
+    server.start_background_services()
+    warming = asyncio.ensure_future(_warm_up()) if server.WARM_UP else None
+    try:
+        yield
+    finally:
+        if warming is not None:
+            warming.cancel()
+        for client in clients.values():
+            await (client.aclose() if hasattr(client, "aclose") else client.close())
+        clients.clear()
+
+
+def openai_client():
+    """The shared AsyncOpenAI client, built on first use (None without OPENAI_API_KEY)."""
+    if "openai" not in clients and server.OPENAI_API_KEY:
+        from openai import AsyncOpenAI
+
+        clients["openai"] = AsyncOpenAI(
+            api_key=server.OPENAI_API_KEY,
+            http_client=server.cassette.async_httpx_client(server.upstream_cassette)
+            if server.upstream_cassette is not None
+            else None,
+        )
+    return clients.get("openai")
+
+
+async def _warm_up():
+    """server.warm_up off the event loop, then the async OpenAI client; /health answers meanwhile."""
+    try:
+        await run_in_threadpool(server.warm_up)
+        openai_client()
+    except Exception as e:
+        server.app.logger.warning("Warm-up failed: %s", e)
+
+
+class _Endpoint:
+    """ASGI app for one route: request metrics and opt-in profiling around the handler.
+
+    Both finish when the last body chunk is sent, so SSE streams are included.
+    Profiles record spans only; the stack sampler cannot tell apart requests
+    sharing the event loop thread.
+    """
+
+    def __init__(self, handler, blueprint, endpoint):
+        self.app = request_response(handler)
+        self.blueprint = blueprint
+        self.endpoint = endpoint
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        method, path = scope["method"], scope["path"]
+        profiling.clear()
+        profile = None
+        if server.profile_mode(method, path, Headers(scope=scope)) is not None:
+            profile = profiling.start(method, path, stacks=False)
+        status = 500
+        finished = False
+
+        async def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            metrics.REQUEST_SECONDS.labels(self.blueprint, self.endpoint, method, str(status)).observe(
+                time.perf_counter() - started
+            )
+            if profile is not None:
+                try:
+                    await run_in_threadpool(profiling_save, profile.finish(status=status, endpoint=self.endpoint))
+                except OSError as e:
+                    server.app.logger.warning("Could not store profile %s: %s", profile.id, e)
+
+        async def send_and_observe(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                await finish()
+
+        try:
+            await self.app(scope, receive, send_and_observe)
+        finally:
+            await finish()
+
+
+def profiling_save(data):
+    server.profile_store.save(data)
+
+
+def _wants_stream(request):
+    if request.query_params.get("stream") in ("1", "true"):
+        return True
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def _error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+# ---------- Geocoding ----------
+async def _nominatim_get(path, params, timeout):
+    """Rate-limited Nominatim GET returning parsed JSON; raises on any failure."""
+    if not await server.nominatim_limiter.acquire_async(timeout=server.NOMINATIM_MAX_WAIT):
+        raise RuntimeError("Nominatim rate limit wait exceeded")
+    resp = await clients["nominatim"].get(
+        f"{server.NOMINATIM_BASE_URL}/{path}", params=params, headers=server.nominatim_headers(), timeout=timeout
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def reverse_geocode(lat, lon):
+    started = time.perf_counter()
+    with profiling.span("reverse_geocode"):
+        result, source = server.reverse_local(lat, lon) or await _reverse_remote(lat, lon)
+    server._observe_geocode("reverse", source, started)
+    return result
+
+
+async def _reverse_remote(lat, lon):
+    key, params = server.reverse_request(lat, lon)
+    try:
+        data = await _nominatim_get("reverse", params, timeout=6) or {}
+    except Exception:
+        return dict(server.REVERSE_FALLBACK), "fallback"
+    return server.store_reverse(key, data), "nominatim"
+
+
+async def forward_geocode(address, centroid_ok=True):
+    if not address:
+        return (None, None)
+    started = time.perf_counter()
+    with profiling.span("forward_geocode"):
+        result, source = server.forward_local(address, centroid_ok) or await _forward_remote(address)
+    server._observe_geocode("forward", source, started)
+    return result
+
+
+async def _forward_remote(address):
+    try:
+        arr = await _nominatim_get("search", {"format": "jsonv2", "q": address, "limit": 1}, timeout=8) or []
+    except Exception:
+        return (None, None), "fallback"
+    return server.store_forward(address, arr), "nominatim"
+
+
+# ---------- Hospitals ----------
+async def _ask_model_for_hospitals(city_label, condition, target_miles, known=()):
+    """Raw hospital objects from Perplexity Sonar; raises HospitalSearchError."""
+    headers, body = server.hospitals_request(city_label, condition, target_miles, known)
+    try:
+        # The pooled client counts transport and HTTP errors itself
+        with profiling.span("_ask_model_for_hospitals"), \
+                metrics.llm_call("openrouter", "hospitals", count_errors=False) as call:
+            resp = await clients["openrouter"].post(
+                f"{server.OPENROUTER_BASE_URL}/chat/completions", headers=headers, json=body, timeout=45
+            )
+            payload = server.openrouter_payload(resp)
+            call["usage"] = payload.get("usage") if isinstance(payload, dict) else None
+    except (async_http.httpx.HTTPError, ValueError) as e:
+        raise HospitalSearchError(f"OpenRouter request failed: {e}", 502)
+    return server.hospital_items(payload)
+
+
+async def _item_coords(item):
+    lat, lon = item.get("latitude"), item.get("longitude")
+    if server.needs_geocode(item):
+        fg_lat, fg_lon = await forward_geocode(item["address"], centroid_ok=False)
+        if isinstance(fg_lat, (int, float)) and isinstance(fg_lon, (int, float)):
+            lat, lon = fg_lat, fg_lon
+    return lat, lon
+
+
+async def _clean_model_items(items, city_label):
+    """server._clean_model_items, with the website checks and geocodes running concurrently."""
+    named = server.named_items(items)
+    url_statuses, coords = await asyncio.gather(
+        run_in_threadpool(server.verify_item_urls, items),
+        asyncio.gather(*(_item_coords(it) for it in named)),
+    )
+    return [server.hospital_record(it, city_label, url_statuses, lat, lon) for it, (lat, lon) in zip(named, coords)]
+
+
+async def _search_hospitals(lat, lon, condition, radius, city_label, locality):
+    catalog_rows, in_radius = await run_in_threadpool(server.catalog_lookup, lat, lon, condition, radius, locality)
+    if len(in_radius) >= server.CATALOG_MIN_RESULTS:
+        return {"hospitals": catalog_rows, "source": "catalog"}
+    try:
+        items = await _ask_model_for_hospitals(
+            city_label, condition, server.model_target_miles(radius), known=[r["name"] for r in in_radius]
+        )
+    except HospitalSearchError as e:
+        return server.catalog_fallback(catalog_rows, in_radius, e)
+    fresh = await _clean_model_items(items, city_label)
+    return await run_in_threadpool(server.merge_fresh, catalog_rows, fresh, condition)
+
+
+async def hospitals(request):
+    try:
+        data = json.loads(await request.body() or b"{}") or {}
+    except ValueError:
+        return _error("Invalid JSON body", 400)
+    lat = data.get("lat")
+    lon = data.get("lon")
+    location_query = data.get("location")
+    condition = (data.get("condition") or "").strip()
+    radius = server._radius_from_request(data)
+    sort_by = "distance" if data.get("sort") == "distance" else "price"
+
+    if not condition:
+        return _error("condition required", 400)
+
+    if location_query and (lat is None or lon is None):
+        geocoded_lat, geocoded_lon = await forward_geocode(location_query)
+        if geocoded_lat is None or geocoded_lon is None:
+            return _error(f"Could not find location: '{location_query}'", 400)
+        lat, lon = geocoded_lat, geocoded_lon
+
+    if lat is None or lon is None:
+        return _error("Location required (enable GPS or enter city/zip)", 400)
+
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except Exception:
+        return _error("lat/lon must be numbers", 400)
+
+    place = await reverse_geocode(lat, lon)
+    locality, city_label, cache_key = server.search_cache_key(place, lat, lon, condition, radius)
+    try:
+        found, cache_status = await server.hospital_search_cache.get_async(
+            cache_key, lambda: _search_hospitals(*server.search_origin(lat, lon), condition, radius, city_label, locality)
+        )
+    except HospitalSearchError as e:
+        return _error(e.message, e.http_status)
+    metrics.cache_lookup("hospital_search", cache_status.lower())
+
+    results = server._localize([dict(r) for r in found["hospitals"]], lat, lon, radius, sort_by)
+    return JSONResponse(
+        {"results": results, "radius_miles": radius, "sort": sort_by, "source": found["source"]},
+        headers={"X-Cache": cache_status},
+    )
+
+
+# ---------- Dispute ----------
+async def ai_check_overcharges_and_discount(rules_text, bill_text, household_size, annual_income, zip_code):
+    """Structured analysis dict, as server.ai_check_overcharges_and_discount."""
+    client = openai_client()
+    if client is None:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    with profiling.span("ai_check_overcharges_and_discount"):
+        system_instructions, user_prompt = server._analysis_prompt(
+            rules_text, bill_text, household_size, annual_income, zip_code
+        )
+        with profiling.span("openai_call"), metrics.llm_call("openai", "analysis") as call:
+            response = await client.chat.completions.create(
+                model=server.OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": system_instructions},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0,
+            )
+            call["usage"] = response.usage
+        return server._normalize_analysis(response.choices[0].message.content.strip())
+
+
+async def draft_dispute_letter(patient_name, hospital_name, bill_text, structured_report):
+    client = openai_client()
+    if client is None:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    prompt = server._dispute_letter_prompt(patient_name, hospital_name, structured_report)
+    with profiling.span("draft_dispute_letter"), metrics.llm_call("openai", "letter") as call:
+        response = await client.chat.completions.create(
+            model=server.OPENAI_MODEL, messages=[{"role": "user", "content": prompt}], temperature=0
+        )
+        call["usage"] = response.usage
+    return response.choices[0].message.content
+
+
+async def draft_dispute_letter_stream(patient_name, hospital_name, bill_text, structured_report):
+    """Letter text deltas as the model generates them."""
+    client = openai_client()
+    if client is None:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    prompt = server._dispute_letter_prompt(patient_name, hospital_name, structured_report)
+    with profiling.span("draft_dispute_letter_stream"), metrics.llm_call("openai", "letter_stream") as call:
+        stream = await client.chat.completions.create(
+            model=server.OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                call["usage"] = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def run_bill_analysis(params):
+    """server.run_bill_analysis with the parsing in the threadpool and the model call awaited."""
+    prepared = await run_in_threadpool(server.prepare_analysis, params, lambda stage: None)
+    if "payload" in prepared:
+        return prepared["payload"]
+    if prepared["deterministic"] is not None:
+        return (await run_in_threadpool(server.finish_analysis, params, prepared, prepared["deterministic"]))[0]
+    try:
+        ai_structured = await ai_check_overcharges_and_discount(
+            prepared["rules_text"], prepared["review_text"],
+            params["household_size"], params["annual_income"], params["zip_code"],
+        )
+    except Exception as e:
+        raise DisputeError(f"AI processing failed: {e}", 500)
+    return (await run_in_threadpool(server.finish_analysis, params, prepared, ai_structured))[0]
+
+
+_letters_in_flight = {}  # letter cache key -> Task drafting it on this event loop
+
+
+async def _pending_letter(key):
+    """A draft of this letter already running here or in the pregeneration pool, or None."""
+    if not key:
+        return None
+    task = _letters_in_flight.get(key)
+    if task is not None:
+        return asyncio.shield(task)
+    with server._letters_lock:
+        future = server._letters_in_flight.get(key)
+    return asyncio.wrap_future(future) if future is not None else None
+
+
+async def _draft_and_store(record, patient_name, key):
+    letter = await draft_dispute_letter(*server._letter_args(record, patient_name))
+    if key:
+        server.analysis_cache.set(key, letter, server.ANALYSIS_CACHE_TTL)
+    return letter
+
+
+async def dispute_letter(record, patient_name=None):
+    """server.dispute_letter on the event loop; returns (letter, cached)."""
+    patient_name = " ".join(str(patient_name or record["patient_name"]).split())
+    key = server._letter_cache_key(record, patient_name)
+    letter = server.analysis_cache.get(key) if key else None
+    if key:
+        metrics.cache_lookup("letter", letter is not None)
+    if letter is not None:
+        return letter, True
+    pending = await _pending_letter(key)
+    if pending is not None:
+        try:
+            return await pending, True
+        except Exception:
+            pass  # the background draft failed; draft it again below unless another waiter is
+        retry = _letters_in_flight.get(key)
+        if retry is not None and not retry.done():
+            return await asyncio.shield(retry), True
+    task = asyncio.ensure_future(_draft_and_store(record, patient_name, key))
+    if key:
+        _letters_in_flight[key] = task
+        task.add_done_callback(lambda t: _letters_in_flight.pop(key, None))
+    # shield: a client that goes away must not cancel a draft others may be waiting on
+    return await asyncio.shield(task), False
+
+
+async def _stream_dispute_letter(record, patient_name=None):
+    """SSE events for a letter, as server._stream_dispute_letter."""
+    if not server.overcharges_found(record["ai_structured"]):
+        yield server._sse("done", {"dispute_letter": ""})
+        return
+    patient_name = " ".join(str(patient_name or record["patient_name"]).split())
+    key = server._letter_cache_key(record, patient_name)
+    letter = server.analysis_cache.get(key) if key else None
+    if key:
+        metrics.cache_lookup("letter", letter is not None)
+    if letter is None:
+        pending = await _pending_letter(key)
+        if pending is not None:
+            try:
+                letter = await pending
+            except Exception:
+                pass  # that draft failed; draft it again below
+    if letter is not None:
+        yield server._sse("letter", {"delta": letter})
+        yield server._sse("done", {"dispute_letter": letter})
+        return
+    parts = []
+    try:
+        async for delta in draft_dispute_letter_stream(*server._letter_args(record, patient_name)):
+            parts.append(delta)
+            yield server._sse("letter", {"delta": delta})
+    except Exception as e:
+        yield server._sse("error", {"error": f"AI processing failed: {e}"})
+        return
+    letter = "".join(parts)
+    if key:
+        server.analysis_cache.set(key, letter, server.ANALYSIS_CACHE_TTL)
+    yield server._sse("done", {"dispute_letter": letter})
+
+
+async def _stream_analysis_and_letter(result, record):
+    yield server._sse("analysis", result)
+    async for event in _stream_dispute_letter(record):
+        yield event
+
+
+def _upload_of(value):
+    return (value.filename or "", value.file) if isinstance(value, UploadFile) else None
+
+
+async def _dispute_params(request):
+    """server._dispute_params_from_request for a Starlette request."""
+    limit = server.app.config["MAX_CONTENT_LENGTH"]
+    try:
+        too_large = int(request.headers.get("content-length") or 0) > limit
+    except ValueError:
+        too_large = False
+    if too_large:
+        raise DisputeError(f"Upload too large (limit {limit // (1024 * 1024)} MB).", 413)
+    async with request.form() as form:
+        fields = {k: v for k, v in form.items() if isinstance(v, str)}
+        # Uploads are hashed and stored (or kept in memory) off the event loop
+        return await run_in_threadpool(
+            server.dispute_params, fields, _upload_of(form.get("bill_pdf")), _upload_of(form.get("rules_pdf"))
+        )
+
+
+async def dispute_home(request):
+    return JSONResponse({"status": "ok", "providers": list(server.PROVIDER_RULES.keys())})
+
+
+async def analyze(request):
+    """Analyze a bill; the letter is drafted later via letter_url, or streamed with ?stream=1."""
+    try:
+        params = await _dispute_params(request)
+        result = await run_bill_analysis(params)
+    except DisputeError as e:
+        return _error(e.message, e.http_status)
+    if not _wants_stream(request):
+        return JSONResponse(result)
+    analysis_key = await run_in_threadpool(server._analysis_cache_key, params)
+    record = server._analysis_record(params, result["ai_structured"], analysis_key)
+    return StreamingResponse(
+        _stream_analysis_and_letter(result, record), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+async def analysis_letter(request):
+    """Draft (or fetch the cached) letter for an analysis, as server.analysis_letter."""
+    analysis_id = request.path_params["analysis_id"]
+    record = server.get_analysis_record(analysis_id)
+    if record is None:
+        return _error("Unknown or expired analysis.", 404)
+    body = {}
+    if "json" in request.headers.get("content-type", ""):
+        try:
+            body = await request.json() or {}
+        except ValueError:
+            body = {}
+    else:
+        async with request.form() as form:
+            body = {k: v for k, v in form.items() if isinstance(v, str)}
+    patient_name = body.get("patient_name") or None
+    if _wants_stream(request):
+        return StreamingResponse(
+            _stream_dispute_letter(record, patient_name), media_type="text/event-stream", headers=SSE_HEADERS
+        )
+    if not server.overcharges_found(record["ai_structured"]):
+        return JSONResponse({"analysis_id": analysis_id, "dispute_letter": ""})
+    try:
+        letter, cached = await dispute_letter(record, patient_name)
+    except Exception as e:
+        return _error(f"AI processing failed: {e}", 500)
+    return JSONResponse(
+        {"analysis_id": analysis_id, "dispute_letter": letter}, headers={"X-Cache": "HIT" if cached else "MISS"}
+    )
+
+
+# ---------- Health & metrics ----------
+async def health(request):
+    return JSONResponse({"ok": True})
+
+
+async def prometheus_metrics(request):
+    body, content_type = metrics.render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def health_upstreams(request):
+    """Per-upstream stats of the sync clients (mounted Flask routes) and the async ones."""
+    stats = http_client.all_stats()
+    stats["async"] = {name: c.stats() for name, c in clients.items() if hasattr(c, "stats")}
+    if server.upstream_cassette is not None:
+        stats["cassette"] = server.upstream_cassette.stats()
+    return JSONResponse(stats)
+
+
+def _route(path, handler, method, blueprint, endpoint):
+    return Route(path, _Endpoint(handler, blueprint, endpoint), methods=[method])
+
+
+app = Starlette(
+    routes=[
+        _route("/health", health, "GET", "app", "health"),
+        _route("/metrics", prometheus_metrics, "GET", "app", "prometheus_metrics"),
+        _route("/health/upstreams", health_upstreams, "GET", "app", "health_upstreams"),
+        _route("/api/hospitals", hospitals, "POST", "hospitals", "hospitals.hospitals"),
+        _route("/api/dispute", dispute_home, "GET", "dispute", "dispute.dispute_home"),
+        _route("/api/dispute/analyze", analyze, "POST", "dispute", "dispute.analyze"),
+        _route("/api/dispute/analyses/{analysis_id}/letter", analysis_letter, "POST", "dispute", "dispute.analysis_letter"),
+        # Everything else (batch, jobs, admin) is served by the Flask app on a2wsgi's threads
+        Mount("/", app=WSGIMiddleware(server.app, workers=int(os.getenv("ASGI_WSGI_THREADS", "10")))),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=sorted(server.origins),
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["X-Cache", "X-Profile-Id"],
+        )
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
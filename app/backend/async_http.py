@@ -0,0 +1,140 @@
+"""Async pooled HTTP clients for upstream APIs, used by the ASGI app.
+
+The event-loop counterpart of http_client: one httpx AsyncClient per
+upstream holds keep-alive connections for any number of concurrent
+requests, and 429/5xx responses (and connection failures) are retried with
+the same exponential, jittered backoff, honouring Retry-After. Stats have
+the shape of http_client's, minus connection reuse.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+try:  # the flavour the OpenAI SDK is built on, so cassette transports fit both
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+import metrics
+from http_client import (
+    HTTP_BACKOFF_FACTOR,
+    HTTP_BACKOFF_JITTER,
+    HTTP_RETRIES,
+    IDEMPOTENT_METHODS,
+    RETRY_STATUSES,
+    _percentile,
+)
+
+MAX_RETRY_AFTER = 30.0
+
+
+def pooled_transport(max_connections=100, max_keepalive=20):
+    return httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+    )
+
+
+def _retry_after(resp):
+    try:
+        return min(MAX_RETRY_AFTER, max(0.0, float(resp.headers.get("Retry-After", ""))))
+    except ValueError:
+        return None
+
+
+class AsyncUpstreamClient:
+    def __init__(
+        self,
+        name,
+        max_connections=100,
+        max_keepalive=20,
+        retries=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        retry_methods=("GET", "HEAD", "OPTIONS"),
+        transport=None,
+    ):
+        self.name = name
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.retry_methods = frozenset(retry_methods)
+        self.client = httpx.AsyncClient(transport=transport or pooled_transport(max_connections, max_keepalive))
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=2048)
+        self.requests = 0
+        self.errors = 0
+        self.status_errors = 0
+        self.retried = 0
+
+    def _backoff(self, attempt):
+        delay = self.backoff_factor * (2 ** (attempt - 1)) if attempt > 1 else 0.0
+        return delay + random.uniform(0, self.backoff_jitter)
+
+    async def request(self, method, url, **kwargs):
+        method = method.upper()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                resp = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                # Connections that never opened are safe to retry for any method; read
+                # timeouts and dropped responses only for idempotent ones
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)) or (
+                    method in self.retry_methods and method in IDEMPOTENT_METHODS
+                )
+                if retryable and attempt <= self.retries:
+                    self.retried += 1
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                with self._lock:
+                    self.requests += 1
+                    self.errors += 1
+                    self._latencies.append(time.perf_counter() - start)
+                metrics.upstream_error(self.name, e)
+                raise
+            if resp.status_code in RETRY_STATUSES and method in self.retry_methods and attempt <= self.retries:
+                wait = _retry_after(resp)
+                await resp.aclose()
+                self.retried += 1
+                await asyncio.sleep(self._backoff(attempt) if wait is None else wait)
+                continue
+            break
+        with self._lock:
+            self.requests += 1
+            if resp.status_code >= 400:
+                self.status_errors += 1
+            self._latencies.append(time.perf_counter() - start)
+        if resp.status_code >= 400:
+            metrics.upstream_error(self.name, status=resp.status_code)
+        return resp
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def stats(self):
+        with self._lock:
+            lat = sorted(self._latencies)
+            requests_total, errors, status_errors = self.requests, self.errors, self.status_errors
+        return {
+            "requests": requests_total,
+            "errors": errors,
+            "status_errors": status_errors,
+            "retries": self.retried,
+            "latency_ms": {
+                "p50": round(_percentile(lat, 50) * 1000, 1) if lat else None,
+                "p95": round(_percentile(lat, 95) * 1000, 1) if lat else None,
+                "max": round(lat[-1] * 1000, 1) if lat else None,
+                "samples": len(lat),
+            },
+        }
@@ -0,0 +1,355 @@
+"""Benchmark suite: PDF extraction and end-to-end API latency against local stubs.
+
+Usage:
+    python app/backend/bench/run.py [--levels 1,4,16] [--requests 40] [--output results.json]
+
+OpenAI, OpenRouter and Nominatim are replaced by bench.stubs (configurable
+latency and error rate per upstream), so runs are free, offline and
+repeatable. Measured:
+
+- extract_text_from_pdf on every sample PDF (min/median/max over --repeat runs)
+- p50/p95/p99 latency, throughput and errors of POST /api/dispute/analyze and
+  POST /api/hospitals at each concurrency level, through a threaded local server
+
+Results are written as JSON (bench/results/bench-<timestamp>.json by
+default); --compare prints the change against an earlier results file.
+Server caches are disabled unless --warm-caches is given, so every request
+exercises the full pipeline.
+
+With --cassette, the stubs are not used: --cassette-mode record runs against
+the real APIs (keys from the environment) and saves their responses;
+replay serves them back offline, with --replay-latency zero leaving only the
+time spent in our own code. Request inputs are deterministic, so a replay
+run sends exactly the requests that were recorded.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.abspath(os.path.join(BACKEND_DIR, "..", ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.stubs import UPSTREAMS, StubServer, UpstreamProfile  # noqa: E402
+
+SAMPLE_DIRS = [
+    os.path.join(REPO_DIR, "PDF Reading HealthCare Most Recent"),
+    os.path.join(REPO_DIR, "app", "dispute", "policy_docs"),
+    os.path.join(REPO_DIR, "app", "dispute", "uploads"),
+]
+BILL_DIR = SAMPLE_DIRS[0]
+CENTER = (40.3573, -74.6672)  # Princeton, NJ
+CONDITIONS = ["MRI scan", "colonoscopy", "knee replacement", "ER visit"]
+
+
+def sample_pdfs():
+    """Sample PDFs shipped with the repo (bills and policies), sorted."""
+    found = []
+    for d in SAMPLE_DIRS:
+        if os.path.isdir(d):
+            found.extend(os.path.join(d, f) for f in sorted(os.listdir(d)) if f.lower().endswith(".pdf"))
+    return found
+
+
+def sample_bills():
+    return [p for p in sample_pdfs() if os.path.dirname(p) == BILL_DIR and "charge" not in os.path.basename(p).lower()]
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        # Nearest-rank percentile
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))], 1)
+
+    return {
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "mean": round(statistics.fmean(ordered), 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+def bench_extraction(server, repeat):
+    results = []
+    for path in sample_pdfs():
+        times, text = [], ""
+        for _ in range(repeat):
+            started = time.perf_counter()
+            text = server.extract_text_from_pdf(path)
+            times.append((time.perf_counter() - started) * 1000)
+        results.append(
+            {
+                "file": os.path.relpath(path, REPO_DIR),
+                "bytes": os.path.getsize(path),
+                "pages": server.pdf_extract.page_count(path),
+                "chars": len(text),
+                "min_ms": round(min(times), 1),
+                "median_ms": round(statistics.median(times), 1),
+                "max_ms": round(max(times), 1),
+            }
+        )
+        print(f"  extract {results[-1]['median_ms']:>9.1f} ms  {results[-1]['file']}", file=sys.stderr)
+    return results
+
+
+def _analyze_request(session, base_url, bills, i):
+    path = bills[i % len(bills)]
+    with open(path, "rb") as fh:
+        return session.post(
+            f"{base_url}/api/dispute/analyze",
+            data={"provider": "CMS", "patient_name": "Bench Patient", "household_size": "2",
+                  "annual_income": "30000", "zip_code": "08540"},
+            files={"bill_pdf": (os.path.basename(path), fh, "application/pdf")},
+            timeout=120,
+        )
+
+
+def _hospitals_request(session, base_url, _bills, i):
+    rng = random.Random(i)
+    return session.post(
+        f"{base_url}/api/hospitals",
+        json={
+            "lat": CENTER[0] + rng.uniform(-0.05, 0.05),
+            "lon": CENTER[1] + rng.uniform(-0.05, 0.05),
+            "condition": CONDITIONS[i % len(CONDITIONS)],
+            "sort": "distance" if i % 2 else "price",
+        },
+        timeout=120,
+    )
+
+
+ENDPOINTS = {"analyze": _analyze_request, "hospitals": _hospitals_request}
+
+
+def bench_endpoint(base_url, name, levels, n_requests, bills):
+    import requests
+
+    send = ENDPOINTS[name]
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = send(session, base_url, bills, i).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return (time.perf_counter() - started) * 1000, status
+
+    rows = []
+    for level in levels:
+        with ThreadPoolExecutor(max_workers=level, thread_name_prefix=f"bench-{name}") as pool:
+            started = time.perf_counter()
+            outcomes = list(pool.map(one, range(n_requests)))
+            wall = time.perf_counter() - started
+        ok = [ms for ms, status in outcomes if status == 200]
+        statuses = {}
+        for _, status in outcomes:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        row = {
+            "concurrency": level,
+            "requests": n_requests,
+            "ok": len(ok),
+            "errors": n_requests - len(ok),
+            "statuses": statuses,
+            "throughput_rps": round(n_requests / wall, 2),
+            "latency_ms": percentiles(ok),
+        }
+        rows.append(row)
+        lat = row["latency_ms"]
+        print(
+            f"  {name:9} c={level:<3} p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} ms  "
+            f"{row['throughput_rps']} req/s  errors={row['errors']}",
+            file=sys.stderr,
+        )
+    return rows
+
+
+def _serve(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    httpd = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, name="bench-app", daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Print p50/p95 changes against an earlier results file."""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    print(f"\nvs {baseline_path} ({baseline['meta'].get('git_commit')}):", file=sys.stderr)
+    for name, rows in current["endpoints"].items():
+        before = {r["concurrency"]: r for r in baseline.get("endpoints", {}).get(name, [])}
+        for row in rows:
+            old = before.get(row["concurrency"])
+            if not old:
+                continue
+            deltas = []
+            for key in ("p50", "p95"):
+                a, b = old["latency_ms"][key], row["latency_ms"][key]
+                if a and b:
+                    deltas.append(f"{key} {a} -> {b} ms ({(b - a) / a:+.0%})")
+            print(f"  {name:9} c={row['concurrency']:<3} " + ", ".join(deltas), file=sys.stderr)
+    old_extract = {r["file"]: r["median_ms"] for r in baseline.get("extraction", [])}
+    for row in current["extraction"]:
+        a = old_extract.get(row["file"])
+        if a:
+            print(f"  extract   {a} -> {row['median_ms']} ms ({(row['median_ms'] - a) / a:+.0%})  {row['file']}",
+                  file=sys.stderr)
+
+
+def _profile(spec):
+    """'latency_ms[:jitter_ms[:error_rate]]' -> UpstreamProfile."""
+    parts = [float(p) for p in spec.split(":")]
+    return UpstreamProfile(*parts)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction and API latency against local stubs.")
+    parser.add_argument("--levels", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", "-n", type=int, default=40, help="requests per endpoint and level")
+    parser.add_argument("--endpoints", default="analyze,hospitals", help="comma-separated: analyze, hospitals")
+    parser.add_argument("--repeat", type=int, default=3, help="extraction runs per sample PDF")
+    parser.add_argument("--skip-extraction", action="store_true")
+    parser.add_argument("--warm-caches", action="store_true", help="leave the server's caches enabled")
+    parser.add_argument("--hospitals", type=int, default=12, help="hospitals per stub OpenRouter reply")
+    for name, default in (("openai", "800:200:0"), ("openrouter", "1500:300:0"), ("nominatim", "150:50:0"),
+                          ("site", "50:20:0")):
+        parser.add_argument(f"--{name}", default=default, metavar="MS[:JITTER[:ERR]]",
+                            help=f"{name} stub latency, jitter (ms) and error rate (default {default})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette", metavar="PATH", help="record/replay upstream traffic instead of using the stubs")
+    parser.add_argument("--cassette-mode", choices=("record", "replay", "auto"), default="replay")
+    parser.add_argument("--replay-latency", choices=("recorded", "zero"), default="recorded",
+                        help="sleep for the recorded upstream latency, or not at all")
+    parser.add_argument("--output", "-o", help="results JSON path (default bench/results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="print changes against an earlier run")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        print(f"unknown endpoints: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    cache_dir = tempfile.mkdtemp(prefix="billchill-bench-")
+    # The server reads its configuration at import, so set everything up first
+    os.environ.update({"BILLCHILL_CACHE_DIR": cache_dir, "PDF_CACHE_WARM": "0", "GAZETTEER_FILES": ""})
+    stub = None
+    if args.cassette:
+        # Real upstreams (record) or none at all (replay); keys come from the environment
+        os.environ.update(
+            {
+                "CASSETTE_PATH": os.path.abspath(args.cassette),
+                "CASSETTE_MODE": args.cassette_mode,
+                "CASSETTE_LATENCY": args.replay_latency,
+            }
+        )
+    else:
+        stub = StubServer(
+            profiles={name: _profile(getattr(args, name)) for name in UPSTREAMS},
+            center=CENTER,
+            hospitals=args.hospitals,
+            seed=args.seed,
+        ).start()
+        os.environ.update(stub.env())
+        os.environ.update({"OPENAI_API_KEY": "bench", "OPENROUTER_API_KEY": "bench", "NOMINATIM_RATE_PER_SEC": "1000"})
+    if not args.warm_caches:
+        os.environ.update(
+            {
+                "ANALYSIS_CACHE_TTL": "0",
+                "HOSPITAL_CACHE_TTL": "0",
+                "HOSPITAL_CACHE_STALE_TTL": "0",
+                "CATALOG_MAX_AGE": "0",
+                "GEOCODE_TTL": "0",
+                "GEOCODE_NEGATIVE_TTL": "0",
+                "URL_CHECK_OK_TTL": "0",
+                "URL_CHECK_FAIL_TTL": "0",
+            }
+        )
+
+    import server
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "levels": levels,
+            "requests_per_level": args.requests,
+            "warm_caches": args.warm_caches,
+            "openai_model": server.OPENAI_MODEL,
+        },
+        "extraction": [],
+        "endpoints": {},
+    }
+
+    if not args.skip_extraction:
+        print("PDF extraction:", file=sys.stderr)
+        results["extraction"] = bench_extraction(server, max(1, args.repeat))
+
+    bills = sample_bills()
+    httpd, base_url = _serve(server.app)
+    try:
+        for name in endpoints:
+            print(f"{name}:", file=sys.stderr)
+            results["endpoints"][name] = bench_endpoint(base_url, name, levels, args.requests, bills)
+    finally:
+        httpd.shutdown()
+        if stub is not None:
+            stub.stop()
+    if stub is not None:
+        results["meta"]["stubs"] = stub.stats()
+    if server.upstream_cassette is not None:
+        results["meta"]["cassette"] = server.upstream_cassette.stats()
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"wrote {output}", file=sys.stderr)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Startup benchmark: import time and time to the first /health response.
+
+Usage:
+    python app/backend/bench/startup.py [--runs 5] [--server flask|gunicorn|uvicorn]
+        [--max-import-ms 600] [--max-health-ms 1500]
+
+Every run starts a fresh interpreter with an empty cache directory, the way a
+new worker or an autoscaled instance starts. Measured:
+
+- `import server`: wall time inside the child, plus which heavy modules
+  (openai, pdfplumber, requests, httpx, tiktoken) it loaded; these should
+  stay out until first use
+- the slowest top-level imports, from one extra run under -X importtime
+- process start to the first 200 from GET /health, through the chosen server
+  (gunicorn and uvicorn run one worker and must be installed)
+
+Medians above --max-import-ms / --max-health-ms make the exit status 1, so
+the budget can be held in CI. Results are written as JSON
+(bench/results/startup-<timestamp>.json by default).
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.abspath(os.path.join(BACKEND_DIR, "..", ".."))
+
+HEAVY_MODULES = ("openai", "pdfplumber", "requests", "httpx", "httpx2", "tiktoken")
+
+_IMPORT_SNIPPET = f"""
+import json, sys, time
+sys.path.insert(0, {BACKEND_DIR!r})
+started = time.perf_counter()
+import server
+import_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{"import_ms": import_ms, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+_FLASK_SNIPPET = f"""
+import sys
+sys.path.insert(0, {BACKEND_DIR!r})
+from werkzeug.serving import make_server
+import server
+make_server("127.0.0.1", int(sys.argv[1]), server.app, threaded=True).serve_forever()
+"""
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def _env(cache_dir):
+    env = dict(os.environ)
+    env.update({"BILLCHILL_CACHE_DIR": cache_dir, "PYTHONDONTWRITEBYTECODE": "1"})
+    # A key is needed for the OpenAI client to exist at all; /health never calls it
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("OPENROUTER_API_KEY", "bench")
+    return env
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _server_cmd(kind, port):
+    if kind == "flask":
+        return [sys.executable, "-c", _FLASK_SNIPPET, str(port)]
+    if kind == "gunicorn":
+        return [
+            sys.executable, "-m", "gunicorn", "-c", os.path.join(BACKEND_DIR, "gunicorn.conf.py"),
+            "--bind", f"127.0.0.1:{port}", "--workers", "1",
+        ]
+    return [
+        sys.executable, "-m", "uvicorn", "asgi:app", "--app-dir", BACKEND_DIR,
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+
+
+def measure_import():
+    with tempfile.TemporaryDirectory(prefix="billchill-startup-") as cache_dir:
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET], env=_env(cache_dir), capture_output=True, text=True, timeout=120
+        )
+    if out.returncode != 0:
+        raise RuntimeError(f"import server failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top=10):
+    """Top-level modules imported by server, by cumulative import time."""
+    with tempfile.TemporaryDirectory(prefix="billchill-startup-") as cache_dir:
+        out = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _IMPORT_SNIPPET],
+            env=_env(cache_dir), capture_output=True, text=True, timeout=120,
+        )
+    rows = []
+    for line in out.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m and len(m.group(3)) == 3:  # imported directly by server
+            rows.append({"module": m.group(4), "cumulative_ms": round(int(m.group(2)) / 1000, 1)})
+    return sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]
+
+
+def measure_health(kind, timeout=60.0):
+    """Milliseconds from process start to the first 200 from /health."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    with tempfile.TemporaryDirectory(prefix="billchill-startup-") as cache_dir:
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            _server_cmd(kind, port), env=_env(cache_dir), cwd=BACKEND_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        try:
+            while time.perf_counter() - started < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"{kind} exited with {proc.returncode}:\n{proc.stderr.read().decode()}")
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as resp:
+                        if resp.status == 200:
+                            return (time.perf_counter() - started) * 1000
+                except OSError:
+                    pass
+                time.sleep(0.01)
+            raise RuntimeError(f"{kind}: no /health response within {timeout:.0f} s")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+def _summary(values):
+    return {
+        "min_ms": round(min(values), 1),
+        "median_ms": round(statistics.median(values), 1),
+        "max_ms": round(max(values), 1),
+        "runs_ms": [round(v, 1) for v in values],
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark backend import time and time to first /health.")
+    parser.add_argument("--runs", "-n", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--server", choices=("flask", "gunicorn", "uvicorn"), default="flask")
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time exceeds this")
+    parser.add_argument("--max-health-ms", type=float, help="fail when the median time to /health exceeds this")
+    parser.add_argument("--output", "-o", help="results JSON path (default bench/results/startup-<timestamp>.json)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    runs = max(1, args.runs)
+
+    imports = [measure_import() for _ in range(runs)]
+    import_ms = _summary([r["import_ms"] for r in imports])
+    loaded = sorted({m for r in imports for m in r["loaded"]})
+    print(f"  import server   median {import_ms['median_ms']:>7.1f} ms  (min {import_ms['min_ms']}, max {import_ms['max_ms']})",
+          file=sys.stderr)
+    print(f"  loaded at import: {', '.join(loaded) or 'none of ' + ', '.join(HEAVY_MODULES)}", file=sys.stderr)
+    slowest = slowest_imports()
+    for row in slowest[:5]:
+        print(f"    {row['cumulative_ms']:>7.1f} ms  {row['module']}", file=sys.stderr)
+
+    health_ms = _summary([measure_health(args.server) for _ in range(runs)])
+    print(f"  first /health   median {health_ms['median_ms']:>7.1f} ms  (min {health_ms['min_ms']}, max {health_ms['max_ms']})"
+          f"  [{args.server}]", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "runs": runs,
+            "server": args.server,
+        },
+        "import": {**import_ms, "heavy_modules_loaded": loaded, "slowest": slowest},
+        "first_health": health_ms,
+    }
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"startup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"wrote {output}", file=sys.stderr)
+
+    over = []
+    if args.max_import_ms is not None and import_ms["median_ms"] > args.max_import_ms:
+        over.append(f"import {import_ms['median_ms']} ms > {args.max_import_ms:g} ms")
+    if args.max_health_ms is not None and health_ms["median_ms"] > args.max_health_ms:
+        over.append(f"first /health {health_ms['median_ms']} ms > {args.max_health_ms:g} ms")
+    if over:
+        print("over budget: " + "; ".join(over), file=sys.stderr)
+        return 1
+    return 0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Local stand-ins for the upstream APIs, for benchmarks.
+
+One threaded HTTP server answers, under path prefixes:
+
+- /openai/v1/chat/completions      OpenAI chat completions (JSON or SSE stream)
+- /openrouter/api/v1/chat/completions  OpenRouter (Perplexity-style hospital list)
+- /nominatim/reverse, /nominatim/search  Nominatim
+- /site/<n>                        hospital websites for URL verification
+
+Each upstream has its own latency (base + uniform jitter, in ms) and error
+rate (fraction of requests answered with HTTP 500). Responses are shaped
+like the real ones closely enough for server.py's parsing.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+UPSTREAMS = ("openai", "openrouter", "nominatim", "site")
+
+
+class UpstreamProfile:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def delay(self, rng):
+        return max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def as_dict(self):
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms, "error_rate": self.error_rate}
+
+
+class StubServer:
+    """Serve all stub upstreams on 127.0.0.1; use as a context manager or start()/stop()."""
+
+    def __init__(self, profiles=None, center=(40.3573, -74.6672), hospitals=12, seed=0):
+        self.profiles = {name: UpstreamProfile() for name in UPSTREAMS}
+        self.profiles.update(profiles or {})
+        self.center = center
+        self.hospitals = hospitals
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.counts = {name: 0 for name in UPSTREAMS}
+        self.errors = {name: 0 for name in UPSTREAMS}
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def env(self):
+        """Environment variables pointing server.py at this stub."""
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/openai/v1",
+            "OPENROUTER_BASE_URL": f"{self.url}/openrouter/api/v1",
+            "NOMINATIM_BASE_URL": f"{self.url}/nominatim",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="bench-stubs", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def roll(self, upstream):
+        """(delay seconds, fail?) for one request to an upstream."""
+        profile = self.profiles[upstream]
+        with self._rng_lock:
+            self.counts[upstream] += 1
+            fail = self._rng.random() < profile.error_rate
+            if fail:
+                self.errors[upstream] += 1
+            return profile.delay(self._rng), fail
+
+    def stats(self):
+        return {
+            name: {**self.profiles[name].as_dict(), "requests": self.counts[name], "errors_injected": self.errors[name]}
+            for name in UPSTREAMS
+        }
+
+    # ----- response bodies -----
+    def nearby(self, i, spread=0.15):
+        rng = random.Random(i)
+        return (
+            round(self.center[0] + rng.uniform(-spread, spread), 6),
+            round(self.center[1] + rng.uniform(-spread, spread), 6),
+        )
+
+    def hospital_list(self):
+        items = []
+        for i in range(self.hospitals):
+            item = {
+                "name": f"Bench General Hospital {i}",
+                "address": f"{100 + i} Main Street, Benchville, NJ 08540",
+                "phone": f"(609) 555-{1000 + i}",
+                "url": f"{self.url}/site/{i}",
+                "price_usd": 800 + 150 * i,
+                "price_is_estimate": i % 2 == 0,
+                "notes": "Estimated self-pay price." if i % 2 == 0 else "Listed cash price.",
+            }
+            if i % 3:  # a third come without coordinates and need forward geocoding
+                item["latitude"], item["longitude"] = self.nearby(i)
+            items.append(item)
+        # Wrapped in prose, like real model output that extract_json has to salvage
+        return "Here are hospitals near you:\n```json\n" + json.dumps(items, indent=2) + "\n```"
+
+
+def _analysis_json():
+    return json.dumps(
+        {
+            "state_abbr": "NJ",
+            "total_eligible_discount_percent": 40,
+            "discount_explanation": "State charity care 30% + provider financial aid 10%.",
+            "overcharges": [
+                {"line_number": 3, "service": "Comprehensive metabolic panel", "amount": 412.0,
+                 "reason": "Exceeds reference charge per policy section 4.A."},
+            ],
+        }
+    )
+
+
+_LETTER = (
+    "Dear Billing Department,\n\nI am writing to dispute charges on my statement that exceed the "
+    "amounts permitted under your published charge policy. Please review the items listed below, "
+    "issue a corrected statement, and confirm my eligibility for financial assistance.\n\nSincerely,\nPatient"
+)
+
+
+def _handler_for(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _upstream(self, path):
+            for name in ("openai", "openrouter", "nominatim", "site"):
+                if path.startswith(f"/{name}"):
+                    return name
+            return None
+
+        def _handle(self):
+            parts = urlsplit(self.path)
+            upstream = self._upstream(parts.path)
+            if upstream is None:
+                return self._json(404, {"error": "unknown stub path"})
+            body = self._body() if self.command == "POST" else {}
+            delay, fail = stub.roll(upstream)
+            if fail:
+                time.sleep(delay)
+                return self._json(500, {"error": {"message": "injected stub failure"}})
+            if upstream == "openai":
+                return self._openai(body, delay)
+            time.sleep(delay)
+            if upstream == "openrouter":
+                return self._json(200, _completion(stub.hospital_list(), body.get("model")))
+            if upstream == "nominatim":
+                return self._nominatim(parts)
+            # Hospital website
+            if self.command == "HEAD":
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            return self._json(200, {"ok": True})
+
+        def _openai(self, body, delay):
+            messages = body.get("messages") or [{}]
+            content = _analysis_json() if messages[0].get("role") == "system" else _LETTER
+            if not body.get("stream"):
+                time.sleep(delay)
+                return self._json(200, _completion(content, body.get("model")))
+            # Stream in word-sized deltas, spreading the latency across them
+            words = content.split(" ")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, word in enumerate(words):
+                time.sleep(delay / len(words))
+                delta = word if i == 0 else " " + word
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model") or "stub",
+                    "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return None
+
+        def _nominatim(self, parts):
+            query = parse_qs(parts.query)
+            if parts.path.endswith("/reverse"):
+                return self._json(
+                    200,
+                    {
+                        "display_name": "Benchville, Mercer County, New Jersey, United States",
+                        "address": {"city": "Benchville", "state": "New Jersey", "country": "United States"},
+                    },
+                )
+            q = (query.get("q") or [""])[0]
+            lat, lon = stub.nearby(sum(map(ord, q)))
+            return self._json(200, [{"lat": str(lat), "lon": str(lon), "display_name": q}])
+
+        def do_GET(self):
+            self._handle()
+
+        def do_HEAD(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle()
+
+    return Handler
+
+
+def _completion(content, model):
+    prompt_tokens, completion_tokens = 1200, max(1, len(content) // 4)
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
@@ -0,0 +1,178 @@
+"""Offline bulk audit: run the dispute pipeline over a directory of bills.
+
+Usage:
+    python app/backend/bulk_audit.py BILLS_DIR --provider CMS [--output audit.jsonl]
+
+Reuses the server's pipeline (PDF extraction, pre-screen, policy retrieval,
+ai_check_overcharges_and_discount, draft_dispute_letter) without going
+through HTTP. Bills run on a thread pool (the work is dominated by model
+calls); bills and policies of PDF_PARALLEL_MIN_PAGES pages or more are
+split across the pdf_extract process pool, text and tables alike. One JSONL
+line is appended per bill with per-stage timings. The output file doubles as
+the checkpoint: on restart, bills already recorded with the same content
+hash are skipped (errors too, unless --retry-errors).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+# Only the pipeline is needed; don't extract the bundled policies at import
+os.environ.setdefault("PDF_CACHE_WARM", "0")
+
+import server  # noqa: E402
+
+
+def find_bills(root, recursive=False):
+    """Relative paths of the PDFs under root, sorted."""
+    found = []
+    if recursive:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            found.extend(
+                os.path.relpath(os.path.join(dirpath, f), root) for f in filenames if f.lower().endswith(".pdf")
+            )
+    else:
+        found = [f for f in os.listdir(root) if f.lower().endswith(".pdf") and os.path.isfile(os.path.join(root, f))]
+    return sorted(found)
+
+
+def load_checkpoint(output_path, retry_errors=False):
+    """{relative file: sha256} of bills already finished in a previous run."""
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as fh:
+        for raw in fh:
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            if rec.get("status") == "ok" or (rec.get("status") == "error" and not retry_errors):
+                done[rec.get("file")] = rec.get("sha256")
+    return done
+
+
+def audit_bill(rel_path, params, include_letter):
+    """Run one bill through the pipeline and return its JSONL record."""
+    timings = {}
+    marks = [("start", time.perf_counter())]
+
+    def progress(stage):
+        now = time.perf_counter()
+        prev_stage, prev = marks[-1]
+        if prev_stage != "start":
+            timings[prev_stage] = round((now - prev) * 1000, 1)
+        marks.append((stage, now))
+
+    record = {"file": rel_path, "sha256": params["bill_digest"]}
+    try:
+        result = server.run_bill_analysis(params, progress)[0]
+        if include_letter and server.overcharges_found(result["ai_structured"]):
+            progress("drafting_letter")
+            try:
+                result["dispute_letter"] = server.letter_for_result(params, result)
+            except Exception as e:
+                raise server.DisputeError(f"AI processing failed: {e}", 500)
+        progress("done")
+        record.update(status="ok", result=result)
+    except server.DisputeError as e:
+        progress("failed")
+        record.update(status="error", error=e.message, http_status=e.http_status)
+    except Exception as e:
+        progress("failed")
+        record.update(status="error", error=f"{type(e).__name__}: {e}", http_status=500)
+    timings["total"] = round((time.perf_counter() - marks[0][1]) * 1000, 1)
+    record["timings_ms"] = timings
+    record["finished_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return record
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Audit a directory of bill PDFs against one provider policy.")
+    parser.add_argument("bills_dir", help="directory containing bill PDFs")
+    rules = parser.add_mutually_exclusive_group(required=True)
+    rules.add_argument("--provider", choices=sorted(server.PROVIDER_RULES), help="bundled provider policy")
+    rules.add_argument("--rules", help="path to a rules/policy PDF")
+    parser.add_argument("--output", "-o", default="bulk_audit.jsonl", help="JSONL output and checkpoint file")
+    parser.add_argument("--workers", "-j", type=int, default=4, help="bills processed concurrently")
+    parser.add_argument("--recursive", "-r", action="store_true", help="include PDFs in subdirectories")
+    parser.add_argument("--no-letters", action="store_true", help="skip drafting dispute letters")
+    parser.add_argument("--retry-errors", action="store_true", help="re-run bills that failed last time")
+    parser.add_argument("--patient-name", default="John Doe")
+    parser.add_argument("--household-size", type=int, default=1)
+    parser.add_argument("--annual-income", type=float, default=0.0)
+    parser.add_argument("--zip-code", default="")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    rules_path = server.PROVIDER_RULES[args.provider] if args.provider else args.rules
+    if not os.path.isfile(rules_path):
+        print(f"rules PDF not found: {rules_path}", file=sys.stderr)
+        return 2
+
+    bills = find_bills(args.bills_dir, args.recursive)
+    done = load_checkpoint(args.output, args.retry_errors)
+    context = {
+        "rules_path": rules_path,
+        "rules_digest": None,
+        "rules_data": None,
+        "provider": args.provider or os.path.splitext(os.path.basename(rules_path))[0],
+        "patient_name": args.patient_name,
+        "household_size": args.household_size,
+        "annual_income": args.annual_income,
+        "zip_code": args.zip_code,
+    }
+
+    todo = []
+    for rel in bills:
+        path = os.path.join(args.bills_dir, rel)
+        digest = server.pdf_text_cache.hash_file(path)
+        if done.get(rel) == digest:
+            continue
+        todo.append((rel, {**context, "bill_path": path, "bill_digest": digest, "bill_data": None}))
+    print(f"{len(bills)} bills, {len(bills) - len(todo)} already done, {len(todo)} to audit", file=sys.stderr)
+    if not todo:
+        return 0
+
+    # Index the policy once before the workers start
+    server.get_policy_index(rules_path)
+
+    started = time.perf_counter()
+    counts = {"ok": 0, "error": 0}
+    pool = ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="audit")
+    futures = [pool.submit(audit_bill, rel, params, not args.no_letters) for rel, params in todo]
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            for n, fut in enumerate(as_completed(futures), 1):
+                rec = fut.result()
+                out.write(json.dumps(rec) + "\n")
+                out.flush()  # each finished bill is checkpointed immediately
+                counts[rec["status"]] += 1
+                print(
+                    f"[{n}/{len(todo)}] {rec['status']:5} {rec['timings_ms']['total']:>9.1f} ms  {rec['file']}",
+                    file=sys.stderr,
+                )
+    except KeyboardInterrupt:
+        for fut in futures:
+            fut.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    pool.shutdown()
+    elapsed = time.perf_counter() - started
+    print(
+        f"done: {counts['ok']} ok, {counts['error']} failed in {elapsed:.1f}s "
+        f"({len(todo) / elapsed:.2f} bills/s)",
+        file=sys.stderr,
+    )
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
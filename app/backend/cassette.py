@@ -0,0 +1,309 @@
+"""Record/replay of upstream HTTP traffic ("cassettes").
+
+A Cassette is a JSON file of request/response pairs keyed by a normalized
+request: upstream name, method, URL path, sorted query and canonical JSON
+body. Headers (API keys, user agents) and a few volatile parameters are left
+out of the key, so a recording made against the real APIs replays wherever
+the base URLs point.
+
+Two hooks put a cassette under the existing clients:
+
+- CassetteAdapter wraps the requests adapter of a pooled UpstreamClient
+  (Nominatim, OpenRouter, hospital websites).
+- CassetteTransport is an httpx transport for the OpenAI SDK client;
+  AsyncCassetteTransport does the same for the async clients of the ASGI app.
+
+Modes: "record" always calls upstream and stores the response, "replay"
+only serves stored responses (a miss is a connection error), "auto" replays
+what it has and records the rest. Replay sleeps for the recorded latency or,
+with latency="zero", not at all. Identical requests recorded several times
+replay in order, the last one repeating.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:  # recent OpenAI SDKs are built on the httpx2 fork; use whichever the SDK uses
+    import httpx2 as httpx
+except ImportError:
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+
+MODES = ("record", "replay", "auto")
+FORMAT_VERSION = 1
+# Query/body fields that vary between otherwise identical requests
+VOLATILE_FIELDS = frozenset({"email", "user", "stream_options"})
+# Stored bodies are decoded, so these would describe the wrong bytes on replay
+_DROP_HEADERS = frozenset({"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"})
+
+
+def _canonical_body(body):
+    if body is None or body == b"" or body == "":
+        return None
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return {"sha256": hashlib.sha256(body).hexdigest()}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if k not in VOLATILE_FIELDS}
+    return data
+
+
+def request_key(upstream, method, url, body=None):
+    """Stable key for a request, independent of host, headers and field order."""
+    parts = urlsplit(str(url))
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in VOLATILE_FIELDS)
+    raw = json.dumps(
+        [upstream, method.upper(), parts.path, query, _canonical_body(body)], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _encode_body(content):
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body": base64.b64encode(content).decode("ascii"), "body_encoding": "base64"}
+
+
+def _decode_body(entry):
+    if entry.get("body_encoding") == "base64":
+        return base64.b64decode(entry["body"])
+    return entry["body"].encode("utf-8")
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette:
+    def __init__(self, path, mode="replay", latency="recorded"):
+        if mode not in MODES:
+            raise ValueError(f"cassette mode must be one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = latency != "zero"
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [interaction, ...] in recorded order
+        self._cursor = {}  # key -> next index to replay
+        self.hits = self.misses = self.recorded = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+            for entry in data.get("interactions", []):
+                self._entries.setdefault(entry["key"], []).append(entry)
+        elif mode == "replay":
+            raise FileNotFoundError(f"cassette not found: {path}")
+
+    @property
+    def records(self):
+        return self.mode in ("record", "auto")
+
+    def lookup(self, key, wait=True):
+        """Next stored response for key (sleeping for its latency unless wait=False), or None."""
+        if self.mode == "record":
+            return None
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            entry = entries[min(i, len(entries) - 1)]
+            self.hits += 1
+        if wait and self.replay_latency and entry.get("elapsed"):
+            time.sleep(entry["elapsed"])
+        return entry
+
+    async def lookup_async(self, key):
+        """lookup() for the event loop: the recorded latency is awaited, not slept."""
+        entry = self.lookup(key, wait=False)
+        if entry is not None and self.replay_latency and entry.get("elapsed"):
+            await asyncio.sleep(entry["elapsed"])
+        return entry
+
+    def miss(self, upstream, method, url):
+        return CassetteMiss(f"no cassette entry for {upstream} {method} {urlsplit(str(url)).path}")
+
+    def add(self, key, upstream, method, url, status, headers, content, elapsed):
+        parts = urlsplit(str(url))
+        entry = {
+            "key": key,
+            "upstream": upstream,
+            "request": {"method": method.upper(), "path": parts.path, "query": parts.query},
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS},
+            "elapsed": round(elapsed, 4),
+            **_encode_body(content),
+        }
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self.recorded += 1
+            self._save()
+
+    def _save(self):
+        # Written through on every new interaction so an interrupted run keeps its recording
+        interactions = [e for entries in self._entries.values() for e in entries]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".cassette-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump({"version": FORMAT_VERSION, "interactions": interactions}, fh, indent=1)
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "mode": self.mode,
+                "entries": sum(len(e) for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+            }
+
+
+class CassetteAdapter(BaseAdapter):
+    """requests adapter that records or replays through a cassette, delegating to `inner`."""
+
+    def __init__(self, cassette, upstream, inner):
+        super().__init__()
+        self.cassette = cassette
+        self.upstream = upstream
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        key = request_key(self.upstream, request.method, request.url, request.body)
+        entry = self.cassette.lookup(key)
+        if entry is not None:
+            return self._build_response(request, entry)
+        if not self.cassette.records:
+            raise requests.ConnectionError(self.cassette.miss(self.upstream, request.method, request.url), request=request)
+        start = time.perf_counter()
+        resp = self.inner.send(request, **kwargs)
+        content = resp.content  # reads (and releases) the body
+        self.cassette.add(
+            key, self.upstream, request.method, request.url, resp.status_code, resp.headers, content,
+            time.perf_counter() - start,
+        )
+        return resp
+
+    def _build_response(self, request, entry):
+        resp = requests.Response()
+        resp.status_code = entry["status"]
+        resp.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        resp._content = _decode_body(entry)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.reason = "Replayed"
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self):
+        self.inner.close()
+
+
+def install_requests(cassette, upstream_client):
+    """Route a pooled UpstreamClient's session through the cassette."""
+    adapter = CassetteAdapter(cassette, upstream_client.name, upstream_client.adapter)
+    upstream_client.session.mount("http://", adapter)
+    upstream_client.session.mount("https://", adapter)
+    return adapter
+
+
+if httpx is not None:
+
+    class CassetteTransport(httpx.BaseTransport):
+        """httpx transport that records or replays through a cassette."""
+
+        def __init__(self, cassette, upstream="openai", inner=None):
+            self.cassette = cassette
+            self.upstream = upstream
+            self.inner = inner or httpx.HTTPTransport()
+
+        def handle_request(self, request):
+            body = request.read()
+            key = request_key(self.upstream, request.method, request.url, body)
+            entry = self.cassette.lookup(key)
+            if entry is not None:
+                return httpx.Response(
+                    entry["status"], headers=entry.get("headers") or {}, content=_decode_body(entry), request=request
+                )
+            if not self.cassette.records:
+                raise httpx.ConnectError(str(self.cassette.miss(self.upstream, request.method, request.url)), request=request)
+            start = time.perf_counter()
+            resp = self.inner.handle_request(request)
+            try:
+                content = resp.read()  # streamed replies are recorded whole and replayed as one chunk
+            finally:
+                resp.close()
+            headers = {k: v for k, v in resp.headers.items() if k.lower() not in _DROP_HEADERS}
+            self.cassette.add(
+                key, self.upstream, request.method, request.url, resp.status_code, headers, content,
+                time.perf_counter() - start,
+            )
+            return httpx.Response(resp.status_code, headers=headers, content=content, request=request)
+
+        def close(self):
+            self.inner.close()
+
+    def httpx_client(cassette, upstream="openai"):
+        """httpx client for the OpenAI SDK (OpenAI(http_client=...))."""
+        return httpx.Client(transport=CassetteTransport(cassette, upstream))
+
+    class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+        """Async httpx transport that records or replays through a cassette."""
+
+        def __init__(self, cassette, upstream="openai", inner=None):
+            self.cassette = cassette
+            self.upstream = upstream
+            self.inner = inner or httpx.AsyncHTTPTransport()
+
+        async def handle_async_request(self, request):
+            body = await request.aread()
+            key = request_key(self.upstream, request.method, request.url, body)
+            entry = await self.cassette.lookup_async(key)
+            if entry is not None:
+                return httpx.Response(
+                    entry["status"], headers=entry.get("headers") or {}, content=_decode_body(entry), request=request
+                )
+            if not self.cassette.records:
+                raise httpx.ConnectError(str(self.cassette.miss(self.upstream, request.method, request.url)), request=request)
+            start = time.perf_counter()
+            resp = await self.inner.handle_async_request(request)
+            try:
+                content = await resp.aread()
+            finally:
+                await resp.aclose()
+            headers = {k: v for k, v in resp.headers.items() if k.lower() not in _DROP_HEADERS}
+            self.cassette.add(
+                key, self.upstream, request.method, request.url, resp.status_code, headers, content,
+                time.perf_counter() - start,
+            )
+            return httpx.Response(resp.status_code, headers=headers, content=content, request=request)
+
+        async def aclose(self):
+            await self.inner.aclose()
+
+    def async_httpx_client(cassette, upstream="openai"):
+        """Async httpx client for AsyncOpenAI(http_client=...)."""
+        return httpx.AsyncClient(transport=AsyncCassetteTransport(cassette, upstream))
@@ -0,0 +1,347 @@
+"""Offline geocoding from a local gazetteer.
+
+Loads US Census Gazetteer files (ZCTA/ZIP centroids, places, counties;
+tab-separated with INTPTLAT/INTPTLONG columns, optionally zipped) or a plain
+CSV with kind,name,state,lat,lon[,weight] columns. Points live in flat
+array('d') buffers:
+
+- reverse(): nearest named place (then county) via an implicit KD-tree over
+  unit-sphere coordinates, so there is no dateline/pole special-casing.
+- forward(): exact ZIP, then exact / prefix name match via bisect over a
+  sorted name index, then a difflib fuzzy match; an optional state narrows
+  and ranks candidates. Only bare localities and ZIPs are answered: a query
+  with a street part would otherwise get its town's centroid.
+
+Both return None on a miss so callers can fall back to Nominatim.
+"""
+import bisect
+import csv
+import difflib
+import io
+import math
+import os
+import re
+import zipfile
+from array import array
+
+EARTH_RADIUS_KM = 6371.0
+
+KIND_ZIP = "zip"
+KIND_PLACE = "place"
+KIND_COUNTY = "county"
+REVERSE_KINDS = (KIND_PLACE, KIND_COUNTY)
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming", "PR": "Puerto Rico",
+}
+_STATE_BY_NAME = {name.lower(): abbr for abbr, name in US_STATES.items()}
+
+# Census place names carry their legal/statistical area type as a suffix
+_PLACE_SUFFIX_RE = re.compile(
+    r"\s+(city|town|village|borough|CDP|municipality|city and borough|"
+    r"consolidated government|metro government|unified government|urban county)"
+    r"(\s*\(balance\))?$",
+    re.IGNORECASE,
+)
+_ZIP_RE = re.compile(r"\b(\d{5})(?:-\d{4})?\b")
+# "55 Fruit St", "1 Main Street": a house number followed by more words
+_STREET_RE = re.compile(r"^\s*\d+[a-z]?(?:-\d+)?\s+\S", re.IGNORECASE)
+
+
+def normalize_name(name):
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", (name or "").lower().replace("saint ", "st ")).split())
+
+
+def _unit_vector(lat, lon):
+    p, l = math.radians(lat), math.radians(lon)
+    return math.cos(p) * math.cos(l), math.cos(p) * math.sin(l), math.sin(p)
+
+
+def _chord_to_km(chord_sq):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+def _km_to_chord_sq(km):
+    return (2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)) ** 2
+
+
+class _KDTree:
+    """Balanced KD-tree stored implicitly: the median of each range is its node."""
+
+    def __init__(self, points):
+        # points: list of (x, y, z, entry_index)
+        pts = list(points)
+        self._build(pts, 0, len(pts), 0)
+        self.xs = array("d", (p[0] for p in pts))
+        self.ys = array("d", (p[1] for p in pts))
+        self.zs = array("d", (p[2] for p in pts))
+        self.ids = array("l", (p[3] for p in pts))
+
+    def _build(self, pts, lo, hi, depth):
+        stack = [(lo, hi, depth)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= 1:
+                continue
+            axis = depth % 3
+            pts[lo:hi] = sorted(pts[lo:hi], key=lambda p: p[axis])
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, x, y, z, max_chord_sq=4.0):
+        """(entry_index, chord_sq) of the closest point within max_chord_sq, else None."""
+        xs, ys, zs = self.xs, self.ys, self.zs
+        q = (x, y, z)
+        best, best_d = -1, max_chord_sq
+        stack = [(0, len(self.ids), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            dx, dy, dz = xs[mid] - x, ys[mid] - y, zs[mid] - z
+            d = dx * dx + dy * dy + dz * dz
+            if d < best_d:
+                best, best_d = mid, d
+            axis = depth % 3
+            diff = q[axis] - (xs, ys, zs)[axis][mid]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # Far side pushed first so the near side is searched first
+            if diff * diff < best_d:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        if best < 0:
+            return None
+        return self.ids[best], best_d
+
+
+class Gazetteer:
+    def __init__(self):
+        self.kinds = []
+        self.names = []
+        self.states = []
+        self.lats = array("d")
+        self.lons = array("d")
+        self.weights = array("d")
+        self._trees = {}
+        self._zips = {}
+        self._name_keys = []  # sorted (normalized name, entry_index)
+        self._by_initial = {}  # first letter -> distinct normalized names, for fuzzy matching
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_files(cls, paths):
+        gaz = cls()
+        for path in paths:
+            gaz.load(path)
+        gaz.build()
+        return gaz
+
+    def add(self, kind, name, state, lat, lon, weight=0.0):
+        self.kinds.append(kind)
+        self.names.append(name)
+        self.states.append(state)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.weights.append(weight)
+
+    def load(self, path):
+        """Add every row of a gazetteer file (.txt/.tsv/.csv, or a .zip of one)."""
+        if path.lower().endswith(".zip"):
+            with zipfile.ZipFile(path) as zf:
+                for member in zf.namelist():
+                    if member.lower().endswith((".txt", ".tsv", ".csv")):
+                        with zf.open(member) as fh:
+                            text = io.TextIOWrapper(fh, encoding="utf-8", errors="replace")
+                            self._load_rows(text, member)
+            return
+        with open(path, encoding="utf-8", errors="replace", newline="") as fh:
+            self._load_rows(fh, path)
+
+    def _load_rows(self, fh, source):
+        first = fh.readline()
+        delimiter = "\t" if "\t" in first else ","
+        header = [h.strip().upper() for h in next(csv.reader([first], delimiter=delimiter))]
+        reader = csv.reader(fh, delimiter=delimiter)
+        if "INTPTLAT" in header:
+            self._load_census(reader, header, os.path.basename(source).lower())
+        else:
+            self._load_generic(reader, header)
+
+    def _load_census(self, reader, header, filename):
+        col = {h: i for i, h in enumerate(header)}
+        lat_i, lon_i = col["INTPTLAT"], col.get("INTPTLONG", col.get("INTPTLON"))
+        name_i, state_i, geoid_i = col.get("NAME"), col.get("USPS"), col.get("GEOID")
+        land_i = col.get("ALAND_SQMI")
+        for row in reader:
+            try:
+                lat, lon = float(row[lat_i]), float(row[lon_i])
+            except (ValueError, IndexError):
+                continue
+            geoid = row[geoid_i].strip() if geoid_i is not None else ""
+            weight = float(row[land_i] or 0) if land_i is not None and row[land_i].strip() else 0.0
+            if name_i is None or "zcta" in filename:
+                self.add(KIND_ZIP, geoid[-5:], None, lat, lon, weight)
+                continue
+            name = row[name_i].strip()
+            state = row[state_i].strip() if state_i is not None else None
+            if "count" in filename or (len(geoid) == 5 and "place" not in filename):
+                self.add(KIND_COUNTY, name, state, lat, lon, weight)
+            else:
+                self.add(KIND_PLACE, _PLACE_SUFFIX_RE.sub("", name), state, lat, lon, weight)
+
+    def _load_generic(self, reader, header):
+        col = {h.lower(): i for i, h in enumerate(header)}
+        for row in reader:
+            try:
+                lat, lon = float(row[col["lat"]]), float(row[col["lon"]])
+            except (ValueError, IndexError, KeyError):
+                continue
+            kind = row[col["kind"]].strip().lower() if "kind" in col else KIND_PLACE
+            state = row[col["state"]].strip().upper() if "state" in col and row[col["state"]].strip() else None
+            weight = float(row[col["weight"]] or 0) if "weight" in col else 0.0
+            self.add(kind, row[col["name"]].strip(), state, lat, lon, weight)
+
+    def build(self):
+        """Index everything added so far; call once after loading."""
+        points = {kind: [] for kind in REVERSE_KINDS}
+        keys = []
+        for i, kind in enumerate(self.kinds):
+            if kind == KIND_ZIP:
+                self._zips.setdefault(self.names[i], i)
+                continue
+            if kind in points:
+                points[kind].append((*_unit_vector(self.lats[i], self.lons[i]), i))
+            key = normalize_name(self.names[i])
+            if key:
+                keys.append((key, i))
+        self._trees = {kind: _KDTree(pts) for kind, pts in points.items() if pts}
+        keys.sort()
+        self._name_keys = keys
+        self._by_initial = {}
+        for key, _ in keys:
+            names = self._by_initial.setdefault(key[0], [])
+            if not names or names[-1] != key:
+                names.append(key)
+
+    def _entry(self, i, distance_km=None):
+        out = {
+            "kind": self.kinds[i],
+            "name": self.names[i],
+            "state": self.states[i],
+            "lat": self.lats[i],
+            "lon": self.lons[i],
+        }
+        if distance_km is not None:
+            out["distance_km"] = round(distance_km, 3)
+        return out
+
+    def nearest(self, lat, lon, kind, max_km=25.0):
+        tree = self._trees.get(kind)
+        if tree is None:
+            return None
+        hit = tree.nearest(*_unit_vector(lat, lon), max_chord_sq=_km_to_chord_sq(max_km))
+        if hit is None:
+            return None
+        return self._entry(hit[0], _chord_to_km(hit[1]))
+
+    def reverse(self, lat, lon, max_km=25.0):
+        """Closest named place (then county) within max_km, as a reverse_geocode-style dict."""
+        for kind in REVERSE_KINDS:
+            hit = self.nearest(lat, lon, kind, max_km)
+            if hit:
+                state = US_STATES.get(hit["state"] or "", hit["state"])
+                country = "United States" if hit["state"] in US_STATES else None
+                parts = [p for p in (hit["name"], state, country) if p]
+                return {"city": hit["name"], "state": state, "country": country, "label": ", ".join(parts)}
+        return None
+
+    @staticmethod
+    def _state_abbr(text):
+        return _STATE_BY_NAME.get(text) or (text.upper() if text.upper() in US_STATES else None)
+
+    def _split_state(self, query):
+        """Peel a trailing US state (abbr or name) off a normalized query."""
+        words = query.split()
+        for n in (3, 2, 1):
+            if len(words) > n:
+                abbr = self._state_abbr(" ".join(words[-n:]))
+                if abbr:
+                    return " ".join(words[:-n]), abbr
+        return query, None
+
+    def _candidates(self, key):
+        lo = bisect.bisect_left(self._name_keys, (key, -1))
+        exact, prefix = [], []
+        for name, i in self._name_keys[lo:lo + 200]:
+            if name == key:
+                exact.append(i)
+            elif name.startswith(key + " ") or (len(key) >= 4 and name.startswith(key)):
+                prefix.append(i)
+            else:
+                break
+        return exact, prefix
+
+    def _best(self, idxs, state):
+        if state:
+            in_state = [i for i in idxs if self.states[i] == state]
+            if in_state:
+                idxs = in_state
+            elif any(self.states[i] for i in idxs):
+                return None
+        # Places before counties, then the largest by land area
+        return max(idxs, key=lambda i: (self.kinds[i] == KIND_PLACE, self.weights[i]))
+
+    def forward(self, query, fuzzy_cutoff=0.88):
+        """(lat, lon) for a ZIP, "City, ST" or "City" query, or None when unsure or street-level."""
+        if not query:
+            return None
+        segments = [s for s in (normalize_name(_ZIP_RE.sub(" ", s)) for s in query.split(",")) if s]
+        state = None
+        if len(segments) > 1:
+            state = self._state_abbr(segments[-1])
+            if state:
+                segments.pop()
+        # "55 Fruit St, Boston, MA 02114" needs a real geocoder, not Boston's centroid
+        if len(segments) > 1 or (segments and _STREET_RE.match(segments[0])):
+            return None
+        m = _ZIP_RE.search(query)
+        if m and m.group(1) in self._zips:
+            i = self._zips[m.group(1)]
+            return self.lats[i], self.lons[i]
+        if not segments:
+            return None
+        key, trailing_state = self._split_state(segments[-1])
+        state = state or trailing_state
+        if not key:
+            return None
+        exact, prefix = self._candidates(key)
+        best = self._best(exact, state) if exact else None
+        if best is None and prefix:
+            best = self._best(prefix, state)
+        if best is None and len(key) >= 4:
+            pool = [n for n in self._by_initial.get(key[0], ()) if abs(len(n) - len(key)) <= 2]
+            close = difflib.get_close_matches(key, pool, n=3, cutoff=fuzzy_cutoff)
+            for name in close:
+                best = self._best(self._candidates(name)[0], state)
+                if best is not None:
+                    break
+        if best is None:
+            return None
+        return self.lats[best], self.lons[best]
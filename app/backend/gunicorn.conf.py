@@ -0,0 +1,46 @@
+"""Gunicorn settings for the Flask app.
+
+    gunicorn -c app/backend/gunicorn.conf.py
+
+Workers import the app themselves (no preload: server.py opens SQLite
+connections that must belong to the worker). Right after fork, each worker
+starts its background services (upload sweeper, job consumers, gazetteer)
+and server.warm_up() in a background thread unless
+WARM_UP=0, so /health answers as soon as the app is imported and the first
+analysis doesn't pay for pdfplumber, the OpenAI SDK, the tokenizer or the
+bundled policies.
+
+Without JOB_QUEUE_URL the dispute job queue lives in one process, so the
+default is a single worker; server refuses to start with more (the worker
+count is exported as WEB_CONCURRENCY) until JOB_QUEUE_URL points at Redis.
+"""
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "server:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+_shared_jobs = os.getenv("JOB_QUEUE_URL", "").startswith(("redis://", "rediss://", "unix://"))
+workers = int(os.getenv("WEB_CONCURRENCY", "2" if _shared_jobs else "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Model calls and long PDFs run well past gunicorn's 30 s default
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+
+
+def on_starting(arbiter):
+    # Includes --workers from the command line; read by server's job queue setup
+    os.environ["WEB_CONCURRENCY"] = str(arbiter.cfg.workers)
+
+
+def post_fork(arbiter, worker):
+    import server
+
+    server.start_background_services()
+    server.start_warm_up()
+
+
+def child_exit(arbiter, worker):
+    # Drop a dead worker's live gauges from the shared /metrics files
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
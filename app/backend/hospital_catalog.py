@@ -0,0 +1,213 @@
+"""Local catalog of hospitals and their per-condition prices.
+
+Every cleaned hospital result is upserted here, deduplicated by normalized
+name + address. Hospitals are indexed by geohash cell and prices by
+normalized condition, so a search near a point can be answered from SQLite
+without calling the model when enough fresh records exist:
+
+- hospitals: one row per hospital (contact details, coordinates, geohash).
+- prices: one row per (hospital, condition), with its own updated_at.
+
+Radius queries enumerate the geohash cells covering the bounding box and
+scan each as an index range; exact distances are left to the caller.
+"""
+import hashlib
+import math
+import re
+import time
+
+from sqlite_store import SqliteStore
+
+GEOHASH_PRECISION = 6  # ~1.2 km x 0.6 km cells
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_MAX_QUERY_CELLS = 48
+
+_ADDRESS_ABBREVIATIONS = {
+    "street": "st", "avenue": "ave", "road": "rd", "boulevard": "blvd", "drive": "dr",
+    "lane": "ln", "place": "pl", "court": "ct", "parkway": "pkwy", "highway": "hwy",
+    "suite": "ste", "north": "n", "south": "s", "east": "e", "west": "w",
+}
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            ch = (ch << 1) | (lon >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if lon >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            ch = (ch << 1) | (lat >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if lat >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+
+def _cell_size(precision):
+    """(height, width) in degrees of a geohash cell at this precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(lat, lon, radius_miles):
+    """Geohash prefixes whose cells cover the radius' bounding box, as coarse as needed."""
+    dlat = radius_miles / 69.0
+    dlon = radius_miles / max(1e-6, 69.0 * math.cos(math.radians(lat)))
+    south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    west, east = max(-180.0, lon - dlon), min(180.0, lon + dlon)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        h, w = _cell_size(precision)
+        if (math.ceil((north - south) / h) + 1) * (math.ceil((east - west) / w) + 1) > _MAX_QUERY_CELLS:
+            continue
+        cells = set()
+        y = south
+        while True:
+            x = west
+            while True:
+                cells.add(geohash_encode(min(y, 89.999999), min(x, 179.999999), precision))
+                if x >= east:
+                    break
+                x = min(east, x + w)
+            if y >= north:
+                break
+            y = min(north, y + h)
+        return sorted(cells)
+    return [""]  # radius spans most of the globe
+
+
+def normalize_condition(condition):
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", (condition or "").lower()).split())
+
+
+def _normalize_name(name):
+    words = re.sub(r"[^a-z0-9 ]", " ", (name or "").lower().replace("&", " and ")).split()
+    words = ["st" if w == "saint" else w for w in words if w != "the"]
+    return " ".join(words)
+
+
+def _normalize_address(address):
+    # Street part only: "55 Fruit Street, Boston, MA" and "55 Fruit St" are the same place
+    street = (address or "").split(",")[0].lower()
+    words = re.sub(r"[^a-z0-9 ]", " ", street).split()
+    return " ".join(_ADDRESS_ABBREVIATIONS.get(w, w) for w in words)
+
+
+def record_key(name, address):
+    raw = f"{_normalize_name(name)}|{_normalize_address(address)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _coord(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class HospitalCatalog(SqliteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS hospitals ("
+            "id TEXT PRIMARY KEY, name TEXT NOT NULL, address TEXT, phone TEXT, url TEXT, "
+            "url_status TEXT, latitude REAL, longitude REAL, geohash TEXT, locality TEXT, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS hospitals_geohash ON hospitals (geohash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS hospitals_locality ON hospitals (locality)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS prices ("
+            "hospital_id TEXT NOT NULL, condition TEXT NOT NULL, price_usd REAL, "
+            "price_is_estimate INTEGER NOT NULL, notes TEXT, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (condition, hospital_id))"
+        )
+
+    def upsert(self, records, condition):
+        """Insert or refresh hospital records and their price for this condition."""
+        cond = normalize_condition(condition)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for r in records:
+                lat, lon = _coord(r.get("latitude")), _coord(r.get("longitude"))
+                key = record_key(r["name"], r.get("address"))
+                # Keep known details when a newer result omits them
+                conn.execute(
+                    "INSERT INTO hospitals (id, name, address, phone, url, url_status, latitude, longitude, "
+                    "geohash, locality, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET name = excluded.name, "
+                    "address = COALESCE(excluded.address, address), phone = COALESCE(excluded.phone, phone), "
+                    "url = COALESCE(excluded.url, url), url_status = COALESCE(excluded.url_status, url_status), "
+                    "latitude = COALESCE(excluded.latitude, latitude), longitude = COALESCE(excluded.longitude, longitude), "
+                    "geohash = COALESCE(excluded.geohash, geohash), locality = excluded.locality, "
+                    "updated_at = excluded.updated_at",
+                    (
+                        key, r["name"], r.get("address"), r.get("phone"), r.get("url"), r.get("url_status"),
+                        lat, lon, geohash_encode(lat, lon) if lat is not None and lon is not None else None,
+                        r.get("source_locality"), now,
+                    ),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO prices (hospital_id, condition, price_usd, price_is_estimate, notes, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, cond, r.get("price_usd"), int(bool(r.get("price_is_estimate", True))), r.get("notes"), now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def search(self, lat, lon, radius_miles, condition, max_age, locality=None):
+        """Fresh records for the condition in cells covering the radius (plus, for
+        hospitals without coordinates, those recorded under the same locality).
+
+        Rows are shaped like cleaned hospital results; distances are not computed.
+        """
+        cond = normalize_condition(condition)
+        cutoff = time.time() - max_age
+        cells = covering_cells(lat, lon, radius_miles)
+        ranges = " OR ".join("(h.geohash >= ? AND h.geohash < ?)" for _ in cells)
+        params = [cond, cutoff]
+        for cell in cells:
+            params.extend([cell, cell + "~"])
+        where = f"({ranges})"
+        if locality:
+            where = f"({where} OR (h.geohash IS NULL AND h.locality = ?))"
+            params.append(locality)
+        rows = self._conn().execute(
+            "SELECT h.name, h.address, h.phone, h.url, h.url_status, h.latitude, h.longitude, "
+            "h.locality, p.price_usd, p.price_is_estimate, p.notes "
+            "FROM prices p JOIN hospitals h ON h.id = p.hospital_id "
+            f"WHERE p.condition = ? AND p.updated_at >= ? AND {where}",
+            params,
+        ).fetchall()
+        return [
+            {
+                "name": row[0],
+                "address": row[1],
+                "phone": row[2],
+                "url": row[3],
+                "url_status": row[4],
+                "latitude": row[5],
+                "longitude": row[6],
+                "distance_miles": None,
+                "price_usd": row[8],
+                "price_is_estimate": bool(row[9]),
+                "notes": row[10],
+                "maps_url": None,
+                "source_locality": row[7],
+            }
+            for row in rows
+        ]
+
+    def purge(self, max_age):
+        """Drop prices older than max_age and hospitals left without any price."""
+        conn = self._conn()
+        conn.execute("DELETE FROM prices WHERE updated_at < ?", (time.time() - max_age,))
+        conn.execute("DELETE FROM hospitals WHERE id NOT IN (SELECT hospital_id FROM prices)")
@@ -0,0 +1,197 @@
+"""Pooled HTTP clients for upstream APIs.
+
+One requests.Session per upstream keeps TCP/TLS connections alive between
+calls (per-host pools sized by pool_maxsize) and retries 429/5xx responses
+and failed connections with exponential, jittered backoff that honours
+Retry-After; read timeouts are retried only for idempotent methods. Each client
+records request latency and how often a pooled connection was reused, so we
+can see whether keep-alive is actually working.
+
+requests (and the session) are loaded on a client's first request, so
+importing this module and creating clients at startup costs nothing.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# A read timeout or dropped response on anything else may already have been
+# processed (and billed) upstream, so those only retry statuses and connects
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class UpstreamClient:
+    def __init__(
+        self,
+        name,
+        pool_connections=10,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        retries=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        retry_methods=("GET", "HEAD", "OPTIONS"),
+        headers=None,
+    ):
+        self.name = name
+        self._config = dict(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            retries=retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            retry_methods=retry_methods,
+            headers=headers,
+        )
+        self._session = None
+        self._adapter = None
+        self._session_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=2048)
+        self.requests = 0
+        self.errors = 0
+        self.status_errors = 0
+
+    def _build(self):
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        c = self._config
+        idempotent = frozenset(m.upper() for m in c["retry_methods"]) <= IDEMPOTENT_METHODS
+        retry = Retry(
+            total=c["retries"],
+            connect=c["retries"],
+            read=c["retries"] if idempotent else 0,
+            other=None if idempotent else 0,
+            status=c["retries"],
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(c["retry_methods"]),
+            backoff_factor=c["backoff_factor"],
+            backoff_jitter=c["backoff_jitter"],
+            respect_retry_after_header=True,
+            raise_on_status=False,  # hand the final 429/5xx back to the caller
+        )
+        adapter = HTTPAdapter(
+            pool_connections=c["pool_connections"], pool_maxsize=c["pool_maxsize"], max_retries=retry
+        )
+        session = Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if c["headers"]:
+            session.headers.update(c["headers"])
+        self._adapter = adapter
+        self._session = session
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._build()
+        return self._session
+
+    @property
+    def adapter(self):
+        self.session  # built together with the session
+        return self._adapter
+
+    def request(self, method, url, **kwargs):
+        import requests
+
+        session = self.session
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            with self._lock:
+                self.requests += 1
+                self.errors += 1
+                self._latencies.append(time.perf_counter() - start)
+            metrics.upstream_error(self.name, e)
+            raise
+        with self._lock:
+            self.requests += 1
+            if resp.status_code >= 400:
+                self.status_errors += 1
+            self._latencies.append(time.perf_counter() - start)
+        if resp.status_code >= 400:
+            metrics.upstream_error(self.name, status=resp.status_code)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def _connection_counts(self):
+        opened = 0
+        used = 0
+        if self._adapter is None:
+            return opened, used
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)  # None if evicted meanwhile
+            if pool is not None:
+                opened += pool.num_connections
+                used += pool.num_requests
+        return opened, used
+
+    def stats(self):
+        with self._lock:
+            lat = sorted(self._latencies)
+            requests_total, errors, status_errors = self.requests, self.errors, self.status_errors
+        # urllib3 counts every attempt, including retries, on the pools
+        opened, attempts = self._connection_counts()
+        return {
+            "requests": requests_total,
+            "errors": errors,
+            "status_errors": status_errors,
+            "retries": max(0, attempts - requests_total),
+            "connections_opened": opened,
+            "connections_reused": max(0, attempts - opened),
+            "latency_ms": {
+                "p50": round(_percentile(lat, 50) * 1000, 1) if lat else None,
+                "p95": round(_percentile(lat, 95) * 1000, 1) if lat else None,
+                "max": round(lat[-1] * 1000, 1) if lat else None,
+                "samples": len(lat),
+            },
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name, **kwargs):
+    """Process-wide client for an upstream, created on first use."""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = UpstreamClient(name, **kwargs)
+        return client
+
+
+def all_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {c.name: c.stats() for c in clients}
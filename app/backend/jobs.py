@@ -0,0 +1,393 @@
+"""Background job queue for long-running pipelines (dispute analysis).
+
+Handlers are registered by name and receive (params, progress), where
+progress(stage) appends a progress event to the job. Two backends implement
+the same JobQueue interface:
+
+- InMemoryJobQueue: bounded thread pool, state held in this process.
+- RedisJobQueue: jobs and events live in a Redis-compatible server, so any
+  worker process can accept, run, or report on any job. A running job holds
+  a lease its worker keeps renewing; if the worker dies, the job is put back
+  on the queue (up to max_attempts runs) instead of staying "running".
+
+create_job_queue() picks the backend from a URL (redis://... or memory://).
+The in-memory backend only works with a single server process.
+"""
+import abc
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the pending-job bound is reached."""
+
+
+class JobError(Exception):
+    """A handler failure carrying the HTTP status the API should report."""
+
+    def __init__(self, message, http_status=500):
+        super().__init__(message)
+        self.message = message
+        self.http_status = http_status
+
+
+class JobQueue(abc.ABC):
+    """Interface shared by the job queue backends."""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    @abc.abstractmethod
+    def submit(self, kind, params):
+        """Queue a job and return its id; raises QueueFull when saturated."""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """Job status dict, or None if unknown/expired."""
+
+    @abc.abstractmethod
+    def get_result(self, job_id):
+        """The handler's return value once the job succeeded, else None."""
+
+    @abc.abstractmethod
+    def wait(self, job_id, after=0, timeout=15.0):
+        """Block up to timeout for events with seq > after; returns a (possibly empty) list."""
+
+    def start(self):
+        """Start any consumer threads; submit() works before this, jobs just wait."""
+
+    def shutdown(self):
+        pass
+
+    @abc.abstractmethod
+    def _set_status(self, job_id, status, stage):
+        pass
+
+    @abc.abstractmethod
+    def _add_event(self, job_id, stage):
+        pass
+
+    @abc.abstractmethod
+    def _succeed(self, job_id, result):
+        pass
+
+    @abc.abstractmethod
+    def _fail(self, job_id, message, http_status):
+        pass
+
+    def _run(self, job_id, kind, params):
+        self._set_status(job_id, "running", "started")
+        try:
+            result = self.handlers[kind](params, lambda stage: self._add_event(job_id, stage))
+        except JobError as e:
+            self._fail(job_id, e.message, e.http_status)
+        except Exception as e:
+            self._fail(job_id, f"{type(e).__name__}: {e}", 500)
+        else:
+            self._succeed(job_id, result)
+
+
+def _new_job(job_id, kind):
+    now = time.time()
+    return {
+        "id": job_id,
+        "kind": kind,
+        "status": "queued",
+        "stage": "queued",
+        "error": None,
+        "http_status": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class InMemoryJobQueue(JobQueue):
+    def __init__(self, workers=4, max_pending=64, ttl_seconds=3600):
+        super().__init__()
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._events = {}
+        self._results = {}
+        self._order = deque()
+        self._active = 0
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        with self._cond:
+            self._expire()
+            if self._active >= self.max_pending:
+                raise QueueFull(f"{self._active} jobs pending")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = _new_job(job_id, kind)
+            self._events[job_id] = [{"seq": 1, "stage": "queued", "status": "queued", "at": time.time()}]
+            self._order.append(job_id)
+            self._active += 1
+        self._executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_result(self, job_id):
+        with self._cond:
+            return self._results.get(job_id)
+
+    def wait(self, job_id, after=0, timeout=15.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = [e for e in self._events.get(job_id, ()) if e["seq"] > after]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0 or job_id not in self._jobs:
+                    return events
+                self._cond.wait(remaining)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        while self._order:
+            job = self._jobs.get(self._order[0])
+            if job and (job["status"] not in TERMINAL_STATUSES or job["updated_at"] > cutoff):
+                break
+            job_id = self._order.popleft()
+            self._jobs.pop(job_id, None)
+            self._events.pop(job_id, None)
+            self._results.pop(job_id, None)
+
+    def _append(self, job_id, stage, **changes):
+        with self._cond:
+            job = self._jobs[job_id]
+            job.update(changes, stage=stage, updated_at=time.time())
+            events = self._events[job_id]
+            events.append({"seq": len(events) + 1, "stage": stage, "status": job["status"], "at": job["updated_at"]})
+            self._cond.notify_all()
+
+    def _set_status(self, job_id, status, stage):
+        self._append(job_id, stage, status=status)
+
+    def _add_event(self, job_id, stage):
+        self._append(job_id, stage)
+
+    def _succeed(self, job_id, result):
+        with self._cond:
+            self._results[job_id] = result
+            self._active -= 1
+        self._append(job_id, "done", status="succeeded")
+
+    def _fail(self, job_id, message, http_status):
+        with self._cond:
+            self._active -= 1
+        self._append(job_id, "failed", status="failed", error=message, http_status=http_status)
+
+
+class RedisJobQueue(JobQueue):
+    """Jobs in a Redis-compatible server; every process runs `workers` consumer threads.
+
+    Consumers move a job from the pending list to a processing list and hold
+    a lease key on it, renewed every lease_seconds / 3. A reaper thread puts
+    jobs whose lease has lapsed back on the pending list.
+    """
+
+    def __init__(
+        self,
+        url,
+        workers=4,
+        max_pending=64,
+        ttl_seconds=3600,
+        prefix="billchill:jobs",
+        lease_seconds=60,
+        max_attempts=3,
+        client=None,
+    ):
+        super().__init__()
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._pending = f"{prefix}:pending"
+        self._processing = f"{prefix}:processing"
+        self._stop = threading.Event()
+        self._started = False
+        self._threads = [
+            threading.Thread(target=self._consume, name=f"job-{i}", daemon=True) for i in range(workers)
+        ]
+        self._threads.append(threading.Thread(target=self._reap, name="job-reaper", daemon=True))
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for t in self._threads:
+            t.start()
+
+    def _key(self, job_id, suffix=""):
+        return f"{self.prefix}:{job_id}{suffix}"
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        if self.redis.llen(self._pending) >= self.max_pending:
+            raise QueueFull("pending queue is full")
+        job_id = uuid.uuid4().hex
+        job = _new_job(job_id, kind)
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(job_id), json.dumps(job), ex=self.ttl_seconds)
+        pipe.set(self._key(job_id, ":params"), json.dumps(params), ex=self.ttl_seconds)
+        pipe.rpush(self._key(job_id, ":events"), json.dumps({"stage": "queued", "status": "queued", "at": job["created_at"]}))
+        pipe.expire(self._key(job_id, ":events"), self.ttl_seconds)
+        pipe.lpush(self._pending, job_id)
+        pipe.execute()
+        return job_id
+
+    def get(self, job_id):
+        raw = self.redis.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def get_result(self, job_id):
+        raw = self.redis.get(self._key(job_id, ":result"))
+        return json.loads(raw) if raw else None
+
+    def wait(self, job_id, after=0, timeout=15.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            raw = self.redis.lrange(self._key(job_id, ":events"), after, -1)
+            if raw or time.monotonic() >= deadline or not self.redis.exists(self._key(job_id)):
+                # An event's seq is its position in the list, so it is never raced
+                return [{**json.loads(e), "seq": after + i + 1} for i, e in enumerate(raw)]
+            time.sleep(0.25)
+
+    def shutdown(self):
+        self._stop.set()
+
+    def _consume(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self.redis.brpoplpush(self._pending, self._processing, timeout=1)
+            except Exception:
+                time.sleep(1)
+                continue
+            if not job_id:
+                continue
+            try:
+                self._claim(job_id)
+            except Exception:
+                # Left on the processing list; the reaper requeues it
+                log.warning("job %s failed outside its handler", job_id, exc_info=True)
+
+    def _claim(self, job_id):
+        lease_key = self._key(job_id, ":lease")
+        self.redis.set(lease_key, threading.current_thread().name, ex=self.lease_seconds)
+        renewing = threading.Event()
+        threading.Thread(target=self._renew, args=(lease_key, renewing), daemon=True).start()
+        try:
+            job = self.get(job_id)
+            raw_params = self.redis.get(self._key(job_id, ":params"))
+            if job and raw_params is not None and job["kind"] in self.handlers:
+                self._run(job_id, job["kind"], json.loads(raw_params))
+        finally:
+            renewing.set()
+        pipe = self.redis.pipeline()
+        pipe.lrem(self._processing, 1, job_id)
+        pipe.delete(lease_key)
+        pipe.execute()
+
+    def _renew(self, lease_key, done):
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                self.redis.expire(lease_key, self.lease_seconds)
+            except Exception:
+                log.warning("could not renew job lease %s", lease_key, exc_info=True)
+
+    def _reap(self):
+        """Requeue jobs whose worker stopped renewing the lease (crashed or killed)."""
+        while not self._stop.wait(self.lease_seconds / 2):
+            try:
+                for job_id in self.redis.lrange(self._processing, 0, -1):
+                    self._reap_one(job_id)
+            except Exception:
+                log.warning("job reaper pass failed", exc_info=True)
+
+    def _reap_one(self, job_id):
+        if self.redis.exists(self._key(job_id, ":lease")):
+            return
+        job = self.get(job_id)
+        # A consumer sets the lease right after claiming a job; skip that window
+        if job and time.time() - job["updated_at"] < self.lease_seconds:
+            return
+        if not self.redis.lrem(self._processing, 1, job_id):
+            return  # another process got there first
+        if not job or job["status"] in TERMINAL_STATUSES:
+            return
+        attempts = job.get("attempts", 1) + 1
+        if attempts > self.max_attempts:
+            log.warning("job %s lost its worker %d times; giving up", job_id, self.max_attempts)
+            self._fail(job_id, "worker lost while running the job", 500)
+            return
+        log.warning("job %s lost its worker; requeueing (attempt %d)", job_id, attempts)
+        self._append(job_id, "requeued", status="queued", attempts=attempts)
+        self.redis.lpush(self._pending, job_id)
+
+    def _append(self, job_id, stage, **changes):
+        job = self.get(job_id) or _new_job(job_id, "unknown")
+        job.update(changes, stage=stage, updated_at=time.time())
+        events_key = self._key(job_id, ":events")
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(job_id), json.dumps(job), ex=self.ttl_seconds)
+        pipe.rpush(events_key, json.dumps({"stage": stage, "status": job["status"], "at": job["updated_at"]}))
+        pipe.expire(events_key, self.ttl_seconds)
+        pipe.execute()
+
+    def _set_status(self, job_id, status, stage):
+        self._append(job_id, stage, status=status)
+
+    def _add_event(self, job_id, stage):
+        self._append(job_id, stage)
+
+    def _succeed(self, job_id, result):
+        self.redis.set(self._key(job_id, ":result"), json.dumps(result), ex=self.ttl_seconds)
+        self._append(job_id, "done", status="succeeded")
+
+    def _fail(self, job_id, message, http_status):
+        self._append(job_id, "failed", status="failed", error=message, http_status=http_status)
+
+
+def create_job_queue(url=None, workers=4, max_pending=64, ttl_seconds=3600, processes=1):
+    """Queue for `url`; `processes` is how many server processes will share it.
+
+    The in-memory backend cannot be shared: with more than one process a job
+    posted to one is unknown to the others, so that combination is refused.
+    """
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(url, workers=workers, max_pending=max_pending, ttl_seconds=ttl_seconds)
+    if processes > 1:
+        raise RuntimeError(
+            f"the in-memory job queue cannot be shared by {processes} server processes; "
+            "set JOB_QUEUE_URL=redis://... or run a single worker"
+        )
+    return InMemoryJobQueue(workers=workers, max_pending=max_pending, ttl_seconds=ttl_seconds)
@@ -0,0 +1,232 @@
+"""Structured line-item extraction from patient bills.
+
+Uses pdfplumber table extraction where the statement has a real table grid
+and falls back to parsing text lines (statement rows, bullet lists and
+numbered lists all show up in the sample bills). The same pdfplumber pass
+also yields the page text, so reading a bill parses the PDF only once.
+"""
+import re
+
+import pdf_extract
+
+_MONEY_RE = re.compile(r"(-?)\s?\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{1,2})?")
+_BARE_AMOUNT_RE = re.compile(r"^(?P<lead>\d{1,3}\s+.+?)\s+(?P<amount>\d+(?:\.\d{2})?)$")
+_DATE_RE = re.compile(r"^(\d{1,2}/\d{1,2}/\d{2,4})\s+")
+_LINE_NO_RE = re.compile(r"^(\d{1,3})\s+(?=\D)")
+_REV_CODE_RE = re.compile(r"^(0\d{3})\s+")
+_CPT_RE = re.compile(r"^(\d{5}|[A-V]\d{4})\b\s*")
+_TRAILING_CPT_RE = re.compile(r"\s(\d{5}|[A-V]\d{4})$")
+_UNITS_RE = re.compile(
+    r"\((\d+(?:\.\d+)?)\s*(?:x\s*)?(?:units?|tablets?|caps?|cups?|pairs?|nights?|days?|hours?|"
+    r"uses?|doses?|vials?)\b",
+    re.IGNORECASE,
+)
+_ITEMS_START_RE = re.compile(r"\bDESCRIPTION\b|ITEMIZED|SERVICES PROVIDED", re.IGNORECASE)
+_ADJUSTMENTS_RE = re.compile(r"ADJUSTMENTS|PAYMENTS", re.IGNORECASE)
+_TOTAL_RE = re.compile(r"^\s*TOTAL\b", re.IGNORECASE)
+_BULLETS = "●○•▪◦-*– \t"
+
+
+def _to_amount(sign, whole, cents):
+    value = float(whole.replace(",", "") + (cents or ""))
+    return -value if sign else value
+
+
+def _split_lead(lead):
+    """Pull date / line number / revenue code / CPT-HCPCS code off a row prefix."""
+    lead = lead.strip().lstrip(_BULLETS).strip()
+    date = line_no = rev_code = code = None
+    m = _DATE_RE.match(lead)
+    if m:
+        date = m.group(1)
+        lead = lead[m.end():]
+    else:
+        m = _LINE_NO_RE.match(lead)
+        if m:
+            line_no = int(m.group(1))
+            lead = lead[m.end():]
+    m = _REV_CODE_RE.match(lead)
+    if m:
+        rev_code = m.group(1)
+        lead = lead[m.end():]
+    m = _CPT_RE.match(lead)
+    if m:
+        code = m.group(1)
+        lead = lead[m.end():]
+    desc = lead.strip().rstrip(":").strip()
+    if code is None:
+        # Numbered layouts put the code column after the description
+        m = _TRAILING_CPT_RE.search(desc)
+        if m:
+            code = m.group(1)
+            desc = desc[: m.start()].rstrip(" ,")
+    return date, line_no, rev_code, code, desc
+
+
+def _units_from(desc):
+    m = _UNITS_RE.search(desc or "")
+    return float(m.group(1)) if m else 1.0
+
+
+def _make_item(date, line_no, rev_code, code, desc, amount, raw):
+    return {
+        "line_number": line_no,
+        "date": date,
+        "rev_code": rev_code,
+        "code": code,
+        "description": desc,
+        "units": _units_from(desc),
+        "amount": amount,
+        "raw": raw,
+    }
+
+
+def _parse_text_lines(lines, require_header=True):
+    items = []
+    stated_total = None
+    started = not require_header
+    in_adjustments = False
+    pending = None  # previous non-item line, the first half of a wrapped description
+    wrap_open = False  # last item borrowed `pending` and may continue on the next line
+
+    for idx, raw in enumerate(lines):
+        line = raw.strip()
+        if not line:
+            continue
+        money = _MONEY_RE.search(line)
+
+        if _TOTAL_RE.match(line):
+            if stated_total is None and "RESPONSIB" not in line.upper():
+                m = money or (idx + 1 < len(lines) and _MONEY_RE.search(lines[idx + 1]))
+                if m:
+                    stated_total = _to_amount(*m.groups())
+            wrap_open = False
+            continue
+        if not started:
+            started = bool(_ITEMS_START_RE.search(line))
+            continue
+        if _ADJUSTMENTS_RE.search(line) and not money:
+            in_adjustments = True
+        if in_adjustments:
+            continue
+
+        bare = None if money else _BARE_AMOUNT_RE.match(line)
+        if not money and not bare:
+            if line.lstrip(_BULLETS).lower().startswith("description:") and items:
+                items[-1]["detail"] = line.lstrip(_BULLETS).split(":", 1)[1].strip()
+            elif wrap_open and items:
+                items[-1]["description"] = f"{items[-1]['description']} {line}".strip()
+                wrap_open = False
+            else:
+                pending = line
+            continue
+
+        if money:
+            amount = _to_amount(*money.groups())
+            lead = line[: money.start()]
+        else:
+            amount = float(bare.group("amount"))
+            lead = bare.group("lead")
+        if amount < 0:
+            continue  # credits / adjustments are not charges
+        date, line_no, rev_code, code, desc = _split_lead(lead)
+        wrap_open = False
+        if not desc and pending:
+            desc = pending
+            wrap_open = True
+        if not desc and not code:
+            pending = None
+            continue
+        items.append(_make_item(date, line_no, rev_code, code, desc, amount, line))
+        pending = None
+    return items, stated_total
+
+
+def _column_index(header, pattern):
+    for i, cell in enumerate(header):
+        if cell and re.search(pattern, cell, re.IGNORECASE):
+            return i
+    return None
+
+
+def _parse_tables(tables):
+    items = []
+    for table in tables:
+        if not table:
+            continue
+        header = table[0]
+        cols = {
+            "desc": _column_index(header, r"DESC|SERVICE"),
+            "amount": _column_index(header, r"CHARGE|AMOUNT|BILLED"),
+            "date": _column_index(header, r"DATE"),
+            "rev": _column_index(header, r"REV"),
+            "code": _column_index(header, r"CPT|HCPCS|^CODE"),
+            "units": _column_index(header, r"UNITS|QTY|QUANTITY"),
+        }
+        if cols["desc"] is None or cols["amount"] is None:
+            continue
+
+        def cell(row, key):
+            i = cols[key]
+            if i is None or i >= len(row) or row[i] is None:
+                return None
+            return " ".join(str(row[i]).split()) or None
+
+        for row in table[1:]:
+            amount_cell = cell(row, "amount") or ""
+            m = _MONEY_RE.search(amount_cell) or re.search(r"()(\d[\d,]*)(\.\d{1,2})?", amount_cell)
+            if not m:
+                continue
+            amount = _to_amount(*m.groups())
+            if amount < 0:
+                continue
+            desc = cell(row, "desc") or ""
+            if _TOTAL_RE.match(desc):
+                continue
+            item = _make_item(
+                cell(row, "date"), None, cell(row, "rev"), cell(row, "code"), desc, amount,
+                " | ".join(str(c or "") for c in row),
+            )
+            units = cell(row, "units")
+            if units:
+                try:
+                    item["units"] = float(units)
+                except ValueError:
+                    pass
+            items.append(item)
+    return items
+
+
+def parse_line_items(pages, tables=()):
+    """Return (items, stated_total) from page texts and pdfplumber tables."""
+    lines = [line for page in pages for line in page.splitlines()]
+    text_items, stated_total = _parse_text_lines(lines)
+    if not text_items:
+        text_items, stated_total = _parse_text_lines(lines, require_header=False)
+    items = _parse_tables(tables) or text_items
+    for n, item in enumerate(items, start=1):
+        if item["line_number"] is None:
+            item["line_number"] = n
+    return items, stated_total
+
+
+def read_bill(source):
+    """Parse a bill PDF (path or binary file object) in a single pdfplumber pass.
+
+    Long bills given as a path are split across the pdf_extract process pool.
+    Returns {"text", "pages", "items", "stated_total"} where text matches
+    extract_text_from_pdf and items are {line_number, date, rev_code, code,
+    description, units, amount} dicts.
+    """
+    pages = []
+    tables = []
+    for text, page_tables in pdf_extract.extract_pages_and_tables(source):
+        pages.append(text)
+        tables.extend(page_tables)
+    items, stated_total = parse_line_items(pages, tables)
+    return {
+        "text": "".join(t + "\n" for t in pages if t),
+        "pages": pages,
+        "items": items,
+        "stated_total": stated_total,
+    }
@@ -0,0 +1,121 @@
+"""Prometheus metrics for the backend, served at /metrics.
+
+Histograms cover PDF extraction, model calls (latency and token usage),
+geocoding, URL verification and request time per blueprint; counters cover
+cache lookups, upstream errors, prompt tokens saved and extract_json
+fallbacks.
+
+Under a multi-process server set PROMETHEUS_MULTIPROC_DIR (an empty,
+writable directory) so /metrics aggregates every worker.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+# Seconds; model calls and PDF parsing run much longer than typical web requests
+_FAST = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_SLOW = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+_TOKENS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+PDF_EXTRACTION_SECONDS = Histogram(
+    "billchill_pdf_extraction_seconds", "Text extraction time per PDF document", ["kind"], buckets=_SLOW
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "billchill_llm_request_seconds", "Model call latency", ["provider", "operation", "outcome"], buckets=_SLOW
+)
+LLM_TOKENS = Histogram(
+    "billchill_llm_tokens", "Tokens per model call, from the usage field", ["provider", "operation", "type"],
+    buckets=_TOKENS,
+)
+GEOCODE_SECONDS = Histogram(
+    "billchill_geocode_seconds", "Geocoding time by direction and answering source", ["direction", "source"],
+    buckets=_FAST,
+)
+URL_VERIFICATION_SECONDS = Histogram(
+    "billchill_url_verification_seconds", "Time to verify one batch of hospital websites", buckets=_FAST
+)
+REQUEST_SECONDS = Histogram(
+    "billchill_request_seconds", "HTTP request time, including streamed bodies",
+    ["blueprint", "endpoint", "method", "status"], buckets=_SLOW,
+)
+CACHE_REQUESTS = Counter("billchill_cache_requests_total", "Cache lookups by result", ["cache", "result"])
+UPSTREAM_ERRORS = Counter("billchill_upstream_errors_total", "Failed upstream calls", ["upstream", "reason"])
+PROMPT_TOKENS_SAVED = Counter(
+    "billchill_prompt_tokens_saved", "Analysis prompt tokens removed by compaction and the token budget"
+)
+EXTRACT_JSON_FALLBACKS = Counter(
+    "billchill_extract_json_fallback_total", "Model replies that were not plain JSON", ["outcome"]
+)
+
+
+def cache_lookup(cache, hit):
+    """Count a lookup; hit is a bool or a result name such as "stale"."""
+    result = hit if isinstance(hit, str) else ("hit" if hit else "miss")
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def upstream_error(upstream, exc=None, status=None):
+    """Count a failed upstream call, classified by HTTP status class or exception type."""
+    status = status or getattr(exc, "status_code", None)
+    if status:
+        reason = f"http_{int(status) // 100}xx"
+    elif exc is not None and "timeout" in type(exc).__name__.lower():
+        reason = "timeout"
+    else:
+        reason = "connection"
+    UPSTREAM_ERRORS.labels(upstream, reason).inc()
+
+
+def _usage_tokens(usage):
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+@contextmanager
+def llm_call(provider, operation, count_errors=True):
+    """Time one model call; set call["usage"] from the response inside the block.
+
+    count_errors=False when the HTTP client already counted the failure.
+    """
+    call = {"usage": None}
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield call
+        outcome = "ok"
+    except Exception as e:
+        if count_errors:
+            upstream_error(provider, e)
+        raise
+    finally:
+        LLM_REQUEST_SECONDS.labels(provider, operation, outcome).observe(time.perf_counter() - started)
+        prompt, completion = _usage_tokens(call["usage"])
+        if prompt is not None:
+            LLM_TOKENS.labels(provider, operation, "prompt").observe(prompt)
+        if completion is not None:
+            LLM_TOKENS.labels(provider, operation, "completion").observe(completion)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(*labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def render():
+    """(body, content type) for the /metrics endpoint."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,123 @@
+"""Disk-backed cache of extracted PDF text, keyed by file content (SHA-256).
+
+Entries are plain files in a shared directory, so every worker process sees
+the same cache and it survives restarts. Writes are atomic (temp file +
+rename) which keeps concurrent writers from exposing half-written entries.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+# Bump when extraction output changes so stale entries are never served.
+CACHE_FORMAT_VERSION = "1"
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PdfTextCache:
+    """Content-addressed text cache with size-bounded LRU eviction.
+
+    A per-process stat index (path -> mtime/size/hash) avoids re-hashing
+    unchanged files; a changed mtime or size triggers a re-hash, so edits to a
+    policy PDF are picked up without restarting the server.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._stat_index = {}
+        self._lock = threading.Lock()
+
+    def hash_file(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            known = self._stat_index.get(path)
+        if known and known[0] == sig:
+            return known[1]
+        digest = file_sha256(path)
+        with self._lock:
+            self._stat_index[path] = (sig, digest)
+        return digest
+
+    def _entry_path(self, digest, kind):
+        return os.path.join(self.cache_dir, f"{digest}.{kind}.v{CACHE_FORMAT_VERSION}")
+
+    def get(self, digest, kind="text"):
+        entry = self._entry_path(digest, kind)
+        try:
+            with open(entry, "r", encoding="utf-8") as fh:
+                text = fh.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(entry)  # mtime doubles as last-used time for eviction
+        except OSError:
+            pass
+        return text
+
+    def put(self, digest, text, kind="text"):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(text)
+            os.replace(tmp, self._entry_path(digest, kind))
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._evict()
+
+    def get_or_compute(self, digest, compute, kind="text"):
+        text = self.get(digest, kind)
+        if text is not None:
+            return text
+        text = compute()
+        try:
+            self.put(digest, text, kind)
+        except OSError as e:
+            log.warning("pdf cache write failed for %s: %s", digest, e)
+        return text
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(".tmp-"):
+                continue
+            full = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(full)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, full))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, full in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(full)
+                total -= size
+            except FileNotFoundError:
+                pass
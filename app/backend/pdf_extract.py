@@ -0,0 +1,149 @@
+"""Page-level PDF text extraction with an optional process pool.
+
+pdfplumber is pure Python and CPU bound, so long documents are split into
+page ranges that are extracted in separate processes and re-joined in page
+order; in-memory uploads (BytesIO) are sent to the workers as bytes. Short
+documents (and other file-like sources) stay in-process, where the pool's
+startup and pickling overhead would outweigh the gain. Bills are read with
+their tables (line_items.read_bill), policies as text only. pdfplumber
+itself is imported on the first document, not at server start.
+"""
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger(__name__)
+
+# 0 or 1 disables the pool entirely (single-process fallback)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Documents shorter than this are extracted in-process
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded Flask worker is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+atexit.register(_reset_pool)
+
+
+def open_pdf(source):
+    import pdfplumber
+
+    return pdfplumber.open(source)
+
+
+def _page_content(page, tables):
+    text = page.extract_text() or ""
+    return (text, page.extract_tables() or []) if tables else text
+
+
+def _poolable(source):
+    """What a pool worker can open: the path, or the bytes of an in-memory upload."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, io.BytesIO):
+        return source.getvalue()
+    return None
+
+
+def _extract_range(source, start, stop, tables=False):
+    """Worker entry point: extract pages [start, stop) of the PDF at a path or in bytes."""
+    with open_pdf(io.BytesIO(source) if isinstance(source, bytes) else source) as pdf:
+        return [_page_content(pdf.pages[i], tables) for i in range(start, stop)]
+
+
+def _iter_serial(source, tables=False):
+    with open_pdf(source) as pdf:
+        for page in pdf.pages:
+            yield _page_content(page, tables)
+
+
+def page_count(source):
+    with open_pdf(source) as pdf:
+        return len(pdf.pages)
+
+
+def iter_page_texts(source, workers=None, tables=False):
+    """Yield the text of each page in order ("" for pages without text).
+
+    With tables=True each page is (text, tables) instead, tables as returned
+    by pdfplumber's extract_tables. source may be a filesystem path or a
+    binary file-like object; paths and BytesIO are eligible for the process
+    pool.
+    """
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    shared = _poolable(source)
+    if workers <= 1 or shared is None:
+        yield from _iter_serial(source, tables)
+        return
+
+    n_pages = page_count(source)
+    if n_pages < PDF_PARALLEL_MIN_PAGES:
+        yield from _iter_serial(source, tables)
+        return
+
+    # A couple of ranges per worker keeps the pool busy when pages vary in cost
+    step = max(1, -(-n_pages // (workers * 2)))
+    ranges = [(start, min(start + step, n_pages)) for start in range(0, n_pages, step)]
+    try:
+        pool = _get_pool(workers)
+        futures = [pool.submit(_extract_range, shared, a, b, tables) for a, b in ranges]
+    except (BrokenProcessPool, RuntimeError, OSError) as e:
+        log.warning("pdf extraction pool unavailable, falling back to serial: %s", e)
+        _reset_pool()
+        yield from _iter_serial(source, tables)
+        return
+
+    done = 0
+    try:
+        for fut in futures:
+            pages = fut.result()
+            yield from pages
+            done += len(pages)
+    except BrokenProcessPool as e:
+        log.warning("pdf extraction pool died, finishing serially: %s", e)
+        _reset_pool()
+        with open_pdf(source) as pdf:
+            for page in pdf.pages[done:]:
+                yield _page_content(page, tables)
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+def extract_pages(source, workers=None):
+    return list(iter_page_texts(source, workers))
+
+
+def extract_pages_and_tables(source, workers=None):
+    """[(text, tables)] per page, in order; long documents use the pool like extract_pages."""
+    return list(iter_page_texts(source, workers, tables=True))
+
+
+def extract_text(source, workers=None):
+    """Full document text: non-empty pages, each followed by a newline."""
+    return "".join(t + "\n" for t in iter_page_texts(source, workers) if t)
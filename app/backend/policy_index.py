@@ -0,0 +1,178 @@
+"""Section-level BM25 retrieval over policy documents.
+
+Each policy is split into chunks (one or more per page, cut at section
+headings) and indexed once. At request time the bill text is used as the
+query so only the sections relevant to the billed services reach the LLM.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+CHUNK_MIN_CHARS = 400
+CHUNK_MAX_CHARS = 2000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*|[IVXLC]+|[A-Z])[.)]\s+\S")
+_STOPWORDS = frozenset(
+    """a an and are as at be been but by for from has have if in into is it its
+    may no not of on or such that the their then there these this to was were
+    will with which who any all per other""".split()
+)
+
+
+def tokenize(text):
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if tok in _STOPWORDS or len(tok) < 2:
+            continue
+        # Bare amounts, dates and account numbers only add noise to the query
+        if tok.isdigit() and len(tok) != 5:
+            continue
+        tokens.append(tok)
+    return tokens
+
+
+def _is_heading(line):
+    line = line.strip()
+    if not line or len(line) > 80 or "...." in line or line[-1] in ";,)":
+        return False
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters):
+        return True
+    return bool(_NUMBERED_HEADING_RE.match(line)) and not line.endswith(".")
+
+
+def chunk_pages(pages):
+    """Split page texts into {chunk_id, page, heading, text} sections."""
+    chunks = []
+    heading = None
+    for page_no, page_text in enumerate(pages, start=1):
+        sections = []
+        current = []
+        for line in page_text.splitlines():
+            if _is_heading(line) and sum(len(l) for l in current) >= CHUNK_MIN_CHARS:
+                sections.append((heading, current))
+                current = []
+            if _is_heading(line):
+                heading = line.strip()
+            current.append(line)
+        if current:
+            sections.append((heading, current))
+
+        for sec_heading, lines in sections:
+            buf = []
+            size = 0
+            for line in lines:
+                if size + len(line) > CHUNK_MAX_CHARS and buf:
+                    chunks.append({"page": page_no, "heading": sec_heading, "text": "\n".join(buf)})
+                    buf, size = [], 0
+                buf.append(line)
+                size += len(line) + 1
+            if buf and "".join(buf).strip():
+                chunks.append({"page": page_no, "heading": sec_heading, "text": "\n".join(buf)})
+
+    for i, chunk in enumerate(chunks):
+        chunk["chunk_id"] = i
+    return chunks
+
+
+class PolicyIndex:
+    """Okapi BM25 inverted index over the chunks of a single policy document."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_len = []
+        for idx, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk["text"]))
+            self.doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((idx, tf))
+        n = len(chunks)
+        self.avg_len = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+        self.total_chars = sum(len(c["text"]) for c in chunks)
+        # Boilerplate stripped from the pages before chunking, when the caller records it
+        self.lines_removed = 0
+        self.tokens_removed = 0
+
+    @classmethod
+    def from_pages(cls, pages):
+        return cls(chunk_pages(pages))
+
+    def search(self, query_text, top_k=8):
+        """Return [(chunk, score)] for the best matching chunks, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query_text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / (self.avg_len or 1))
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:top_k]
+        return [(self.chunks[idx], score) for idx, score in ranked]
+
+    def select(self, query_text, top_k=8, full_text_max_chars=12000, max_tokens=None, count_tokens=None):
+        """Pick the rules context for a bill: candidates() then render()."""
+        return self.render(self.candidates(query_text, top_k, full_text_max_chars), max_tokens, count_tokens)
+
+    def candidates(self, query_text, top_k=8, full_text_max_chars=12000):
+        """Labelled (chunk, score, text) entries for a bill, best score first.
+
+        Small documents are passed through whole. Otherwise the top_k BM25
+        matches are used; if nothing matches, the opening chunks (usually the
+        policy overview) are used instead.
+        """
+        if self.total_chars <= full_text_max_chars:
+            picked = [(c, None) for c in self.chunks]
+        else:
+            picked = self.search(query_text, top_k) or [(c, 0.0) for c in self.chunks[:top_k]]
+
+        labelled = []
+        for chunk, score in picked:
+            label = f"[Chunk {chunk['chunk_id']} | Page {chunk['page']}"
+            if chunk["heading"]:
+                label += f" | {chunk['heading']}"
+            labelled.append((chunk, score, label + "]\n" + chunk["text"].strip()))
+        return labelled
+
+    @staticmethod
+    def render(labelled, max_tokens=None, count_tokens=None):
+        """Rules context from candidates(), in document order.
+
+        With max_tokens (and a count_tokens(text) function), chunks are kept
+        best score first (document order for whole documents) until the
+        budget is spent; lower-ranked chunks are dropped.
+        Returns (context_text, chunks_used) where chunks_used carries the
+        chunk_id/page/heading/score needed for citations.
+        """
+        if max_tokens is not None:
+            kept, spent = [], 0
+            for entry in labelled:
+                cost = count_tokens(entry[2]) + 1  # separator
+                if spent + cost <= max_tokens:
+                    kept.append(entry)
+                    spent += cost
+            labelled = kept
+        labelled = sorted(labelled, key=lambda e: e[0]["chunk_id"])
+
+        parts = []
+        used = []
+        for chunk, score, text in labelled:
+            parts.append(text)
+            used.append(
+                {
+                    "chunk_id": chunk["chunk_id"],
+                    "page": chunk["page"],
+                    "heading": chunk["heading"],
+                    "score": round(score, 4) if score is not None else None,
+                }
+            )
+        return "\n\n".join(parts), used
@@ -0,0 +1,254 @@
+"""Deterministic rules pre-screen for parsed bill line items.
+
+Only what can be checked exactly is ruled a definite overcharge: a stated
+total above the itemized sum. The other rules (identical repeated lines,
+component codes billed with their comprehensive code, amenity-style fees)
+are only suspicions, since repeated doses or modifiers can make them
+legitimate, so those lines go to the model as ambiguous with the rule's
+reason attached (format_screen_notes). A line at or below the configured
+reference charge for its code or description (load_reference_charges) is
+verified. A bill
+whose every line is verified and whose total reconciles is "clean" and needs
+no model call: clean_result() answers it, with the discount estimated from
+the federal poverty guidelines.
+"""
+import csv
+import re
+from collections import defaultdict
+
+# Comprehensive code -> component codes that are not separately payable when
+# billed on the same date (NCCI column 1 / column 2 style pairs).
+BUNDLED_COMPONENTS = {
+    "45385": {"45378"},  # colonoscopy w/ lesion removal includes diagnostic colonoscopy
+    "45380": {"45378"},
+    "45384": {"45378"},
+    "43239": {"43235"},  # EGD w/ biopsy includes diagnostic EGD
+    "80053": {"80048", "82565", "84132", "82947", "84295"},  # CMP includes BMP and its analytes
+    "80061": {"82465", "83718", "84478"},  # lipid panel components
+    "85025": {"85027", "85004"},  # CBC w/ diff includes CBC w/o diff
+}
+
+# Fees that are usually part of facility charges rather than separate lines.
+AMENITY_FEE_RE = re.compile(
+    r"wi-?fi|internet|television|\btv\b|convenience|comfort kit|"
+    r"statement fee|billing fee|invoice fee|admin(?:istrative)? fee",
+    re.IGNORECASE,
+)
+
+
+def _reference_key(text):
+    return " ".join((text or "").upper().split())
+
+
+def load_reference_charges(path):
+    """{code or description: max charge per unit} from a CSV with a max_charge
+    column and a code or description column.
+
+    E.g. built from the hospital's published standard charges; lines above
+    their reference (or without one) stay ambiguous.
+    """
+    charges = {}
+    with open(path, newline="", encoding="utf-8") as fh:
+        for row in csv.DictReader(fh):
+            key = _reference_key(row.get("code") or row.get("description"))
+            try:
+                if key:
+                    charges[key] = float(row.get("max_charge") or "")
+            except ValueError:
+                continue
+    return charges
+
+
+def _reference_charge(reference_charges, item):
+    for text in (item.get("code"), item.get("description")):
+        if text and _reference_key(text) in reference_charges:
+            return reference_charges[_reference_key(text)]
+    return None
+
+
+# HHS poverty guidelines (2024): (first person, each additional person)
+POVERTY_GUIDELINES = {"AK": (18810, 6730), "HI": (17310, 6190)}
+POVERTY_GUIDELINES_DEFAULT = (15060, 5380)
+# Income as % of the guideline -> discount, the usual nonprofit hospital
+# financial-assistance tiers (free care up to 200%, sliding scale to 400%)
+FPL_DISCOUNT_TIERS = ((200, 100), (300, 75), (400, 50))
+
+
+# First three ZIP digits -> state, as (low, high, abbr) ranges.
+_ZIP3_STATES = [
+    (5, 5, "NY"), (6, 9, "PR"), (10, 27, "MA"), (28, 29, "RI"), (30, 38, "NH"),
+    (39, 49, "ME"), (50, 54, "VT"), (55, 55, "MA"), (56, 59, "VT"), (60, 69, "CT"),
+    (70, 89, "NJ"), (100, 149, "NY"), (150, 196, "PA"), (197, 199, "DE"),
+    (200, 205, "DC"), (206, 219, "MD"), (220, 246, "VA"), (247, 268, "WV"),
+    (270, 289, "NC"), (290, 299, "SC"), (300, 319, "GA"), (320, 349, "FL"),
+    (350, 369, "AL"), (370, 385, "TN"), (386, 397, "MS"), (398, 399, "GA"),
+    (400, 427, "KY"), (430, 459, "OH"), (460, 479, "IN"), (480, 499, "MI"),
+    (500, 528, "IA"), (530, 549, "WI"), (550, 567, "MN"), (570, 577, "SD"),
+    (580, 588, "ND"), (590, 599, "MT"), (600, 629, "IL"), (630, 658, "MO"),
+    (660, 679, "KS"), (680, 693, "NE"), (700, 714, "LA"), (716, 729, "AR"),
+    (730, 732, "OK"), (733, 733, "TX"), (734, 749, "OK"), (750, 799, "TX"),
+    (800, 816, "CO"), (820, 831, "WY"), (832, 838, "ID"), (840, 847, "UT"),
+    (850, 865, "AZ"), (870, 884, "NM"), (885, 885, "TX"), (889, 898, "NV"),
+    (900, 961, "CA"), (967, 968, "HI"), (970, 979, "OR"), (980, 994, "WA"),
+    (995, 999, "AK"),
+]
+
+
+def zip_to_state(zip_code):
+    digits = re.sub(r"\D", "", str(zip_code or ""))[:5]
+    if len(digits) < 5:
+        return None
+    prefix = int(digits[:3])
+    for low, high, abbr in _ZIP3_STATES:
+        if low <= prefix <= high:
+            return abbr
+    return None
+
+
+def estimate_discount(household_size, annual_income, state_abbr=None):
+    """(discount percent or None, explanation) from income against the poverty guideline."""
+    if not annual_income or annual_income <= 0:
+        return None, "No household income given, so financial-assistance eligibility could not be estimated."
+    size = max(1, int(household_size or 1))
+    first, each = POVERTY_GUIDELINES.get(state_abbr, POVERTY_GUIDELINES_DEFAULT)
+    guideline = first + each * (size - 1)
+    percent_fpl = 100 * annual_income / guideline
+    basis = (
+        f"Income ${annual_income:,.0f} for a household of {size} is {percent_fpl:.0f}% of the "
+        f"${guideline:,.0f} federal poverty guideline."
+    )
+    for limit, discount in FPL_DISCOUNT_TIERS:
+        if percent_fpl <= limit:
+            return float(discount), (
+                f"{basis}\nTypical hospital financial assistance at or below {limit}% of the guideline: "
+                f"{discount}% discount. Confirm against the provider's financial assistance policy."
+            )
+    return 0.0, f"{basis}\nAbove the usual 400% limit for hospital financial assistance."
+
+
+def clean_result(screen, household_size, annual_income, zip_code):
+    """The structured analysis for a "clean" bill, without a model call."""
+    state = zip_to_state(zip_code)
+    discount, explanation = estimate_discount(household_size, annual_income, state)
+    return {
+        "state_abbr": state,
+        "total_eligible_discount_percent": discount,
+        "discount_explanation": explanation,
+        "overcharges": list(screen["definite_overcharges"]),
+    }
+
+
+def _service(item):
+    return item.get("description") or item.get("code") or "(unlabelled line)"
+
+
+def _flag(item, reason):
+    return {
+        "line_number": item.get("line_number"),
+        "service": _service(item),
+        "amount": item.get("amount"),
+        "reason": reason,
+    }
+
+
+def _suspicions(items):
+    """{item index: [reason, ...]} from the duplicate, unbundling and amenity rules."""
+    reasons = defaultdict(list)
+
+    seen = defaultdict(list)
+    for i, item in enumerate(items):
+        key = (item.get("date"), item.get("code") or (item.get("description") or "").lower(), item["amount"])
+        seen[key].append(i)
+    for key, idxs in seen.items():
+        for i in idxs[1:]:
+            when = f" on {key[0]}" if key[0] else ""
+            reasons[i].append(
+                f"Possible duplicate: identical line billed {len(idxs)} times{when} (repeated doses can be legitimate)."
+            )
+
+    by_date = defaultdict(list)
+    for i, item in enumerate(items):
+        by_date[item.get("date")].append(i)
+    for idxs in by_date.values():
+        codes = {items[i].get("code") for i in idxs}
+        for i in idxs:
+            code = items[i].get("code")
+            parents = [c for c in codes if code and code in BUNDLED_COMPONENTS.get(c, ())]
+            if parents:
+                reasons[i].append(f"Possible unbundling: {code} is a component of {parents[0]} billed the same day.")
+
+    for i, item in enumerate(items):
+        if AMENITY_FEE_RE.search(item.get("description") or ""):
+            reasons[i].append("Possible amenity/overhead fee, usually included in facility charges.")
+    return reasons
+
+
+def screen_bill(items, stated_total=None, reference_charges=None):
+    """Classify each parsed line as verified or ambiguous, and check the stated total.
+
+    Returns a dict with status ("clean" | "flagged" | "review" | "unparsed"),
+    definite_overcharges (same shape as the AI overcharges), ambiguous_items
+    (with screen_reasons from the rules that fired) and verified_lines.
+    """
+    if not items:
+        return {
+            "status": "unparsed",
+            "definite_overcharges": [],
+            "ambiguous_items": [],
+            "verified_lines": [],
+            "total_reconciled": False,
+        }
+
+    definite = []
+    itemized = round(sum(item["amount"] for item in items), 2)
+    total_reconciled = stated_total is not None and abs(stated_total - itemized) < 0.01
+    if stated_total is not None and stated_total - itemized >= 0.01:
+        definite.append(
+            {
+                "line_number": None,
+                "service": "Statement total",
+                "amount": round(stated_total - itemized, 2),
+                "reason": f"Stated total ${stated_total:,.2f} exceeds the sum of itemized charges ${itemized:,.2f}.",
+            }
+        )
+
+    reference_charges = reference_charges or {}
+    reasons = _suspicions(items)
+    ambiguous = []
+    verified = []
+    for i, item in enumerate(items):
+        ceiling = _reference_charge(reference_charges, item)
+        units = item.get("units") or 1
+        if i not in reasons and ceiling is not None and item["amount"] <= ceiling * units:
+            verified.append(item["line_number"])
+        else:
+            ambiguous.append({**item, "screen_reasons": reasons.get(i, [])})
+
+    if definite:
+        status = "flagged"
+    elif not ambiguous and total_reconciled:
+        status = "clean"
+    else:
+        status = "review"
+    return {
+        "status": status,
+        "definite_overcharges": definite,
+        "ambiguous_items": ambiguous,
+        "verified_lines": verified,
+        "total_reconciled": total_reconciled,
+    }
+
+
+def format_screen_notes(screen):
+    """Pre-screen notes appended to the bill text for the LLM ("" when there are none)."""
+    lines = []
+    for item in screen["ambiguous_items"]:
+        for reason in item.get("screen_reasons") or ():
+            lines.append(f"- Line {item['line_number']} ({_service(item)}, ${item['amount']:,.2f}) check: {reason}")
+    if screen["verified_lines"]:
+        numbers = ", ".join(str(n) for n in screen["verified_lines"])
+        lines.append(f"- Lines {numbers} are at or below reference charges; no need to review them.")
+    for oc in screen["definite_overcharges"]:
+        where = f"Line {oc['line_number']}" if oc["line_number"] is not None else "Bill"
+        lines.append(f"- Already flagged (do not repeat): {where}: {oc['service']} ${oc['amount']:,.2f} | {oc['reason']}")
+    return "Pre-screen notes:\n" + "\n".join(lines) if lines else ""
@@ -0,0 +1,274 @@
+"""Opt-in request profiling: stage spans and an optional stack sampler.
+
+A profiled request carries a Profile in a context variable. span() records
+named, nested stages (start offset, duration, thread); it costs one
+ContextVar lookup when the request is not being profiled. Work handed to a
+thread pool keeps its profile when submitted through contextvars, e.g.
+pool.submit(contextvars.copy_context().run, fn, ...).
+
+With stacks enabled, a sampler thread reads sys._current_frames() every
+interval for the threads currently working on the request and aggregates
+the stacks in folded form ("outer;inner;leaf count"), ready for
+flamegraph.pl or speedscope.
+
+Finished profiles are written as JSON files to a ProfileStore directory,
+bounded by count and age, so every worker process shares one store.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+_profile = contextvars.ContextVar("billchill_profile", default=None)
+_parent = contextvars.ContextVar("billchill_span_parent", default=None)
+
+MAX_SPANS = 2000
+MAX_STACK_DEPTH = 128
+
+
+class Profile:
+    def __init__(self, method, path, stacks=False, sample_interval=0.005, max_seconds=120.0):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+        self._threads = Counter()  # thread ident -> active span count (request thread pinned)
+        self._threads[threading.get_ident()] += 1
+        self.stacks = Counter() if stacks else None
+        self.samples = 0
+        self.sample_interval = sample_interval
+        self._max_seconds = max_seconds
+        self._stop = threading.Event()
+        self._sampler = None
+        if stacks:
+            self._sampler = threading.Thread(target=self._sample_loop, name=f"profile-{self.id}", daemon=True)
+            self._sampler.start()
+
+    def _offset_ms(self, t):
+        return round((t - self._t0) * 1000, 3)
+
+    def _enter(self, name, attrs):
+        with self._lock:
+            if len(self.spans) >= MAX_SPANS:
+                self.dropped_spans += 1
+                return None
+            index = len(self.spans)
+            self.spans.append(
+                {
+                    "name": name,
+                    "parent": _parent.get(),
+                    "thread": threading.current_thread().name,
+                    "start_ms": self._offset_ms(time.perf_counter()),
+                    "duration_ms": None,
+                    **({"attrs": attrs} if attrs else {}),
+                }
+            )
+            self._threads[threading.get_ident()] += 1
+            return index
+
+    def _exit(self, index, error):
+        with self._lock:
+            span = self.spans[index]
+            span["duration_ms"] = round(self._offset_ms(time.perf_counter()) - span["start_ms"], 3)
+            if error is not None:
+                span["error"] = type(error).__name__
+            ident = threading.get_ident()
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        deadline = time.perf_counter() + self._max_seconds
+        names = {}
+        while not self._stop.wait(self.sample_interval) and time.perf_counter() < deadline:
+            with self._lock:
+                idents = [i for i in self._threads if i != me]
+            frames = sys._current_frames()
+            if any(i not in names for i in idents):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(_thread_role(names.get(ident, "thread")))
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def finish(self, status=None, endpoint=None):
+        """Stop sampling and return the profile as a JSON-ready dict."""
+        duration_ms = self._offset_ms(time.perf_counter())
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        with self._lock:
+            spans = [dict(s) for s in self.spans]
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "endpoint": endpoint,
+            "status": status,
+            "started_at": self.started_at,
+            "duration_ms": duration_ms,
+            "spans": spans,
+            "dropped_spans": self.dropped_spans,
+            "stacks": None
+            if self.stacks is None
+            else {"interval_ms": self.sample_interval * 1000, "samples": self.samples, "folded": dict(self.stacks)},
+        }
+
+
+def _thread_role(name):
+    # "url-check_3" and "url-check_7" are the same role in a flame graph
+    return name.rsplit("_", 1)[0] if name.rsplit("_", 1)[-1].isdigit() else name
+
+
+def start(method, path, stacks=False, sample_interval=0.005):
+    """Profile the rest of the current context; returns the Profile."""
+    profile = Profile(method, path, stacks=stacks, sample_interval=sample_interval)
+    _profile.set(profile)
+    _parent.set(None)
+    return profile
+
+
+def clear():
+    _profile.set(None)
+    _parent.set(None)
+
+
+def current():
+    return _profile.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Record a stage of the profiled request; a no-op otherwise."""
+    profile = _profile.get()
+    index = profile._enter(name, attrs) if profile is not None else None
+    if index is None:
+        yield
+        return
+    token = _parent.set(index)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _parent.reset(token)
+        profile._exit(index, error)
+
+
+def traced(name=None):
+    """Decorator: run the function inside span(name or the function's name)."""
+
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profile.get() is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def folded(profile_data):
+    """Folded stack text ("a;b;c count" per line) from a stored profile."""
+    stacks = (profile_data.get("stacks") or {}).get("folded") or {}
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+class ProfileStore:
+    """Finished profiles as <id>.json files, pruned to max_count and max_age."""
+
+    def __init__(self, root, max_count=200, max_age=24 * 3600):
+        self.root = root
+        self.max_count = max_count
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id):
+        return os.path.join(self.root, f"{profile_id}.json")
+
+    def save(self, data):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".profile-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp, self._path(data["id"]))
+        self.prune()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".json") and entry.is_file():
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        return sorted(entries, reverse=True)
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            for i, (mtime, path) in enumerate(self._entries()):
+                if i >= self.max_count or mtime < cutoff:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def get(self, profile_id):
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._path(profile_id), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self, limit=50):
+        """Newest first: id, method, path, status, duration and span count."""
+        summaries = []
+        for _, path in self._entries()[:limit]:
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    data = json.load(fh)
+            except (FileNotFoundError, ValueError):
+                continue
+            summaries.append(
+                {
+                    "id": data["id"],
+                    "method": data.get("method"),
+                    "path": data.get("path"),
+                    "status": data.get("status"),
+                    "started_at": data.get("started_at"),
+                    "duration_ms": data.get("duration_ms"),
+                    "spans": len(data.get("spans") or []),
+                    "stack_samples": (data.get("stacks") or {}).get("samples"),
+                }
+            )
+        return summaries
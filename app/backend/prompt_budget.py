@@ -0,0 +1,201 @@
+"""Prompt compaction: local token counts, boilerplate removal, budgets.
+
+Tokens are counted with tiktoken when it is installed (and its encoding
+can be loaded), otherwise estimated at ~4 characters per token. Page
+headers/footers that repeat across pages are dropped after their first
+occurrence, runs of whitespace are collapsed, and texts that still don't
+fit are cut to a per-model token budget.
+"""
+import functools
+import math
+import re
+
+try:
+    import tiktoken  # optional, exact counts for OpenAI models
+except ImportError:
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4
+EDGE_LINES = 3  # lines at the top and bottom of a page checked for boilerplate
+TRUNCATION_MARKER = "\n[... truncated to fit the prompt budget]"
+
+# Context windows (tokens); longest matching prefix wins
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4.1": 1_047_576,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+    "o1": 200_000,
+    "o3": 200_000,
+    "o4-mini": 200_000,
+}
+COMPLETION_RESERVE_TOKENS = 4_096
+
+_SPACES_RE = re.compile(r"[ \t\u00a0]+")
+# "Page 3", "Page 3 of 12", "3 of 12", "3/12" (digits replaced by #); a bare
+# number needs the page sequence behind it, see _page_number_offset()
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s*#+(?:\s*(?:of|/)\s*#+)?|#+\s*(?:of|/)\s*#+)$")
+_BARE_NUMBER_RE = re.compile(r"^\d{1,4}$")
+
+
+@functools.lru_cache(maxsize=16)
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None  # encoding files could not be fetched (offline)
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def tokenizer_name(model):
+    enc = _encoding(model)
+    return f"tiktoken:{enc.name}" if enc is not None else f"chars/{CHARS_PER_TOKEN}"
+
+
+def count_tokens(text, model):
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model):
+    """Cut text to at most max_tokens (marker included), preferring a line break."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    room = max_tokens - count_tokens(TRUNCATION_MARKER, model)
+    if room <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is None:
+        cut = text[: room * CHARS_PER_TOKEN]
+    else:
+        cut = enc.decode(enc.encode(text, disallowed_special=())[:room])
+    newline = cut.rfind("\n")
+    if newline > len(cut) * 0.8:
+        cut = cut[:newline]
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def context_window(model):
+    best = None
+    for prefix in MODEL_CONTEXT_TOKENS:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return MODEL_CONTEXT_TOKENS.get(best)
+
+
+def parse_budgets(spec):
+    """Parse "30000" or "gpt-4.1-mini=30000,gpt-4o=20000" into {model prefix or "*": tokens}."""
+    budgets = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        model, sep, value = part.rpartition("=")
+        budgets[model.strip() if sep else "*"] = int(value)
+    return budgets
+
+
+def model_budget(model, budgets, default):
+    """Prompt token budget: configured per model (longest prefix), else the default
+    capped by what the model's context window leaves after the completion reserve."""
+    matches = [p for p in budgets if p != "*" and model.startswith(p)]
+    if matches:
+        return budgets[max(matches, key=len)]
+    budget = budgets.get("*", default)
+    window = context_window(model)
+    if window:
+        budget = min(budget, window - COMPLETION_RESERVE_TOKENS)
+    return budget
+
+
+def collapse_whitespace(text):
+    """Single spaces within lines, no trailing spaces, at most one blank line in a row."""
+    out = []
+    for line in (text or "").splitlines():
+        line = _SPACES_RE.sub(" ", line).strip()
+        if line or (out and out[-1]):
+            out.append(line)
+    while out and not out[-1]:
+        out.pop()
+    return "\n".join(out)
+
+
+def _line_key(line):
+    return " ".join(line.lower().split())
+
+
+def _edge_indexes(lines):
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+
+def _page_number_offset(split, needed):
+    """Offset k such that a bare edge line "n" on page p (0-based) is n == p + k
+    on at least `needed` pages, or None: a lone number is only a page number
+    when it counts up with the pages (otherwise it may be a total or quantity).
+    """
+    offsets = {}
+    for page_no, lines in enumerate(split):
+        for k in {int(lines[i]) - page_no for i in _edge_indexes(lines) if _BARE_NUMBER_RE.match(lines[i].strip())}:
+            offsets[k] = offsets.get(k, 0) + 1
+    best = max(offsets, key=offsets.get, default=None)
+    return best if best is not None and offsets[best] >= needed else None
+
+
+def strip_repeated_lines(pages, min_fraction=0.5):
+    """Drop header/footer lines repeated across pages, keeping the first occurrence.
+
+    A line counts as boilerplate when it sits among the first or last few lines
+    of at least min_fraction of the pages (and of two or more). Page-number
+    lines ("Page 3 of 12", or bare numbers that count up with the pages) go
+    from every page. Returns (pages, lines_removed).
+    """
+    split = [(page or "").splitlines() for page in pages]
+    seen_on = {}
+    for page_no, lines in enumerate(split):
+        for i in _edge_indexes(lines):
+            seen_on.setdefault(_line_key(lines[i]), set()).add(page_no)
+    needed = max(2, math.ceil(min_fraction * len(split)))
+    repeated = {key for key, on in seen_on.items() if key and len(on) >= needed}
+    offset = _page_number_offset(split, needed)
+
+    removed = 0
+    kept_once = set()
+    cleaned = []
+    for page_no, lines in enumerate(split):
+        edges = _edge_indexes(lines)
+        out = []
+        for i, line in enumerate(lines):
+            key = _line_key(line)
+            if i in edges and (
+                _PAGE_NUMBER_RE.match(re.sub(r"\d+", "#", key))
+                or (offset is not None and key == str(page_no + offset))
+            ):
+                removed += 1
+                continue
+            if i in edges and key in repeated:
+                if key in kept_once:
+                    removed += 1
+                    continue
+                kept_once.add(key)
+            out.append(line)
+        cleaned.append("\n".join(out))
+    return cleaned, removed
+
+
+def compact_pages(pages):
+    """Pages with repeated boilerplate removed and whitespace collapsed; returns (pages, lines_removed)."""
+    pages, removed = strip_repeated_lines(pages)
+    return [collapse_whitespace(p) for p in pages], removed
@@ -0,0 +1,124 @@
+"""In-process LRU response cache with stale-while-revalidate.
+
+Entries are fresh for `ttl` seconds, then served stale for up to
+`stale_ttl` more while one background refresh recomputes them. Concurrent
+misses for the same key share a single computation. Failed computations
+are never cached; a failed refresh leaves the stale entry in place.
+
+get_async() is the same protocol for coroutines on one event loop:
+refreshes run as tasks instead of on the refresh pool.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+HIT = "HIT"
+STALE = "STALE"
+MISS = "MISS"
+
+
+class SWRCache:
+    def __init__(self, ttl=600, stale_ttl=3600, max_entries=512, refresh_workers=2):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._inflight = {}  # key -> Future
+        self._ainflight = {}  # key -> asyncio.Task (get_async)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="swr-refresh")
+        self.hits = self.stale_hits = self.misses = 0
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _compute(self, key, compute, fut):
+        try:
+            value = compute()
+        except BaseException as e:
+            fut.set_exception(e)
+        else:
+            self._store(key, value)
+            fut.set_result(value)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get(self, key, compute):
+        """Return (value, status); compute() runs on a miss or, for stale entries, in the background."""
+        with self._lock:
+            found = self._lookup(key)
+            if found is not None:
+                if found[1] == STALE and key not in self._inflight:
+                    fut = self._inflight[key] = Future()
+                    self._pool.submit(self._compute, key, compute, fut)
+                return found
+            self.misses += 1
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if owner:
+            self._compute(key, compute, fut)
+        return fut.result(), MISS
+
+    def _lookup(self, key):
+        """(value, status) for a fresh or stale entry, or None on a miss; call with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry[1]
+        if age < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], HIT
+        if age < self.ttl + self.stale_ttl:
+            self._entries.move_to_end(key)
+            self.stale_hits += 1
+            return entry[0], STALE
+        del self._entries[key]
+        return None
+
+    async def _compute_async(self, key, compute):
+        try:
+            value = await compute()
+            self._store(key, value)
+            return value
+        finally:
+            self._ainflight.pop(key, None)
+
+    def _task(self, key, compute):
+        task = self._ainflight.get(key)
+        if task is None:
+            task = self._ainflight[key] = asyncio.ensure_future(self._compute_async(key, compute))
+            # A failed background refresh must not be reported as "never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def get_async(self, key, compute):
+        """Like get(), for a coroutine function compute on the running event loop."""
+        with self._lock:
+            found = self._lookup(key)
+            if found is None:
+                self.misses += 1
+        if found is not None:
+            if found[1] == STALE:
+                self._task(key, compute)
+            return found
+        # shield: a client that goes away must not cancel a search others are waiting on
+        return await asyncio.shield(self._task(key, compute)), MISS
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+            }
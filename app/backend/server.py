@@ -1,15 +1,40 @@
+import contextvars
+import functools
+import hmac
+import io
 import os
+import random
 import json
 import re
 import math
-from functools import lru_cache
-
-from flask import Flask, request, jsonify, Blueprint
+import threading
+import time
+import uuid
+import zipfile
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+
+from flask import Flask, request, jsonify, Blueprint, Response, g, stream_with_context
 from flask_cors import CORS
-import requests
-import pdfplumber
 from dotenv import load_dotenv, find_dotenv
-from openai import OpenAI
+
+import http_client
+import line_items
+import metrics
+import pdf_extract
+import prescreen
+import profiling
+import prompt_budget
+from gazetteer import Gazetteer
+from hospital_catalog import HospitalCatalog, normalize_condition, record_key
+from jobs import JobError, QueueFull, create_job_queue
+from pdf_cache import PdfTextCache, sha256_bytes
+from policy_index import PolicyIndex
+from response_cache import SWRCache
+from sqlite_store import SqliteTTLCache, SqliteTokenBucket
+from upload_store import UploadStore
+from url_check import STATUS_OK, UrlVerifier, check_url
 
 
 # Load env early (supports .env in repo root)
@@ -18,6 +43,29 @@ load_dotenv(find_dotenv())
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NOMINATIM_EMAIL = os.getenv("NOMINATIM_EMAIL")  # optional but recommended
+# Upstream endpoints (overridable for local stubs; OpenAI's client reads OPENAI_BASE_URL itself)
+NOMINATIM_BASE_URL = os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org").rstrip("/")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+# Optional record/replay of all upstream traffic (see cassette.py); replay needs no keys or network
+CASSETTE_PATH = os.getenv("CASSETTE_PATH")
+if CASSETTE_PATH:
+    import cassette  # pulls in requests and httpx, so only when a cassette is configured
+upstream_cassette = (
+    cassette.Cassette(
+        CASSETTE_PATH,
+        mode=os.getenv("CASSETTE_MODE", "replay"),
+        latency=os.getenv("CASSETTE_LATENCY", "recorded"),
+    )
+    if CASSETTE_PATH
+    else None
+)
+if upstream_cassette is not None and upstream_cassette.mode == "replay":
+    OPENROUTER_API_KEY = OPENROUTER_API_KEY or "replay"
+    OPENAI_API_KEY = OPENAI_API_KEY or "replay"
+
+SERVER_DIR = os.path.dirname(__file__)
+# Shared on-disk caches (PDF text, geocodes, ...) used by every worker process
+CACHE_DIR = os.getenv("BILLCHILL_CACHE_DIR") or os.path.join(SERVER_DIR, ".cache")
 
 app = Flask(__name__)
 
@@ -26,7 +74,12 @@ origins = {"http://localhost:3000", "http://127.0.0.1:3000"}
 extra_origin = os.getenv("CORS_ALLOW_ORIGIN")
 if extra_origin:
     origins.add(extra_origin)
-CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": list(origins)}})
+CORS(
+    app,
+    supports_credentials=True,
+    resources={r"/api/*": {"origins": list(origins)}},
+    expose_headers=["X-Cache", "X-Profile-Id"],
+)
 
 
 # ---------- Shared helpers (Hospitals) ----------
@@ -39,145 +92,337 @@ def extract_json(text: str):
     m = re.search(r'(\[.*\]|\{.*\})', text, re.DOTALL)
     if m:
         try:
-            return json.loads(m.group(1))
+            data = json.loads(m.group(1))
         except Exception:
-            return None
+            data = None
+        if data is not None:
+            metrics.EXTRACT_JSON_FALLBACKS.labels("salvaged").inc()
+            return data
+    metrics.EXTRACT_JSON_FALLBACKS.labels("failed").inc()
     return None
 
 
+# Hospital websites are checked concurrently and cached (ok and failed) per URL/host
+URL_CHECK_DEADLINE = float(os.getenv("URL_CHECK_DEADLINE", "6"))
+# Pooled upstream clients: keep-alive per host, jittered retries on 429/5xx
+nominatim_http = http_client.get_client(
+    "nominatim", pool_maxsize=int(os.getenv("NOMINATIM_POOL_MAXSIZE", "4"))
+)
+openrouter_http = http_client.get_client(
+    "openrouter",
+    pool_maxsize=int(os.getenv("OPENROUTER_POOL_MAXSIZE", "10")),
+    retry_methods=("POST",),  # 429/5xx and failed connects only; a read timeout may already be billed
+)
+# Many distinct hosts, one or two requests each; fail fast rather than retry
+websites_http = http_client.get_client("websites", pool_connections=64, pool_maxsize=2, retries=0)
+if upstream_cassette is not None:
+    for _upstream in (nominatim_http, openrouter_http, websites_http):
+        cassette.install_requests(upstream_cassette, _upstream)
+
+url_verifier = UrlVerifier(
+    http=websites_http,
+    check=profiling.traced("check_url")(check_url),
+    workers=int(os.getenv("URL_CHECK_WORKERS", "8")),
+    timeout=float(os.getenv("URL_CHECK_TIMEOUT", "3")),
+    ok_ttl=int(os.getenv("URL_CHECK_OK_TTL", str(6 * 3600))),
+    fail_ttl=int(os.getenv("URL_CHECK_FAIL_TTL", "900")),
+    max_entries=int(os.getenv("URL_CHECK_MAX_ENTRIES", "4096")),
+)
+
+
+@profiling.traced()
 def verify_url(url):
+    return url_verifier.verify(url) == STATUS_OK
+
+
+# Geocode results are shared by all workers on disk; Nominatim allows ~1 req/s
+GEOCODE_TTL = int(os.getenv("GEOCODE_TTL", str(30 * 86400)))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", "3600"))
+# 2 decimals ≈ 1.1 km, well inside the city-level (zoom=10) reverse lookup
+GEOCODE_ROUND_DECIMALS = int(os.getenv("GEOCODE_ROUND_DECIMALS", "2"))
+NOMINATIM_RATE_PER_SEC = float(os.getenv("NOMINATIM_RATE_PER_SEC", "1"))
+NOMINATIM_MAX_WAIT = float(os.getenv("NOMINATIM_MAX_WAIT", "5"))
+geocode_cache = SqliteTTLCache(os.path.join(CACHE_DIR, "geocode.sqlite3"), table="geocode")
+nominatim_limiter = SqliteTokenBucket(
+    os.path.join(CACHE_DIR, "ratelimit.sqlite3"), "nominatim", rate=NOMINATIM_RATE_PER_SEC
+)
+
+
+# Optional offline gazetteer (Census ZCTA/place/county files); Nominatim only on a miss
+GAZETTEER_FILES = [p for p in os.getenv("GAZETTEER_FILES", "").split(os.pathsep) if p.strip()]
+GAZETTEER_MAX_KM = float(os.getenv("GAZETTEER_MAX_KM", "25"))
+_gazetteer = None
+_gazetteer_started = False
+_gazetteer_lock = threading.Lock()
+
+
+def _load_gazetteer():
+    global _gazetteer
     try:
-        r = requests.head(url, allow_redirects=True, timeout=3)
-        return r.status_code < 400
-    except Exception:
-        return False
+        _gazetteer = Gazetteer.from_files(GAZETTEER_FILES)
+        app.logger.info("Gazetteer loaded: %d entries", len(_gazetteer))
+    except Exception as e:
+        app.logger.warning("Gazetteer load failed: %s", e)
+
+
+def get_gazetteer():
+    """The offline gazetteer, or None when not configured or still loading (never blocks)."""
+    global _gazetteer_started
+    if not GAZETTEER_FILES:
+        return None
+    with _gazetteer_lock:
+        if not _gazetteer_started:
+            _gazetteer_started = True
+            threading.Thread(target=_load_gazetteer, name="gazetteer-load", daemon=True).start()
+    return _gazetteer
+
+
+def _nominatim_get(path, params, timeout):
+    """Rate-limited Nominatim GET returning parsed JSON; raises on any failure."""
+    if not nominatim_limiter.acquire(timeout=NOMINATIM_MAX_WAIT):
+        raise RuntimeError("Nominatim rate limit wait exceeded")
+    resp = nominatim_http.get(
+        f"{NOMINATIM_BASE_URL}/{path}", params=params, headers=nominatim_headers(), timeout=timeout
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def nominatim_headers():
+    return {"User-Agent": f"hospital-price-finder/1.0 ({NOMINATIM_EMAIL or 'no-email-provided'})"}
+
 
+def _observe_geocode(direction, source, started):
+    metrics.GEOCODE_SECONDS.labels(direction, source).observe(time.perf_counter() - started)
+    if source != "gazetteer":
+        metrics.cache_lookup("geocode", source == "cache")
 
-def haversine_miles(lat1, lon1, lat2, lon2):
-    """Compute distance in miles between two lat/lon points."""
-    R_km = 6371.0
-    p1, p2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlmb = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dlmb/2)**2
-    dist_km = 2 * R_km * math.asin(math.sqrt(a))
-    return dist_km * 0.621371  # km -> miles
 
+REVERSE_FALLBACK = {"city": None, "state": None, "country": None, "label": "this area"}
 
-@lru_cache(maxsize=256)
+
+@profiling.traced()
 def reverse_geocode(lat: float, lon: float):
     """
     Reverse geocode to (city, state/region, country). Uses OpenStreetMap Nominatim.
     Returns dict with {city, state, country, label}. Falls back sensibly.
+
+    Coordinates are rounded so nearby points share a cache entry. Transient
+    failures return the fallback without caching it.
     """
+    started = time.perf_counter()
+    result, source = _reverse_lookup(lat, lon)
+    _observe_geocode("reverse", source, started)
+    return result
+
+
+def _reverse_lookup(lat, lon):
+    """(place, source) where source is gazetteer, cache, nominatim or fallback."""
+    local = reverse_local(lat, lon)
+    if local is not None:
+        return local
+    key, params = reverse_request(lat, lon)
     try:
-        params = {
-            "format": "jsonv2",
-            "lat": str(lat),
-            "lon": str(lon),
-            "zoom": "10",
-            "addressdetails": "1",
-        }
-        headers = {
-            "User-Agent": f"hospital-price-finder/1.0 ({NOMINATIM_EMAIL or 'no-email-provided'})"
-        }
-        resp = requests.get(
-            "https://nominatim.openstreetmap.org/reverse",
-            params=params,
-            headers=headers,
-            timeout=6,
-        )
-        resp.raise_for_status()
-        data = resp.json() or {}
-        addr = data.get("address", {})
-        city = (
-            addr.get("city")
-            or addr.get("town")
-            or addr.get("village")
-            or addr.get("suburb")
-            or addr.get("county")
-        )
-        state = addr.get("state") or addr.get("region") or addr.get("state_district")
-        country = addr.get("country")
-        label_parts = [p for p in [city, state, country] if p]
-        label = ", ".join(label_parts) if label_parts else data.get("display_name", "Unknown location")
-        return {"city": city, "state": state, "country": country, "label": label}
+        data = _nominatim_get("reverse", params, timeout=6) or {}
     except Exception:
-        return {"city": None, "state": None, "country": None, "label": "this area"}
+        return dict(REVERSE_FALLBACK), "fallback"
+    return store_reverse(key, data), "nominatim"
+
+
+def reverse_local(lat, lon):
+    """(place, source) from the gazetteer or the shared cache, or None when Nominatim is needed."""
+    gaz = get_gazetteer()
+    if gaz is not None:
+        hit = gaz.reverse(float(lat), float(lon), GAZETTEER_MAX_KM)
+        if hit:
+            return hit, "gazetteer"
+    cached = geocode_cache.get(reverse_request(lat, lon)[0])
+    if cached is not None:
+        return cached, "cache"
+    return None
 
 
-@lru_cache(maxsize=512)
-def forward_geocode(address: str):
-    """Resolve a free-form address/place name to (lat, lon) using Nominatim."""
+def reverse_request(lat, lon):
+    """(cache key, Nominatim params) for coordinates rounded to GEOCODE_ROUND_DECIMALS."""
+    d = GEOCODE_ROUND_DECIMALS
+    lat, lon = round(float(lat), d), round(float(lon), d)
+    params = {
+        "format": "jsonv2",
+        "lat": str(lat),
+        "lon": str(lon),
+        "zoom": "10",
+        "addressdetails": "1",
+    }
+    return f"reverse:{lat:.{d}f},{lon:.{d}f}", params
+
+
+def store_reverse(key, data):
+    """Place from a Nominatim reverse reply, cached under key."""
+    addr = data.get("address", {})
+    city = (
+        addr.get("city")
+        or addr.get("town")
+        or addr.get("village")
+        or addr.get("suburb")
+        or addr.get("county")
+    )
+    state = addr.get("state") or addr.get("region") or addr.get("state_district")
+    country = addr.get("country")
+    label_parts = [p for p in [city, state, country] if p]
+    label = ", ".join(label_parts) if label_parts else data.get("display_name", "Unknown location")
+    result = {"city": city, "state": state, "country": country, "label": label}
+    geocode_cache.set(key, result, GEOCODE_TTL if label_parts else GEOCODE_NEGATIVE_TTL)
+    return result
+
+
+@profiling.traced()
+def forward_geocode(address: str, centroid_ok=True):
+    """Resolve a free-form address/place name to (lat, lon) using Nominatim.
+
+    centroid_ok=False skips the gazetteer, whose ZIP/place centroids must not
+    stand in for a specific building such as a hospital.
+    """
     if not address:
         return (None, None)
+    started = time.perf_counter()
+    result, source = _forward_lookup(address, centroid_ok)
+    _observe_geocode("forward", source, started)
+    return result
+
+
+def _forward_lookup(address, centroid_ok=True):
+    """((lat, lon), source) where source is gazetteer, cache, nominatim or fallback."""
+    local = forward_local(address, centroid_ok)
+    if local is not None:
+        return local
     try:
         params = {"format": "jsonv2", "q": address, "limit": 1}
-        headers = {"User-Agent": f"hospital-price-finder/1.0 ({NOMINATIM_EMAIL or 'no-email-provided'})"}
-        resp = requests.get(
-            "https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=8
-        )
-        resp.raise_for_status()
-        arr = resp.json() or []
-        if not arr:
-            return (None, None)
-        item = arr[0]
-        lat = item.get("lat")
-        lon = item.get("lon")
+        arr = _nominatim_get("search", params, timeout=8) or []
+    except Exception:
+        return (None, None), "fallback"
+    return store_forward(address, arr), "nominatim"
+
+
+def _forward_key(address):
+    return "forward:" + " ".join(address.lower().split())
+
+
+def forward_local(address, centroid_ok=True):
+    """((lat, lon), source) from the gazetteer or the shared cache, or None when Nominatim is needed."""
+    gaz = get_gazetteer() if centroid_ok else None
+    if gaz is not None:
+        hit = gaz.forward(address)
+        if hit:
+            return hit, "gazetteer"
+    cached = geocode_cache.get(_forward_key(address))
+    if cached is not None:
+        return tuple(cached), "cache"
+    return None
+
+
+def store_forward(address, arr):
+    """(lat, lon) from a Nominatim search reply, cached for the address."""
+    result = (None, None)
+    if arr:
         try:
-            return (float(lat), float(lon))
+            result = (float(arr[0].get("lat")), float(arr[0].get("lon")))
         except Exception:
-            return (None, None)
-    except Exception:
-        return (None, None)
+            pass
+    # "No match" is cached briefly; real coordinates for the full TTL
+    geocode_cache.set(_forward_key(address), result, GEOCODE_TTL if result[0] is not None else GEOCODE_NEGATIVE_TTL)
+    return result
 
 
 # ---------- Hospitals Blueprint ----------
 hospitals_bp = Blueprint("hospitals", __name__)
 
+# Search radius in miles; clients may pass radius_miles within [MIN, MAX]
+HOSPITAL_RADIUS_MILES = float(os.getenv("HOSPITAL_RADIUS_MILES", "37.3"))
+HOSPITAL_RADIUS_MIN_MILES = 1.0
+HOSPITAL_RADIUS_MAX_MILES = float(os.getenv("HOSPITAL_RADIUS_MAX_MILES", "150"))
+
+
+# Hospital catalog: results are reused for CATALOG_MAX_AGE; the model is only asked
+# when fewer than CATALOG_MIN_RESULTS fresh ones fall inside the radius
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", str(7 * 86400)))
+CATALOG_MIN_RESULTS = max(1, int(os.getenv("CATALOG_MIN_RESULTS", "5")))
+CATALOG_RETENTION = int(os.getenv("CATALOG_RETENTION", str(90 * 86400)))
+hospital_catalog = HospitalCatalog(
+    os.getenv("HOSPITAL_CATALOG_PATH") or os.path.join(CACHE_DIR, "hospitals.sqlite3")
+)
+
+# Whole searches are cached per worker: fresh for HOSPITAL_CACHE_TTL, then served
+# stale for up to HOSPITAL_CACHE_STALE_TTL while one background refresh runs
+hospital_search_cache = SWRCache(
+    ttl=int(os.getenv("HOSPITAL_CACHE_TTL", "600")),
+    stale_ttl=int(os.getenv("HOSPITAL_CACHE_STALE_TTL", "3600")),
+    max_entries=int(os.getenv("HOSPITAL_CACHE_MAX_ENTRIES", "512")),
+)
+
+
+def _radius_from_request(data):
+    try:
+        radius = float(data.get("radius_miles") or HOSPITAL_RADIUS_MILES)
+    except (TypeError, ValueError):
+        radius = HOSPITAL_RADIUS_MILES
+    if not math.isfinite(radius):
+        radius = HOSPITAL_RADIUS_MILES
+    return min(max(radius, HOSPITAL_RADIUS_MIN_MILES), HOSPITAL_RADIUS_MAX_MILES)
+
+
+def _maps_url(lat, lon, row):
+    """Driving directions from the requester to a hospital (address preferred over coordinates)."""
+    if row["address"]:
+        return (
+            f"https://www.google.com/maps/dir/?api=1&origin={lat},{lon}&destination={quote(row['address'])}&travelmode=driving"
+        )
+    if isinstance(row["latitude"], (int, float)) and isinstance(row["longitude"], (int, float)):
+        return (
+            f"https://www.google.com/maps/dir/?api=1&origin={lat},{lon}&destination={row['latitude']},{row['longitude']}&travelmode=driving"
+        )
+    return None
+
 
 @hospitals_bp.route("/api/hospitals", methods=["OPTIONS"])  # Preflight if called directly
 def hospitals_options():
     return ("", 204)
 
 
-@hospitals_bp.route("/api/hospitals", methods=["POST"])
-def hospitals():
-    if not OPENROUTER_API_KEY:
-        return jsonify({"error": "Missing OPENROUTER_API_KEY"}), 500
-
-    data = request.get_json(force=True) or {}
-    lat = data.get("lat")
-    lon = data.get("lon")
-    location_query = data.get("location") # NEW: Accept location string
-    condition = (data.get("condition") or "").strip()
-
-    if not condition:
-        return jsonify({"error": "condition required"}), 400
+class HospitalSearchError(Exception):
+    def __init__(self, message, http_status=502):
+        super().__init__(message)
+        self.message = message
+        self.http_status = http_status
 
-    # NEW: If location_query is provided, geocode it.
-    if location_query and (lat is None or lon is None):
-        geocoded_lat, geocoded_lon = forward_geocode(location_query)
-        if geocoded_lat is None or geocoded_lon is None:
-             return jsonify({"error": f"Could not find location: '{location_query}'"}), 400
-        lat, lon = geocoded_lat, geocoded_lon
 
-    if lat is None or lon is None:
-        return jsonify({"error": "Location required (enable GPS or enter city/zip)"}), 400
+@profiling.traced()
+def _ask_model_for_hospitals(city_label, condition, target_miles, known=()):
+    """Raw hospital objects from Perplexity Sonar; raises HospitalSearchError."""
+    import requests  # already loaded by the pooled client
 
+    headers, body = hospitals_request(city_label, condition, target_miles, known)
     try:
-        lat = float(lat)
-        lon = float(lon)
-    except Exception:
-        return jsonify({"error": "lat/lon must be numbers"}), 400
+        # The pooled client counts transport and HTTP errors itself
+        with metrics.llm_call("openrouter", "hospitals", count_errors=False) as call:
+            resp = openrouter_http.post(
+                f"{OPENROUTER_BASE_URL}/chat/completions", headers=headers, json=body, timeout=45
+            )
+            payload = openrouter_payload(resp)
+            call["usage"] = payload.get("usage") if isinstance(payload, dict) else None
+    except requests.RequestException as e:
+        raise HospitalSearchError(f"OpenRouter request failed: {e}", 502)
+    return hospital_items(payload)
 
-    place = reverse_geocode(lat, lon)
-    city_label = place.get("label") or "this area"
+
+def hospitals_request(city_label, condition, target_miles, known=()):
+    """(headers, JSON body) of the OpenRouter chat completion; raises HospitalSearchError."""
+    if not OPENROUTER_API_KEY:
+        raise HospitalSearchError("Missing OPENROUTER_API_KEY", 500)
 
     system_msg = (
         "You are a web-connected data model that must return only structured JSON. "
         "Given a city/region and a medical condition, find and summarize hospitals in that locality "
-        "(target within ~30 miles of the city center) with publicly available or estimated cash/self-pay prices "
+        f"(target within ~{target_miles} miles of the city center) with publicly available or estimated cash/self-pay prices "
         "for the given condition. Each object should include: name, address, phone, url, latitude, longitude, "
         "price_usd, price_is_estimate, and notes. Output strictly a JSON array."
     )
@@ -186,130 +431,277 @@ def hospitals():
         f"locality: {city_label}\n"
         f"condition: {condition}\n\n"
         "Constraints:\n"
-        "- Prefer hospitals in the named locality and adjacent municipalities (≈30 miles).\n"
+        f"- Prefer hospitals in the named locality and adjacent municipalities (≈{target_miles} miles).\n"
         "- If exact cash/self-pay prices are unavailable, estimate sensibly and mark price_is_estimate=true with notes.\n"
         "- Include latitude/longitude if available (helps with distance checks).\n"
         "- Output strictly a JSON array of hospital objects with the requested fields—no extra commentary."
     )
-
-    try:
-        resp = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:5000",
-                "X-Title": "Nearby Hospitals Price Finder",
-            },
-            json={
-                "model": "perplexity/sonar",
-                "messages": [
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                "temperature": 0.2,
-                "max_tokens": 1200,
-                "web_search": True,
-            },
-            timeout=45,
+    if known:
+        user_msg += (
+            "\n- Already known, skip these unless the price has changed: " + "; ".join(known[:20]) + "."
         )
-    except requests.RequestException as e:
-        return jsonify({"error": f"OpenRouter request failed: {e}"}), 502
 
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:5000",
+        "X-Title": "Nearby Hospitals Price Finder",
+    }
+    body = {
+        "model": "perplexity/sonar",
+        "messages": [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": user_msg},
+        ],
+        "temperature": 0.2,
+        "max_tokens": 1200,
+        "web_search": True,
+    }
+    return headers, body
+
+
+def openrouter_payload(resp):
+    """Parsed reply (requests or httpx response); raises HospitalSearchError on an HTTP error."""
     if resp.status_code >= 400:
-        return jsonify({"error": f"OpenRouter error {resp.status_code}: {resp.text[:600]}"}), 502
+        raise HospitalSearchError(f"OpenRouter error {resp.status_code}: {resp.text[:600]}", 502)
+    return resp.json()
 
-    payload = resp.json()
+
+def hospital_items(payload):
+    """The JSON array of hospitals in a chat completion reply; raises HospitalSearchError."""
     try:
         content = payload["choices"][0]["message"]["content"]
     except Exception:
-        return jsonify({"error": "Malformed response from model"}), 502
+        raise HospitalSearchError("Malformed response from model", 502)
 
     items = extract_json(content)
     if not isinstance(items, list):
-        return jsonify({"error": "Model did not return a JSON array"}), 502
+        raise HospitalSearchError("Model did not return a JSON array", 502)
+    return items
+
+
+def _clean_model_items(items, city_label):
+    """Normalize model output into hospital records (URL status checked, coordinates filled in)."""
+    url_statuses = verify_item_urls(items)
+    candidates = []
+    for it in named_items(items):
+        lat2, lon2 = it.get("latitude"), it.get("longitude")
+        if needs_geocode(it):
+            fg_lat, fg_lon = forward_geocode(it["address"], centroid_ok=False)
+            if isinstance(fg_lat, (int, float)) and isinstance(fg_lon, (int, float)):
+                lat2, lon2 = fg_lat, fg_lon
+        candidates.append(hospital_record(it, city_label, url_statuses, lat2, lon2))
+    return candidates
+
+
+def verify_item_urls(items):
+    """{url: status} for every site in the model output, checked in parallel up front.
+
+    Unreachable sites are reported, not dropped.
+    """
+    with profiling.span("verify_urls"), metrics.timed(metrics.URL_VERIFICATION_SECONDS):
+        return url_verifier.verify_many(
+            [it.get("url") for it in items if isinstance(it, dict) and isinstance(it.get("url"), str)],
+            deadline=URL_CHECK_DEADLINE,
+        )
+
+
+def named_items(items):
+    return [it for it in items if isinstance(it, dict) and it.get("name")]
+
+
+def needs_geocode(item):
+    """True when the model gave an address but no usable coordinates."""
+    lat, lon = item.get("latitude"), item.get("longitude")
+    return bool(item.get("address")) and (not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)))
+
 
+def hospital_record(it, city_label, url_statuses, lat, lon):
+    price_raw = it.get("price_usd")
+    try:
+        price_val = float(price_raw) if price_raw is not None else None
+    except Exception:
+        price_val = None
+
+    site_url = it.get("url")
+    return {
+        "name": it.get("name"),
+        "address": it.get("address"),
+        "phone": it.get("phone"),
+        "url": site_url,
+        "url_status": url_statuses.get(site_url) if isinstance(site_url, str) else None,
+        "latitude": lat,
+        "longitude": lon,
+        "distance_miles": None,
+        "price_usd": price_val,
+        "price_is_estimate": bool(it.get("price_is_estimate", True)),
+        "notes": it.get("notes"),
+        "maps_url": None,
+        "source_locality": city_label,
+    }
+
+
+def _localize(candidates, lat, lon, radius, sort_by):
+    """Per-requester view: distances, radius cut (unknown distances kept), ordering, directions."""
+    import numpy as np  # only the hospitals path needs it
+    import geo
+
+    lats, lons = geo.coords_array(candidates)
+    dists = geo.distances_miles(lat, lon, lats, lons)
+    prices = np.array([np.nan if c["price_usd"] is None else c["price_usd"] for c in candidates], dtype=float)
+    keep = geo.within_radius(dists, radius)
     cleaned = []
-    for it in items:
-        if not isinstance(it, dict):
-            continue
-        name = it.get("name")
-        if not name:
+    for i in geo.order(dists, prices, by=sort_by):
+        if not keep[i]:
             continue
+        row = candidates[i]
+        row["distance_miles"] = None if np.isnan(dists[i]) else round(float(dists[i]), 2)
+        row["maps_url"] = _maps_url(lat, lon, row)
+        cleaned.append(row)
+    return cleaned
 
-        site_url = it.get("url")
-        if site_url and not verify_url(site_url):
-            continue
 
-        addr = it.get("address")
-        lat2 = it.get("latitude")
-        lon2 = it.get("longitude")
+def _search_hospitals(lat, lon, condition, radius, city_label, locality):
+    """Hospital records for a locality and condition, independent of who is asking.
 
-        dist_miles = None
-        if isinstance(lat2, (int, float)) and isinstance(lon2, (int, float)):
-            try:
-                dist_miles = round(haversine_miles(lat, lon, float(lat2), float(lon2)), 2)
-                if dist_miles is not None and dist_miles > 37.3:
-                    continue
-            except Exception:
-                pass
+    Returns {"hospitals": [...], "source": ...} with distances unset; raises
+    HospitalSearchError when nothing can be returned.
+    """
+    catalog_rows, in_radius = catalog_lookup(lat, lon, condition, radius, locality)
+    if len(in_radius) >= CATALOG_MIN_RESULTS:
+        return {"hospitals": catalog_rows, "source": "catalog"}
+    try:
+        items = _ask_model_for_hospitals(
+            city_label, condition, model_target_miles(radius), known=[r["name"] for r in in_radius]
+        )
+    except HospitalSearchError as e:
+        return catalog_fallback(catalog_rows, in_radius, e)
+    return merge_fresh(catalog_rows, _clean_model_items(items, city_label), condition)
 
-        if (not isinstance(lat2, (int, float)) or not isinstance(lon2, (int, float))) and addr:
-            fg_lat, fg_lon = forward_geocode(addr)
-            if isinstance(fg_lat, (int, float)) and isinstance(fg_lon, (int, float)):
-                lat2, lon2 = fg_lat, fg_lon
 
-        maps_url = None
-        if addr:
-            maps_url = (
-                f"https://www.google.com/maps/dir/?api=1&origin={lat},{lon}&destination={requests.utils.quote(addr)}&travelmode=driving"
-            )
-        elif isinstance(lat2, (int, float)) and isinstance(lon2, (int, float)):
-            maps_url = (
-                f"https://www.google.com/maps/dir/?api=1&origin={lat},{lon}&destination={lat2},{lon2}&travelmode=driving"
-            )
+def model_target_miles(radius):
+    # The model is asked for a little less than the hard cutoff, as before (30 of 37.3 mi)
+    return max(1, round(radius * 0.8))
 
-        price_raw = it.get("price_usd")
-        try:
-            price_val = float(price_raw) if price_raw is not None else None
-        except Exception:
-            price_val = None
 
-        cleaned.append(
-            {
-                "name": name,
-                "address": addr,
-                "phone": it.get("phone"),
-                "url": site_url,
-                "latitude": lat2,
-                "longitude": lon2,
-                "distance_miles": dist_miles,
-                "price_usd": price_val,
-                "price_is_estimate": bool(it.get("price_is_estimate", True)),
-                "notes": it.get("notes"),
-                "maps_url": maps_url,
-                "source_locality": city_label,
-            }
+def catalog_lookup(lat, lon, condition, radius, locality):
+    """(catalog rows, rows inside the radius); the model is asked when too few are inside.
+
+    Rows are fetched SEARCH_CELL_MILES beyond the radius, so they cover
+    everyone whose search_origin() is (lat, lon).
+    """
+    with profiling.span("catalog_search"):
+        catalog_rows = hospital_catalog.search(
+            lat, lon, radius + SEARCH_CELL_MILES, condition, CATALOG_MAX_AGE, locality=locality
         )
+    in_radius = _localize([dict(r) for r in catalog_rows], lat, lon, radius, "price")
+    metrics.cache_lookup("hospital_catalog", len(in_radius) >= CATALOG_MIN_RESULTS)
+    return catalog_rows, in_radius
+
+
+def catalog_fallback(catalog_rows, in_radius, error):
+    """Serve what the catalog has when the model search failed; re-raise when it has nothing."""
+    if not in_radius:
+        raise error
+    app.logger.warning("Serving %d catalog results; model search failed: %s", len(in_radius), error.message)
+    return {"hospitals": catalog_rows, "source": "catalog"}
+
+
+def merge_fresh(catalog_rows, fresh, condition):
+    """Store fresh model results in the catalog and merge them over the catalog rows."""
+    try:
+        hospital_catalog.upsert(fresh, condition)
+    except Exception as e:
+        app.logger.warning("Hospital catalog update failed: %s", e)
+    merged = {record_key(r["name"], r["address"]): r for r in catalog_rows}
+    merged.update((record_key(r["name"], r["address"]), r) for r in fresh)
+    return {"hospitals": list(merged.values()), "source": "catalog+model" if catalog_rows else "model"}
+
+
+# Farthest a requester can be from their cell's centre (half the diagonal of 0.1 degree)
+SEARCH_CELL_MILES = 5.0
+
+
+def search_origin(lat, lon):
+    """Centre of the ~11 km (0.1 degree) cell a requester falls in."""
+    return round(lat, 1), round(lon, 1)
+
+
+def search_cache_key(place, lat, lon, condition, radius):
+    """(locality, city label, key) for the per-worker search cache.
+
+    Searches are shared per locality and ~11 km cell, condition and radius:
+    the candidates are found from the cell's centre (search_origin), so they
+    suit anyone in it, and distances and directions are recomputed for each
+    requester.
+    """
+    city_label = place.get("label") or "this area"
+    locality = city_label if place.get("city") or place.get("state") else None
+    key = (locality, "cell:%.1f,%.1f" % search_origin(lat, lon), normalize_condition(condition), round(radius))
+    return locality, city_label, key
+
+
+@hospitals_bp.route("/api/hospitals", methods=["POST"])
+def hospitals():
+    data = request.get_json(force=True) or {}
+    lat = data.get("lat")
+    lon = data.get("lon")
+    location_query = data.get("location") # NEW: Accept location string
+    condition = (data.get("condition") or "").strip()
+    radius = _radius_from_request(data)
+    sort_by = "distance" if data.get("sort") == "distance" else "price"
+
+    if not condition:
+        return jsonify({"error": "condition required"}), 400
 
-    cleaned.sort(
-        key=lambda r: (
-            float("inf") if r["price_usd"] is None else r["price_usd"],
-            float("inf") if r.get("distance_miles") is None else r["distance_miles"],
+    # NEW: If location_query is provided, geocode it.
+    if location_query and (lat is None or lon is None):
+        geocoded_lat, geocoded_lon = forward_geocode(location_query)
+        if geocoded_lat is None or geocoded_lon is None:
+             return jsonify({"error": f"Could not find location: '{location_query}'"}), 400
+        lat, lon = geocoded_lat, geocoded_lon
+
+    if lat is None or lon is None:
+        return jsonify({"error": "Location required (enable GPS or enter city/zip)"}), 400
+
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except Exception:
+        return jsonify({"error": "lat/lon must be numbers"}), 400
+
+    place = reverse_geocode(lat, lon)
+    locality, city_label, cache_key = search_cache_key(place, lat, lon, condition, radius)
+    try:
+        found, cache_status = hospital_search_cache.get(
+            cache_key, lambda: _search_hospitals(*search_origin(lat, lon), condition, radius, city_label, locality)
         )
-    )
+    except HospitalSearchError as e:
+        return jsonify({"error": e.message}), e.http_status
+    metrics.cache_lookup("hospital_search", cache_status.lower())
 
-    return jsonify({"results": cleaned})
+    results = _localize([dict(r) for r in found["hospitals"]], lat, lon, radius, sort_by)
+    resp = jsonify({"results": results, "radius_miles": radius, "sort": sort_by, "source": found["source"]})
+    resp.headers["X-Cache"] = cache_status
+    return resp
 
 
 # ---------- Dispute Blueprint ----------
 dispute_bp = Blueprint("dispute", __name__)
 
 # Folders for dispute assets (relative to repo structure)
-SERVER_DIR = os.path.dirname(__file__)
 DISPUTE_DIR = os.path.abspath(os.path.join(SERVER_DIR, "..", "dispute"))
 UPLOAD_FOLDER = os.path.join(DISPUTE_DIR, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are stored by content hash; small ones are parsed from memory and only
+# written to disk when a background job needs them. Oversized requests get a 413.
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", "32")) * 1024 * 1024
+upload_store = UploadStore(
+    UPLOAD_FOLDER,
+    memory_max_bytes=int(os.getenv("UPLOAD_MEMORY_MAX_MB", "4")) * 1024 * 1024,
+    max_age=int(os.getenv("UPLOAD_MAX_AGE", str(24 * 3600))),
+    max_total_bytes=int(os.getenv("UPLOAD_MAX_TOTAL_MB", "512")) * 1024 * 1024,
+)
 POLICY_DOCS_DIR = os.path.join(DISPUTE_DIR, "policy_docs")
 PROVIDER_RULES = {
     "United": os.path.join(POLICY_DOCS_DIR, "United Healthcare Charge Policy.pdf"),
@@ -318,21 +710,135 @@ PROVIDER_RULES = {
     "CMS": os.path.join(POLICY_DOCS_DIR, "CMS Charge.pdf"),
 }
 
-# OpenAI client (if key provided)
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Extracted policy text is cached on disk by content hash and shared by all workers
+pdf_text_cache = PdfTextCache(
+    os.path.join(CACHE_DIR, "pdf_text"),
+    max_bytes=int(os.getenv("PDF_TEXT_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+
+# Only the top-k policy sections matching the bill are sent to the model;
+# policies shorter than POLICY_FULL_TEXT_MAX_CHARS are sent whole.
+POLICY_TOP_K = int(os.getenv("POLICY_TOP_K", "8"))
+POLICY_FULL_TEXT_MAX_CHARS = int(os.getenv("POLICY_FULL_TEXT_MAX_CHARS", "12000"))
+POLICY_INDEX_CACHE_SIZE = 16
+_policy_indexes = OrderedDict()  # rules sha256 -> PolicyIndex
+_policy_indexes_lock = threading.Lock()
+
+# OpenAI client (if key provided), built on first use: importing the SDK takes
+# longer than the rest of startup, and the hospitals path never needs it
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """The shared OpenAI client, or None without OPENAI_API_KEY."""
+    global _openai_client
+    if _openai_client is None and OPENAI_API_KEY:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+
+                _openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    http_client=cassette.httpx_client(upstream_cassette) if upstream_cassette is not None else None,
+                )
+    return _openai_client
+
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+
+# Analysis prompts are compacted (page headers/footers repeated on every page
+# dropped, whitespace collapsed) and cut to a per-model token budget, given as
+# "32000" or "gpt-4.1-mini=32000,gpt-4o=20000". The bill extract takes at most
+# PROMPT_BILL_MAX_SHARE of it; the best-matching rules sections fill the rest.
+PROMPT_TOKEN_BUDGETS = prompt_budget.parse_budgets(os.getenv("PROMPT_TOKEN_BUDGET", ""))
+PROMPT_TOKEN_BUDGET_DEFAULT = 32000
+PROMPT_BILL_MAX_SHARE = float(os.getenv("PROMPT_BILL_MAX_SHARE", "0.6"))
+
+# Optional reference charges (CSV: code,max_charge per unit, e.g. from the hospital's
+# published standard charges); lines at or below theirs are verified by the pre-screen
+REFERENCE_CHARGES_PATH = os.getenv("REFERENCE_CHARGES_PATH")
+REFERENCE_CHARGES = prescreen.load_reference_charges(REFERENCE_CHARGES_PATH) if REFERENCE_CHARGES_PATH else {}
+REFERENCE_CHARGES_DIGEST = sha256_bytes(json.dumps(sorted(REFERENCE_CHARGES.items())).encode("utf-8"))[:16]
+
+# Analyses and letters are memoized (every call uses temperature=0), keyed by bill
+# and rules content hashes, model and normalized patient context; shared by all workers
+ANALYSIS_CACHE_VERSION = 4  # bump when prompts or the payload shape change
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 86400)))
+analysis_cache = SqliteTTLCache(
+    os.path.join(CACHE_DIR, "analysis.sqlite3"),
+    table="analysis",
+    max_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_MB", "64")) * 1024 * 1024,
+)
+_UNEXPECTED_FORMAT = "Model returned unexpected format."
+
+# /analyze returns an analysis_id; the letter is drafted when it is requested from
+# /api/dispute/analyses/<id>/letter, or in the background right after the
+# analysis with LETTER_PREGENERATE=1. Records are kept ANALYSIS_RECORD_TTL seconds.
+ANALYSIS_RECORD_TTL = int(os.getenv("ANALYSIS_RECORD_TTL", "86400"))
+LETTER_PREGENERATE = os.getenv("LETTER_PREGENERATE", "0") == "1"
+letter_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LETTER_WORKERS", "2")), thread_name_prefix="letter")
+_letters_in_flight = {}  # letter cache key -> Future of a draft running in this worker
+_letters_lock = threading.Lock()
+
+
+@profiling.traced()
+def extract_text_from_pdf(file_path):
+    """Extract all page text, fanning long documents out over the process pool."""
+    with metrics.timed(metrics.PDF_EXTRACTION_SECONDS, "text"):
+        return pdf_extract.extract_text(file_path)
 
 
-def extract_text_from_pdf(file_path):
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text
+def load_policy_pages(source, digest=None):
+    """Per-page rules text, served from the shared cache when the content is known.
+
+    source is a path or a file-like object; in-memory sources must pass digest.
+    """
+    digest = digest or pdf_text_cache.hash_file(source)
+    extracted = []
+
+    def extract():
+        extracted.append(True)
+        with metrics.timed(metrics.PDF_EXTRACTION_SECONDS, "rules"):
+            return json.dumps(pdf_extract.extract_pages(source))
+
+    raw = pdf_text_cache.get_or_compute(digest, extract, kind="pages")
+    metrics.cache_lookup("pdf_text", not extracted)
+    return json.loads(raw)
+
+
+def get_policy_index(source, digest=None):
+    """Return the BM25 section index for a rules PDF, building it on first use."""
+    digest = digest or pdf_text_cache.hash_file(source)
+    with _policy_indexes_lock:
+        index = _policy_indexes.get(digest)
+        if index is not None:
+            _policy_indexes.move_to_end(digest)
+            return index
+    raw_pages = load_policy_pages(source, digest)
+    pages, lines_removed = prompt_budget.compact_pages(raw_pages)
+    index = PolicyIndex.from_pages(pages)
+    index.lines_removed = lines_removed
+    index.tokens_removed = max(0, prompt_budget.count_tokens("\n".join(raw_pages), OPENAI_MODEL)
+                               - prompt_budget.count_tokens("\n".join(pages), OPENAI_MODEL))
+    with _policy_indexes_lock:
+        _policy_indexes[digest] = index
+        while len(_policy_indexes) > POLICY_INDEX_CACHE_SIZE:
+            _policy_indexes.popitem(last=False)
+    return index
+
+
+def warm_policy_cache():
+    """Extract and index the bundled provider policies."""
+    for rules_path in PROVIDER_RULES.values():
+        try:
+            get_policy_index(rules_path)
+        except Exception as e:
+            app.logger.warning("Policy warm-up failed for %s: %s", rules_path, e)
 
 
 def ai_check_overcharges(rules_text, bill_text):
+    client = get_openai_client()
     if client is None:
         raise RuntimeError("Missing OPENAI_API_KEY")
     prompt = f"""
@@ -349,14 +855,17 @@ def ai_check_overcharges(rules_text, bill_text):
     - For each, provide line number, service, amount, and reason.
     - If none, say "No overcharges detected".
     """
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-    )
+    with metrics.llm_call("openai", "overcharges") as call:
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+        )
+        call["usage"] = response.usage
     return response.choices[0].message.content
 
 
+@profiling.traced()
 def ai_check_overcharges_and_discount(rules_text, bill_text, household_size, annual_income, zip_code):
     """Structured AI analysis returning a dict.
 
@@ -369,9 +878,33 @@ def ai_check_overcharges_and_discount(rules_text, bill_text, household_size, ann
 
     We instruct the model to emit strict JSON to reduce fragile downstream parsing.
     """
+    client = get_openai_client()
     if client is None:
         raise RuntimeError("Missing OPENAI_API_KEY")
 
+    system_instructions, user_prompt = _analysis_prompt(rules_text, bill_text, household_size, annual_income, zip_code)
+    with profiling.span("openai_call"), metrics.llm_call("openai", "analysis") as call:
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": system_instructions},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0,
+        )
+        call["usage"] = response.usage
+    raw_text = response.choices[0].message.content.strip()
+    return _normalize_analysis(raw_text)
+
+
+@profiling.traced("build_prompt")
+def _analysis_prompt(rules_text, bill_text, household_size, annual_income, zip_code):
+    """(system, user) messages for the structured analysis."""
+    return _analysis_messages(rules_text, bill_text, household_size, annual_income, zip_code)
+
+
+def _analysis_messages(rules_text, bill_text, household_size, annual_income, zip_code):
+    """The analysis template, untraced (also measured by _analysis_template_tokens)."""
     # Strengthen system instructions & embed strict mini-schema to maximize structured reliability
     system_instructions = (
         "You are a hospital billing auditor AI. OUTPUT ONLY VALID JSON. No commentary outside JSON. "
@@ -397,18 +930,13 @@ def ai_check_overcharges_and_discount(rules_text, bill_text, household_size, ann
     }
 
     user_prompt = f"""
-Hospital Rules Document (extract):\n{rules_text}\n\nPatient Bill (extract):\n{bill_text}\n\nContext:\nHousehold Size: {household_size}\nAnnual Income: {annual_income}\nZIP Code: {zip_code}\n\nTasks:\n1. Identify any overcharges referencing rule rationale precisely (section/page if available).\n2. Infer two-letter state from ZIP (or null if unsure).\n3. Estimate total eligible discount considering state programs, provider policy, and federal (CMS) where applicable. Use numeric percent without % symbol.\n4. Provide concise multi-line discount_explanation summarizing derivation components.\n5. Ensure overcharges array is empty when none found.\n\nReturn ONLY JSON with exactly these keys. Example structure: {json.dumps(json_schema_description, separators=(',',':'))}\n"""
+Hospital Rules Document (extract):\n{rules_text}\n\nPatient Bill (extract):\n{bill_text}\n\nContext:\nHousehold Size: {household_size}\nAnnual Income: {annual_income}\nZIP Code: {zip_code}\n\nTasks:\n1. Identify any overcharges referencing rule rationale precisely (section/page if available). Lines with a 'check:' note under Pre-screen notes were flagged by automatic rules; confirm or dismiss each (e.g. repeated doses of a drug are not duplicates).\n2. Infer two-letter state from ZIP (or null if unsure).\n3. Estimate total eligible discount considering state programs, provider policy, and federal (CMS) where applicable. Use numeric percent without % symbol.\n4. Provide concise multi-line discount_explanation summarizing derivation components.\n5. Ensure overcharges array is empty when none found.\n\nReturn ONLY JSON with exactly these keys. Example structure: {json.dumps(json_schema_description, separators=(',',':'))}\n"""
+    return system_instructions, user_prompt
 
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": system_instructions},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0,
-    )
-    raw_text = response.choices[0].message.content.strip()
 
+@profiling.traced("normalize_json")
+def _normalize_analysis(raw_text):
+    """Parse and coerce the model reply into the structured analysis dict."""
     # Attempt to extract JSON robustly
     data = extract_json(raw_text)
     if not isinstance(data, dict):
@@ -416,7 +944,7 @@ Hospital Rules Document (extract):\n{rules_text}\n\nPatient Bill (extract):\n{bi
         data = {
             "state_abbr": None,
             "total_eligible_discount_percent": None,
-            "discount_explanation": "Model returned unexpected format.",
+            "discount_explanation": _UNEXPECTED_FORMAT,
             "overcharges": [],
         }
 
@@ -501,25 +1029,52 @@ def _format_overcharge_report_for_letter(structured):
     return "\n".join(lines)
 
 
-def draft_dispute_letter(patient_name, hospital_name, bill_text, structured_report):
-    if client is None:
-        raise RuntimeError("Missing OPENAI_API_KEY")
+def _dispute_letter_prompt(patient_name, hospital_name, structured_report):
     readable_summary = _format_overcharge_report_for_letter(structured_report)
-    prompt = f"""
+    return f"""
 Draft a formal, concise yet firm letter to dispute identified overcharges for patient {patient_name} at {hospital_name}.
 Include citation to financial assistance and discount eligibility if relevant. Maintain professional tone.
 
 Structured Analysis Summary:
 {readable_summary}
 """
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-    )
+
+
+@profiling.traced()
+def draft_dispute_letter(patient_name, hospital_name, bill_text, structured_report):
+    client = get_openai_client()
+    if client is None:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    with metrics.llm_call("openai", "letter") as call:
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": _dispute_letter_prompt(patient_name, hospital_name, structured_report)}],
+            temperature=0,
+        )
+        call["usage"] = response.usage
     return response.choices[0].message.content
 
 
+def draft_dispute_letter_stream(patient_name, hospital_name, bill_text, structured_report):
+    """Same letter as draft_dispute_letter, yielded as text deltas while the model generates it."""
+    client = get_openai_client()
+    if client is None:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    with profiling.span("draft_dispute_letter_stream"), metrics.llm_call("openai", "letter_stream") as call:
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": _dispute_letter_prompt(patient_name, hospital_name, structured_report)}],
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},  # usage arrives on a final chunk without choices
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                call["usage"] = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
 def overcharges_found(ai_result) -> bool:
     """Return True if overcharges were found.
 
@@ -542,91 +1097,454 @@ def dispute_home():
     return jsonify({"status": "ok", "providers": list(PROVIDER_RULES.keys())})
 
 
-@dispute_bp.route("/api/dispute/analyze", methods=["POST"])  # multipart/form-data expected
-def analyze():
-    provider = request.form.get('provider')
-    uploaded_rules = request.files.get('rules_pdf')
-    bill_file = request.files.get('bill_pdf')
+class DisputeError(JobError):
+    """Dispute pipeline failure carrying the HTTP status to report."""
+
+
+def _build_legacy_summary(ai_structured):
+    """Simple legacy summary text similar to the old format, for backward compatibility."""
+    legacy_lines = []
+    if ai_structured.get("overcharges"):
+        legacy_lines.append("Overcharges:")
+        for oc in ai_structured["overcharges"]:
+            ln = oc.get("line_number")
+            svc = oc.get("service")
+            amt = oc.get("amount")
+            amt_str = f"${amt:,.2f}" if isinstance(amt, (int, float)) else "(n/a)"
+            legacy_lines.append(f"- Line {ln}: {svc} {amt_str} | Reason: {oc.get('reason')}")
+    else:
+        legacy_lines.append("Overcharges: No overcharges detected")
+    if ai_structured.get("state_abbr"):
+        legacy_lines.append(f"State: {ai_structured['state_abbr']}")
+    if ai_structured.get("total_eligible_discount_percent") is not None:
+        legacy_lines.append(
+            f"Total Eligible Discount: {int(ai_structured['total_eligible_discount_percent'])}%"
+        )
+    if ai_structured.get("discount_explanation"):
+        legacy_lines.append(ai_structured["discount_explanation"].strip())
+    return "\n".join(legacy_lines)
+
+
+def _receive_pdf(stream, kind, persist):
+    """{kind}_path/_digest/_data params for an uploaded PDF.
+
+    With persist the file is written to the upload store (jobs need a path and
+    JSON-serializable params) and pinned against the sweeper until the job
+    calls release_uploads(); otherwise small files stay in memory.
+    """
+    with profiling.span("receive_upload", kind=kind):
+        upload = upload_store.receive(stream)
+    if upload.size == 0:
+        raise DisputeError(f"The uploaded {kind} PDF is empty.", 400)
+    params = {}
+    if persist:
+        params[f"{kind}_pin"] = upload_store.pin(upload.digest)
+        upload_store.persist(upload)
+    return {
+        **params,
+        f"{kind}_path": upload.path,
+        f"{kind}_digest": upload.digest,
+        f"{kind}_data": None if upload.path else upload.data,
+    }
+
+
+def release_uploads(params):
+    """Unpin the stored uploads a job was holding."""
+    for kind in ("bill", "rules"):
+        if params.get(f"{kind}_pin"):
+            upload_store.unpin(params[f"{kind}_pin"])
+
+
+def _pdf_source(params, kind):
+    data = params.get(f"{kind}_data")
+    return io.BytesIO(data) if data is not None else params[f"{kind}_path"]
+
+
+def _pdf_digest(params, kind):
+    return params.get(f"{kind}_digest") or pdf_text_cache.hash_file(params[f"{kind}_path"])
+
+
+def _dispute_context_from_request(persist=False):
+    """Rules and patient context from the multipart form, shared by every bill in it."""
+    return dispute_context(request.form, _upload_of(request.files.get('rules_pdf')), persist)
+
+
+def _dispute_params_from_request(persist=False):
+    """Validate the multipart form, receive the uploads, and return pipeline params."""
+    return dispute_params(
+        request.form, _upload_of(request.files.get('bill_pdf')), _upload_of(request.files.get('rules_pdf')), persist
+    )
+
+
+def _upload_of(file_storage):
+    return (file_storage.filename, file_storage.stream) if file_storage else None
+
+
+def dispute_context(form, rules_upload, persist=False):
+    """Rules and patient context from form fields; uploads are (filename, binary stream) or None."""
+    provider = form.get('provider')
     # Optional patient context (backward compatible defaults)
     try:
-        household_size = int(request.form.get('household_size', 1))
+        household_size = int(form.get('household_size', 1))
     except Exception:
         household_size = 1
     try:
-        annual_income = float(request.form.get('annual_income', 0))
+        annual_income = float(form.get('annual_income', 0))
     except Exception:
         annual_income = 0.0
-    zip_code = request.form.get('zip_code', '')
+    zip_code = form.get('zip_code', '')
 
-    if not bill_file:
-        return jsonify({"error": "Please upload a patient bill PDF."}), 400
+    params = {}
+    if rules_upload and rules_upload[0]:
+        if not rules_upload[0].lower().endswith('.pdf'):
+            raise DisputeError("Rules file must be a PDF.", 415)
+        params.update(_receive_pdf(rules_upload[1], "rules", persist))
+    elif provider in PROVIDER_RULES:
+        params.update(rules_path=PROVIDER_RULES[provider], rules_digest=None, rules_data=None)
+    else:
+        raise DisputeError("No rules PDF selected or provider invalid.", 400)
 
-    if not bill_file.filename.lower().endswith('.pdf'):
-        return jsonify({"error": "Only PDF files are supported for now."}), 415
+    return {
+        **params,
+        "provider": provider,
+        "patient_name": form.get('patient_name', 'John Doe'),
+        "household_size": household_size,
+        "annual_income": annual_income,
+        "zip_code": zip_code,
+    }
+
+
+def dispute_params(form, bill_upload, rules_upload, persist=False):
+    """Pipeline params for one bill; raises DisputeError on invalid input."""
+    if not bill_upload:
+        raise DisputeError("Please upload a patient bill PDF.", 400)
 
-    bill_path = os.path.join(UPLOAD_FOLDER, bill_file.filename)
-    bill_file.save(bill_path)
+    if not bill_upload[0].lower().endswith('.pdf'):
+        raise DisputeError("Only PDF files are supported for now.", 415)
+
+    params = dispute_context(form, rules_upload, persist)
     try:
-        bill_text = extract_text_from_pdf(bill_path)
-    except Exception as e:
-        return jsonify({"error": f"Failed to read bill PDF: {e}"}), 400
-
-    rules_path = None
-    if uploaded_rules and uploaded_rules.filename:
-        if not uploaded_rules.filename.lower().endswith('.pdf'):
-            return jsonify({"error": "Rules file must be a PDF."}), 415
-        rules_path = os.path.join(UPLOAD_FOLDER, uploaded_rules.filename)
-        uploaded_rules.save(rules_path)
-    elif provider in PROVIDER_RULES:
-        rules_path = PROVIDER_RULES[provider]
+        params.update(_receive_pdf(bill_upload[1], "bill", persist))
+    except Exception:
+        release_uploads(params)  # don't leave the rules pinned for a job that never runs
+        raise
+    return params
+
+
+def _letter_args(record, patient_name):
+    return (
+        patient_name,
+        record["provider"] if record["provider"] else 'Custom Provider',
+        None,  # the letter is written from the structured analysis alone
+        record["ai_structured"],
+    )
+
+
+def analysis_token_budget():
+    return prompt_budget.model_budget(OPENAI_MODEL, PROMPT_TOKEN_BUDGETS, PROMPT_TOKEN_BUDGET_DEFAULT)
+
+
+@functools.lru_cache(maxsize=1)
+def _analysis_template_tokens():
+    """Tokens of the analysis messages with empty rules and bill (the fixed part)."""
+    system, user = _analysis_messages("", "", 0, 0, "00000")
+    return prompt_budget.count_tokens(system, OPENAI_MODEL) + prompt_budget.count_tokens(user, OPENAI_MODEL)
+
+
+def _compact_analysis_inputs(bill, screen, policy_index):
+    """Bill extract and rules context for the analysis prompt, fitted to the token budget.
+
+    The bill goes first (capped at PROMPT_BILL_MAX_SHARE of what the template
+    leaves, with the pre-screen notes kept whole at its end), then the
+    best-matching rules sections while they fit.
+    Returns (review_text, rules_text, rules_chunks_used, report).
+    """
+    count = lambda text: prompt_budget.count_tokens(text, OPENAI_MODEL)
+    pages, lines_removed = prompt_budget.compact_pages(bill["pages"])
+    notes = prescreen.format_screen_notes(screen)
+    raw_review = bill["text"] + notes
+
+    with profiling.span("select_policy_sections"):
+        candidates = policy_index.candidates(
+            bill["text"], top_k=POLICY_TOP_K, full_text_max_chars=POLICY_FULL_TEXT_MAX_CHARS
+        )
+        all_rules, all_chunks = policy_index.render(candidates)
+        budget = analysis_token_budget()
+        available = max(0, budget - _analysis_template_tokens())
+        review_text = prompt_budget.truncate_tokens(
+            "\n".join(p for p in pages if p), int(available * PROMPT_BILL_MAX_SHARE) - count(notes), OPENAI_MODEL
+        )
+        bill_truncated = review_text.endswith(prompt_budget.TRUNCATION_MARKER)
+        if notes:
+            review_text += "\n\n" + notes
+        review_tokens = count(review_text)
+        rules_text, rules_chunks_used = policy_index.render(
+            candidates, max_tokens=available - review_tokens, count_tokens=count
+        )
+
+    template = _analysis_template_tokens()
+    tokens = template + review_tokens + count(rules_text)
+    # The rules were compacted when the index was built; add back what that removed
+    raw_tokens = template + count(raw_review) + count(all_rules) + policy_index.tokens_removed
+    metrics.PROMPT_TOKENS_SAVED.inc(max(0, raw_tokens - tokens))
+    report = {
+        "tokenizer": prompt_budget.tokenizer_name(OPENAI_MODEL),
+        "budget": budget,
+        "tokens": tokens,
+        "raw_tokens": raw_tokens,
+        "saved_tokens": max(0, raw_tokens - tokens),
+        "bill_truncated": bill_truncated,
+        "rules_chunks_dropped": len(all_chunks) - len(rules_chunks_used),
+        "boilerplate_lines_removed": lines_removed + policy_index.lines_removed,
+    }
+    return review_text, rules_text, rules_chunks_used, report
+
+
+def _analysis_cache_key(params):
+    """Memo key for an analysis, or None when caching is off or a file can't be hashed."""
+    if ANALYSIS_CACHE_TTL <= 0:
+        return None
+    try:
+        bill_digest = _pdf_digest(params, "bill")
+        rules_digest = _pdf_digest(params, "rules")
+    except OSError:
+        return None
+    context = [
+        ANALYSIS_CACHE_VERSION,
+        bill_digest,
+        rules_digest,
+        OPENAI_MODEL,
+        POLICY_TOP_K,
+        POLICY_FULL_TEXT_MAX_CHARS,
+        analysis_token_budget(),
+        PROMPT_BILL_MAX_SHARE,
+        REFERENCE_CHARGES_DIGEST,
+        int(params["household_size"]),
+        round(float(params["annual_income"]), 2),
+        re.sub(r"\D", "", str(params["zip_code"] or ""))[:5],
+    ]
+    return "analysis:" + sha256_bytes(json.dumps(context).encode("utf-8"))
+
+
+def _analysis_record(params, ai_structured, analysis_key):
+    """What the letter endpoint needs to draft a letter for an analysis."""
+    return {
+        "analysis_key": analysis_key,
+        "provider": params["provider"] or "",
+        "patient_name": " ".join(str(params["patient_name"]).split()),
+        "ai_structured": ai_structured,
+    }
+
+
+def remember_analysis(params, ai_structured, analysis_key):
+    """Store the analysis record and return its analysis_id.
+
+    The id is derived from the memo key and addressee, so a repeated analysis
+    maps to the same record and letter; uncacheable analyses get a random id.
+    """
+    record = _analysis_record(params, ai_structured, analysis_key)
+    if analysis_key:
+        addressee = json.dumps([analysis_key, record["provider"], record["patient_name"]])
+        analysis_id = sha256_bytes(addressee.encode("utf-8"))[:32]
     else:
-        return jsonify({"error": "No rules PDF selected or provider invalid."}), 400
+        analysis_id = uuid.uuid4().hex
+    analysis_cache.set("analysis-record:" + analysis_id, record, ANALYSIS_RECORD_TTL)
+    if LETTER_PREGENERATE and overcharges_found(ai_structured):
+        letter_pool.submit(_pregenerate_letter, record)
+    return analysis_id
 
+
+def get_analysis_record(analysis_id):
+    if not analysis_id.isalnum():
+        return None
+    return analysis_cache.get("analysis-record:" + analysis_id)
+
+
+def _letter_cache_key(record, patient_name):
+    if not record["analysis_key"]:
+        return None
+    addressee = json.dumps([patient_name, record["provider"]])
+    return record["analysis_key"] + ":letter:" + sha256_bytes(addressee.encode("utf-8"))
+
+
+def dispute_letter(record, patient_name=None):
+    """Letter for an analysis record; returns (letter, cached).
+
+    Served from the shared cache, or from a draft of the same letter already
+    running in this worker (e.g. pregeneration), before calling the model. If
+    that draft fails, the letter is drafted once more here, as the stream does.
+    """
+    patient_name = " ".join(str(patient_name or record["patient_name"]).split())
+    key = _letter_cache_key(record, patient_name)
+    letter = analysis_cache.get(key) if key else None
+    if key:
+        metrics.cache_lookup("letter", letter is not None)
+    if letter is not None:
+        return letter, True
+    with _letters_lock:
+        pending = _letters_in_flight.get(key) if key else None
+        if pending is None:
+            future = Future()
+            if key:
+                _letters_in_flight[key] = future
+    if pending is not None:
+        try:
+            return pending.result(), True
+        except Exception:
+            pass  # the background draft failed; draft it again below unless another waiter is
+        letter = None
+        with _letters_lock:
+            current = _letters_in_flight.get(key)
+            if current is None or current is pending:
+                # A retry that already finished has stored its letter before unregistering
+                letter = analysis_cache.get(key)
+                if letter is None:
+                    future = Future()
+                    _letters_in_flight[key] = future
+        if letter is not None:
+            return letter, True
+        if current is not None and current is not pending:
+            return current.result(), True
     try:
-        rules_text = extract_text_from_pdf(rules_path)
+        letter = draft_dispute_letter(*_letter_args(record, patient_name))
+        if key:
+            analysis_cache.set(key, letter, ANALYSIS_CACHE_TTL)
+        future.set_result(letter)
+        return letter, False
     except Exception as e:
-        return jsonify({"error": f"Failed to read rules PDF: {e}"}), 400
+        future.set_exception(e)
+        raise
+    finally:
+        with _letters_lock:
+            if key and _letters_in_flight.get(key) is future:
+                del _letters_in_flight[key]
+
+
+def letter_for_result(params, result):
+    """Letter for a run_bill_analysis result, drafted now (or served from the cache)."""
+    return dispute_letter(_analysis_record(params, result["ai_structured"], _analysis_cache_key(params)))[0]
+
 
+def _pregenerate_letter(record):
+    try:
+        dispute_letter(record)
+    except Exception as e:
+        app.logger.warning("Letter pregeneration failed: %s", e)
+
+
+def run_dispute_analysis(params, progress=None):
+    """Full dispute pipeline: parse bill and rules, analyze, draft the letter.
+
+    progress(stage) is called as each stage starts. Raises DisputeError with
+    the HTTP status the API should return.
+    """
+    progress = progress or (lambda stage: None)
+    result, bill_text = run_bill_analysis(params, progress)
+    if overcharges_found(result["ai_structured"]):
+        progress("drafting_letter")
+        try:
+            result["dispute_letter"] = letter_for_result(params, result)
+        except Exception as e:
+            raise DisputeError(f"AI processing failed: {e}", 500)
+    return result
+
+
+def run_bill_analysis(params, progress=None):
+    """Analysis stages only; returns (payload with an empty dispute_letter, bill_text).
+
+    The payload carries the analysis_id and letter_url to draft the letter later.
+    """
+    progress = progress or (lambda stage: None)
+    prepared = prepare_analysis(params, progress)
+    if "payload" in prepared:
+        return prepared["payload"], prepared["bill_text"]
+    if prepared["deterministic"] is not None:
+        return finish_analysis(params, prepared, prepared["deterministic"])
     try:
         # Structured analysis
+        progress("analyzing")
         ai_structured = ai_check_overcharges_and_discount(
-            rules_text, bill_text, household_size, annual_income, zip_code
+            prepared["rules_text"], prepared["review_text"],
+            params["household_size"], params["annual_income"], params["zip_code"],
         )
-        # For backward compatibility, keep a simple legacy summary text similar to old format
-        legacy_lines = []
-        if ai_structured.get("overcharges"):
-            legacy_lines.append("Overcharges:")
-            for oc in ai_structured["overcharges"]:
-                ln = oc.get("line_number")
-                svc = oc.get("service")
-                amt = oc.get("amount")
-                amt_str = f"${amt:,.2f}" if isinstance(amt, (int, float)) else "(n/a)"
-                legacy_lines.append(f"- Line {ln}: {svc} {amt_str} | Reason: {oc.get('reason')}")
-        else:
-            legacy_lines.append("Overcharges: No overcharges detected")
-        if ai_structured.get("state_abbr"):
-            legacy_lines.append(f"State: {ai_structured['state_abbr']}")
-        if ai_structured.get("total_eligible_discount_percent") is not None:
-            legacy_lines.append(
-                f"Total Eligible Discount: {int(ai_structured['total_eligible_discount_percent'])}%"
-            )
-        if ai_structured.get("discount_explanation"):
-            legacy_lines.append(ai_structured["discount_explanation"].strip())
-        ai_result_legacy = "\n".join(legacy_lines)
-
-        # Draft letter only if overcharges found
-        dispute_letter = ""
-        if overcharges_found(ai_structured):
-            dispute_letter = draft_dispute_letter(
-                request.form.get('patient_name', 'John Doe'),
-                provider if provider else 'Custom Provider',
-                bill_text,
-                ai_structured,
-            )
     except Exception as e:
-        return jsonify({"error": f"AI processing failed: {e}"}), 500
+        raise DisputeError(f"AI processing failed: {e}", 500)
+    return finish_analysis(params, prepared, ai_structured)
+
+
+def prepare_analysis(params, progress):
+    """Everything before the model call: memo lookup, PDF parsing, pre-screen, prompt inputs.
+
+    Returns {"payload", "bill_text"} for a memoized analysis, otherwise the
+    state finish_analysis needs (bill, screen, review_text, rules_text, ...).
+    For a clean bill, "deterministic" holds the finished analysis and no
+    model call is needed.
+    """
+    cache_key = _analysis_cache_key(params)
+    cached = analysis_cache.get(cache_key) if cache_key else None
+    if cache_key:
+        metrics.cache_lookup("analysis", cached is not None)
+    if cached is not None:
+        progress("cached")
+        return {"payload": _with_analysis_id(params, cached["payload"], cache_key), "bill_text": cached["bill_text"]}
+
+    progress("reading_bill")
+    try:
+        # One pdfplumber pass yields both the text and the structured line items
+        with profiling.span("read_bill"), metrics.timed(metrics.PDF_EXTRACTION_SECONDS, "bill"):
+            bill = line_items.read_bill(_pdf_source(params, "bill"))
+    except Exception as e:
+        raise DisputeError(f"Failed to read bill PDF: {e}", 400)
+
+    progress("reading_rules")
+    try:
+        # Uploaded copies of a known policy hash to the same cache entry
+        with profiling.span("policy_index"):
+            policy_index = get_policy_index(_pdf_source(params, "rules"), _pdf_digest(params, "rules"))
+    except Exception as e:
+        raise DisputeError(f"Failed to read rules PDF: {e}", 400)
+    # Deterministic pre-screen: a clean bill is answered without the model; otherwise
+    # the rules' suspicions go to the model as notes on the bill text
+    progress("prescreen")
+    with profiling.span("prescreen"):
+        screen = prescreen.screen_bill(bill["items"], bill["stated_total"], REFERENCE_CHARGES)
+    if screen["status"] == "clean":
+        deterministic = prescreen.clean_result(screen, params["household_size"], params["annual_income"], params["zip_code"])
+        return {
+            "cache_key": cache_key,
+            "bill": bill,
+            "screen": screen,
+            "deterministic": deterministic,
+            "review_text": None,
+            "rules_text": None,
+            "rules_chunks_used": [],
+            "prompt_report": None,
+        }
+    with profiling.span("compact_prompt"):
+        review_text, rules_text, rules_chunks_used, prompt_report = _compact_analysis_inputs(bill, screen, policy_index)
+    return {
+        "cache_key": cache_key,
+        "bill": bill,
+        "screen": screen,
+        "deterministic": None,
+        "review_text": review_text,
+        "rules_text": rules_text,
+        "rules_chunks_used": rules_chunks_used,
+        "prompt_report": prompt_report,
+    }
+
+
+def finish_analysis(params, prepared, ai_structured):
+    """Merge the pre-screen findings into the model's analysis, then build, memoize
+    and register the payload. Returns (payload, bill_text) like run_bill_analysis.
+    """
+    bill, screen, cache_key = prepared["bill"], prepared["screen"], prepared["cache_key"]
+    # The model is told not to repeat the deterministic findings
+    ai_structured["overcharges"] = screen["definite_overcharges"] + (ai_structured["overcharges"] or [])
+    ai_structured["state_abbr"] = ai_structured.get("state_abbr") or prescreen.zip_to_state(params["zip_code"])
+    ai_result_legacy = _build_legacy_summary(ai_structured)
 
-    return jsonify({
+    payload = {
         "providers": list(PROVIDER_RULES.keys()),
         "ai_result": ai_result_legacy,  # legacy combined text
         "ai_structured": {
@@ -635,21 +1553,545 @@ def analyze():
             "discount_explanation": ai_structured.get("discount_explanation"),
             "overcharges": ai_structured.get("overcharges"),
         },
-        "dispute_letter": dispute_letter,
-    })
+        "dispute_letter": "",  # drafted by the caller when overcharges were found
+        "rules_chunks_used": prepared["rules_chunks_used"],
+        "prescreen": {
+            "status": screen["status"],
+            "line_items": len(bill["items"]),
+            "verified_lines": len(screen["verified_lines"]),
+            "ambiguous_lines": len(screen["ambiguous_items"]),
+            "definite_overcharges": len(screen["definite_overcharges"]),
+            "llm_skipped": prepared["deterministic"] is not None,
+        },
+        "prompt": prepared["prompt_report"],
+    }
+    # A reply the model garbled is worth retrying, so it is not memoized
+    if cache_key and ai_structured.get("discount_explanation") != _UNEXPECTED_FORMAT:
+        analysis_cache.set(cache_key, {"payload": payload, "bill_text": bill["text"]}, ANALYSIS_CACHE_TTL)
+    return _with_analysis_id(params, payload, cache_key), bill["text"]
+
+
+def _with_analysis_id(params, payload, cache_key):
+    analysis_id = remember_analysis(params, payload["ai_structured"], cache_key)
+    return {**payload, "analysis_id": analysis_id, "letter_url": f"/api/dispute/analyses/{analysis_id}/letter"}
+
+
+def _wants_stream():
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+
+def _stream_dispute_letter(record, patient_name=None):
+    """SSE events for a letter: tokens as the model emits them, then the full text."""
+    if not overcharges_found(record["ai_structured"]):
+        yield _sse("done", {"dispute_letter": ""})
+        return
+    patient_name = " ".join(str(patient_name or record["patient_name"]).split())
+    key = _letter_cache_key(record, patient_name)
+    letter = analysis_cache.get(key) if key else None
+    if key:
+        metrics.cache_lookup("letter", letter is not None)
+    if letter is None and key:
+        with _letters_lock:
+            pending = _letters_in_flight.get(key)
+        if pending is not None:
+            try:
+                letter = pending.result()
+            except Exception:
+                pass  # the background draft failed; draft it again below
+    if letter is not None:
+        yield _sse("letter", {"delta": letter})
+        yield _sse("done", {"dispute_letter": letter})
+        return
+    parts = []
+    try:
+        for delta in draft_dispute_letter_stream(*_letter_args(record, patient_name)):
+            parts.append(delta)
+            yield _sse("letter", {"delta": delta})
+    except Exception as e:
+        yield _sse("error", {"error": f"AI processing failed: {e}"})
+        return
+    letter = "".join(parts)
+    if key:
+        analysis_cache.set(key, letter, ANALYSIS_CACHE_TTL)
+    yield _sse("done", {"dispute_letter": letter})
+
+
+def _stream_analysis_and_letter(params, result):
+    """SSE body for /analyze?stream=1: the analysis immediately, then the letter."""
+    yield _sse("analysis", result)
+    yield from _stream_dispute_letter(_analysis_record(params, result["ai_structured"], _analysis_cache_key(params)))
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@dispute_bp.route("/api/dispute/analyze", methods=["POST"])  # multipart/form-data expected
+def analyze():
+    """Analyze a bill; the letter is drafted later via letter_url.
+
+    `?stream=1` or `Accept: text/event-stream` instead streams the analysis and
+    then the letter over SSE.
+    """
+    try:
+        params = _dispute_params_from_request()
+        # Analysis errors surface as regular JSON responses with a status code, streaming or not
+        result = run_bill_analysis(params)[0]
+    except DisputeError as e:
+        return jsonify({"error": e.message}), e.http_status
+    if not _wants_stream():
+        return jsonify(result)
+    return Response(
+        stream_with_context(_stream_analysis_and_letter(params, result)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@dispute_bp.route("/api/dispute/analyses/<analysis_id>/letter", methods=["POST"])
+def analysis_letter(analysis_id):
+    """Draft (or fetch the cached) letter for an analysis; optional patient_name overrides the
+    name given to /analyze. `?stream=1` streams it over SSE like /analyze does."""
+    record = get_analysis_record(analysis_id)
+    if record is None:
+        return jsonify({"error": "Unknown or expired analysis."}), 404
+    body = request.get_json(silent=True) or request.form
+    patient_name = body.get("patient_name") or None
+    if _wants_stream():
+        return Response(
+            stream_with_context(_stream_dispute_letter(record, patient_name)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    if not overcharges_found(record["ai_structured"]):
+        return jsonify({"analysis_id": analysis_id, "dispute_letter": ""})
+    try:
+        letter, cached = dispute_letter(record, patient_name)
+    except Exception as e:
+        return jsonify({"error": f"AI processing failed: {e}"}), 500
+    return jsonify({"analysis_id": analysis_id, "dispute_letter": letter}), 200, {"X-Cache": "HIT" if cached else "MISS"}
+
+
+# ---------- Dispute batch (many bills, one policy) ----------
+BATCH_MAX_BILLS = int(os.getenv("BATCH_MAX_BILLS", "200"))
+# Shared by all batch requests, so total batch concurrency stays bounded
+batch_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_CONCURRENCY", "4")), thread_name_prefix="batch"
+)
+
+
+def _batch_bills_from_request():
+    """(filename, stream) for every bill_pdf field and every PDF inside bills_zip."""
+    bills = [(f.filename, f.stream) for f in request.files.getlist("bill_pdf") if f and f.filename]
+    archive = request.files.get("bills_zip")
+    if archive and archive.filename:
+        try:
+            zf = zipfile.ZipFile(archive.stream)
+        except zipfile.BadZipFile:
+            raise DisputeError("bills_zip is not a valid zip archive.", 400)
+        # Bound what the archive may expand to, not just its compressed size
+        budget = 4 * app.config["MAX_CONTENT_LENGTH"]
+        for info in zf.infolist():
+            base = os.path.basename(info.filename)
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or base.startswith("."):
+                continue
+            budget -= info.file_size
+            if budget < 0:
+                raise DisputeError("bills_zip expands beyond the upload limit.", 413)
+            bills.append((info.filename, zf.open(info)))
+    if not bills:
+        raise DisputeError("Please upload bill PDFs (bill_pdf) or a zip archive (bills_zip).", 400)
+    if len(bills) > BATCH_MAX_BILLS:
+        raise DisputeError(f"Too many bills in one batch (max {BATCH_MAX_BILLS}).", 400)
+    return bills
+
+
+def _batch_line(index, filename, status, **fields):
+    return {"type": "bill", "index": index, "filename": filename, "status": status, **fields}
+
+
+def _run_batch_bill(index, filename, params, include_letter):
+    start = time.perf_counter()
+    try:
+        if include_letter:
+            result = run_dispute_analysis(params)
+        else:
+            result = run_bill_analysis(params)[0]
+        line = _batch_line(index, filename, "ok", result=result)
+    except DisputeError as e:
+        line = _batch_line(index, filename, "error", error=e.message, http_status=e.http_status)
+    except Exception as e:
+        line = _batch_line(index, filename, "error", error=f"{type(e).__name__}: {e}", http_status=500)
+    line["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return line
+
+
+@dispute_bp.route("/api/dispute/batch", methods=["POST"])  # multipart/form-data expected
+def analyze_batch():
+    """Analyze many bills against one policy; streams one NDJSON line per bill as it finishes.
+
+    Same form fields as /analyze, with bill_pdf repeated and/or a bills_zip
+    archive; letters=0 skips letter drafting.
+    """
+    started = time.perf_counter()
+    try:
+        context = _dispute_context_from_request()
+        bills = _batch_bills_from_request()
+        # Parse and index the rules once; every bill then hits the in-memory index
+        get_policy_index(_pdf_source(context, "rules"), _pdf_digest(context, "rules"))
+    except DisputeError as e:
+        return jsonify({"error": e.message}), e.http_status
+    except Exception as e:
+        return jsonify({"error": f"Failed to read rules PDF: {e}"}), 400
+    include_letter = request.form.get("letters", "1") not in ("0", "false")
+
+    # Bodies are read here, in the request thread; workers only see bytes or paths
+    ready, rejected = [], []
+    for index, (filename, stream) in enumerate(bills):
+        if not filename.lower().endswith(".pdf"):
+            rejected.append(_batch_line(index, filename, "error", error="Only PDF files are supported for now.", http_status=415))
+            continue
+        try:
+            ready.append((index, filename, {**context, **_receive_pdf(stream, "bill", persist=False)}))
+        except DisputeError as e:
+            rejected.append(_batch_line(index, filename, "error", error=e.message, http_status=e.http_status))
+
+    def stream():
+        counts = {"ok": 0, "error": len(rejected)}
+        for line in rejected:
+            yield json.dumps(line) + "\n"
+        # Each bill runs in a copy of this context so a profiled batch records its spans
+        futures = [
+            batch_pool.submit(contextvars.copy_context().run, _run_batch_bill, i, name, params, include_letter)
+            for i, name, params in ready
+        ]
+        try:
+            for fut in as_completed(futures):
+                line = fut.result()
+                counts[line["status"]] += 1
+                yield json.dumps(line) + "\n"
+        finally:
+            for fut in futures:  # client went away: drop bills not started yet
+                fut.cancel()
+        yield json.dumps({
+            "type": "summary",
+            "total": len(bills),
+            "succeeded": counts["ok"],
+            "failed": counts["error"],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }) + "\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------- Dispute jobs (async analysis) ----------
+job_queue = create_job_queue(
+    os.getenv("JOB_QUEUE_URL"),
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "64")),
+    ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", "3600")),
+    processes=int(os.getenv("WEB_CONCURRENCY", "1")),
+)
+
+
+def run_dispute_job(params, progress):
+    """run_dispute_analysis for a queued job; its uploads stay pinned until it ends."""
+    try:
+        return run_dispute_analysis(params, progress)
+    finally:
+        release_uploads(params)
+
+
+job_queue.register("dispute", run_dispute_job)
+
+
+def _job_urls(job_id):
+    base = f"/api/dispute/jobs/{job_id}"
+    return {"status_url": base, "result_url": f"{base}/result", "events_url": f"{base}/events"}
+
+
+@dispute_bp.route("/api/dispute/jobs", methods=["POST"])  # same form fields as /analyze
+def submit_dispute_job():
+    try:
+        params = _dispute_params_from_request(persist=True)
+    except DisputeError as e:
+        return jsonify({"error": e.message}), e.http_status
+    try:
+        job_id = job_queue.submit("dispute", params)
+    except QueueFull:
+        release_uploads(params)
+        return jsonify({"error": "Analysis queue is full, retry shortly."}), 503, {"Retry-After": "5"}
+    return jsonify({"job_id": job_id, "status": "queued", **_job_urls(job_id)}), 202
+
+
+@dispute_bp.route("/api/dispute/jobs/<job_id>", methods=["GET"])
+def dispute_job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    return jsonify({**job, **_job_urls(job_id)})
+
+
+@dispute_bp.route("/api/dispute/jobs/<job_id>/result", methods=["GET"])
+def dispute_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), job["http_status"] or 500
+    if job["status"] != "succeeded":
+        return jsonify({"status": job["status"], "stage": job["stage"]}), 202
+    return jsonify(job_queue.get_result(job_id))
+
+
+@dispute_bp.route("/api/dispute/jobs/<job_id>/events", methods=["GET"])
+def dispute_job_events(job_id):
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after", 0))
+    except ValueError:
+        after = 0
+
+    def stream():
+        seq = after
+        while True:
+            events = job_queue.wait(job_id, after=seq, timeout=15)
+            if not events:
+                if job_queue.get(job_id) is None:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for ev in events:
+                seq = ev["seq"]
+                yield f"id: {seq}\n" + _sse("progress", ev)
+                if ev["status"] == "succeeded":
+                    yield _sse("result", job_queue.get_result(job_id))
+                    return
+                if ev["status"] == "failed":
+                    job = job_queue.get(job_id) or {}
+                    yield _sse("error", {"error": job.get("error"), "http_status": job.get("http_status")})
+                    return
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    return jsonify({"error": f"Upload too large (limit {limit_mb} MB)."}), 413
+
+
+# ---------- Profiling (opt-in, admin only) ----------
+# Everything here is disabled unless ADMIN_TOKEN is set. A request is profiled
+# when it sends `X-Profile: 1` (or `stacks` for the sampling profiler too) with
+# the admin token, or at random with probability PROFILE_SAMPLE_RATE.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_STACKS = os.getenv("PROFILE_STACKS", "0") == "1"  # stack sampling for rate-sampled requests
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+profile_store = profiling.ProfileStore(
+    os.getenv("PROFILE_DIR") or os.path.join(CACHE_DIR, "profiles"),
+    max_count=int(os.getenv("PROFILE_MAX_COUNT", "200")),
+    max_age=int(os.getenv("PROFILE_MAX_AGE", str(24 * 3600))),
+)
+
+
+def _admin_authorized(headers=None):
+    if not ADMIN_TOKEN:
+        return False
+    headers = request.headers if headers is None else headers
+    supplied = headers.get("X-Admin-Token") or ""
+    auth = headers.get("Authorization") or ""
+    if auth.startswith("Bearer "):
+        supplied = supplied or auth[len("Bearer "):]
+    return hmac.compare_digest(supplied.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+def profile_mode(method, path, headers):
+    """None when the request is not profiled, otherwise whether to sample stacks."""
+    if not ADMIN_TOKEN or path.startswith("/admin/") or method == "OPTIONS":
+        return None
+    flag = (headers.get("X-Profile") or "").strip().lower()
+    if flag and flag != "0" and _admin_authorized(headers):
+        return flag in ("stacks", "sample")
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return PROFILE_STACKS
+    return None
+
+
+@app.before_request
+def _maybe_start_profile():
+    profiling.clear()  # worker threads are reused between requests
+    stacks = profile_mode(request.method, request.path, request.headers)
+    if stacks is None:
+        return
+    g.profile = profiling.start(request.method, request.path, stacks=stacks, sample_interval=PROFILE_SAMPLE_INTERVAL)
+
+
+@app.after_request
+def _finish_profile(response):
+    profile = g.get("profile")
+    if profile is None:
+        return response
+    response.headers["X-Profile-Id"] = profile.id
+    status, endpoint = response.status_code, request.endpoint
+
+    def store():
+        # After the body is sent, so streamed letters and batch results are included
+        try:
+            profile_store.save(profile.finish(status=status, endpoint=endpoint))
+        except OSError as e:
+            app.logger.warning("Could not store profile %s: %s", profile.id, e)
+
+    response.call_on_close(store)
+    return response
+
+
+def _require_admin():
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not _admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@app.get("/admin/profiles")
+def list_profiles():
+    """Newest stored profiles first (?limit=N)."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    limit = max(1, min(500, request.args.get("limit", 50, type=int)))
+    return jsonify({"profiles": profile_store.list(limit)})
+
+
+@app.get("/admin/profiles/<profile_id>")
+def get_profile(profile_id):
+    """One profile as JSON; `?format=folded` returns the sampled stacks for flamegraph.pl/speedscope."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    data = profile_store.get(profile_id)
+    if data is None:
+        return jsonify({"error": "Unknown profile"}), 404
+    if request.args.get("format") == "folded":
+        return Response(profiling.folded(data), mimetype="text/plain")
+    return jsonify(data)
+
+
+# ---------- Health & metrics ----------
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        labels = (request.blueprint or "app", request.endpoint or "unmatched", request.method, str(response.status_code))
+        # Streamed bodies (SSE, NDJSON) are only done once the server closes the response
+        response.call_on_close(
+            lambda: metrics.REQUEST_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+        )
+    return response
 
 
-# ---------- Health route ----------
 @app.get("/health")
 def health():
     return jsonify({"ok": True})
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.get("/health/upstreams")
+def health_upstreams():
+    """Per-upstream request counts, latency and connection reuse."""
+    stats = http_client.all_stats()
+    if upstream_cassette is not None:
+        stats["cassette"] = upstream_cassette.stats()
+    return jsonify(stats)
+
+
+# ---------- Warm-up ----------
+# Heavy modules and clients load on first use, so a worker answers /health within
+# a fraction of a second of starting; warm_up() front-loads them after fork instead
+# of on the first real request (gunicorn.conf.py post_fork, asgi.py lifespan)
+WARM_UP = os.getenv("WARM_UP", "1") != "0"
+
+
+PDF_CACHE_WARM = os.getenv("PDF_CACHE_WARM", "1") != "0"
+
+
+def warm_up():
+    """Load pdfplumber, the OpenAI SDK and client, the tokenizer and the upstream
+    sessions, then (with PDF_CACHE_WARM) extract and index the bundled policies."""
+    started = time.perf_counter()
+    import pdfplumber  # noqa: F401
+
+    get_openai_client()
+    prompt_budget.count_tokens("warm-up", OPENAI_MODEL)
+    for upstream in (nominatim_http, openrouter_http, websites_http):
+        upstream.session
+    if PDF_CACHE_WARM:
+        warm_policy_cache()
+    app.logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
+
+
+def start_warm_up():
+    """Run warm_up() in a background thread (if WARM_UP), so startup isn't blocked on it."""
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """Purge the catalog and start the upload sweeper, job consumers and gazetteer load.
+
+    Not done at import: pdf_extract's spawned pool processes re-import
+    __main__, and each would start its own copies. Called by `python
+    server.py`, gunicorn's post_fork and the ASGI lifespan; repeat calls are
+    no-ops.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    hospital_catalog.purge(CATALOG_RETENTION)
+    upload_store.start_sweeper(int(os.getenv("UPLOAD_SWEEP_INTERVAL", "300")))
+    job_queue.start()
+    # Start loading the offline gazetteer (if configured) without blocking startup
+    get_gazetteer()
+
+
 # Register blueprints
 app.register_blueprint(hospitals_bp)
 app.register_blueprint(dispute_bp)
 
 
 if __name__ == "__main__":
+    # With the debug reloader this process only watches files; the child serves
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
+        start_warm_up()
     # Default to port 5000 to match references
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
\ No newline at end of file
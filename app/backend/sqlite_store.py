@@ -0,0 +1,162 @@
+"""SQLite-backed primitives shared by all worker processes on a host.
+
+- SqliteTTLCache: JSON key/value cache with per-entry TTLs and an optional
+  total size bound.
+- SqliteTokenBucket: cross-process token-bucket rate limiter.
+
+Both use WAL mode and a busy timeout so concurrent gunicorn workers can
+read and write the same file; connections are per thread.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SqliteStore:
+    """Per-thread WAL connections to one SQLite file; base class for SQLite-backed stores."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class SqliteTTLCache(SqliteStore):
+    """max_bytes bounds the stored JSON; entries closest to expiry are evicted first."""
+
+    def __init__(self, path, table="cache", max_bytes=None):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        if not table.isidentifier():
+            raise ValueError(f"invalid table name: {table!r}")
+        self.table = table
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._writes = 0
+
+    def get(self, key):
+        row = self._conn().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl),
+        )
+        self._writes += 1
+        if self.max_bytes is not None:
+            if self._writes % 20 == 0:
+                self._evict()
+        elif self._writes % 500 == 0:
+            self.purge_expired()
+
+    def delete(self, key):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+
+    def total_bytes(self):
+        row = self._conn().execute(f"SELECT COALESCE(SUM(length(value)), 0) FROM {self.table}").fetchone()
+        return row[0]
+
+    def _evict(self):
+        self.purge_expired()
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in self._conn().execute(
+            f"SELECT key, length(value) FROM {self.table} ORDER BY expires_at"
+        ):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn().executemany(f"DELETE FROM {self.table} WHERE key = ?", doomed)
+
+
+class SqliteTokenBucket(SqliteStore):
+    """Token bucket whose state lives in SQLite, so the limit holds across processes."""
+
+    def __init__(self, path, name, rate, capacity=1.0):
+        super().__init__(path)
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _try_take(self):
+        """Take one token if available; otherwise return seconds until one is."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens = self.capacity if row is None else min(
+                self.capacity, row[0] + (now - row[1]) * self.rate
+            )
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, timeout=10.0):
+        """Block until a token is taken; False if that would exceed timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._try_take()
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=10.0):
+        """acquire() for the event loop: waits with asyncio.sleep instead of blocking.
+
+        The SQLite transaction runs in a worker thread so lock contention doesn't stall the loop.
+        """
+        import anyio  # only the ASGI mode calls this
+
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = await anyio.to_thread.run_sync(self._try_take)
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
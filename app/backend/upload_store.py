@@ -0,0 +1,173 @@
+"""Content-addressed store for uploaded PDFs.
+
+receive() reads an upload once while hashing it. Files up to memory_max_bytes
+stay in memory and are parsed from a BytesIO; larger ones are spilled to a
+temp file and renamed to <root>/<sha256>.pdf, so identical uploads share one
+file and concurrent uploads with the same client filename never collide.
+persist() writes a small upload to the same place when something outside
+this request (a background job) needs a path. A sweeper thread enforces a
+maximum file age and a total size bound, oldest first, skipping files that
+are pinned. Pins are marker files next to the uploads, so a job queued in one
+process keeps its file even when another process sweeps; a marker left by a
+crashed process expires after max_age.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+_CHUNK = 1024 * 1024
+# The sweeper only touches files this store created
+_STORED_RE = re.compile(r"^[0-9a-f]{64}\.pdf$")
+_TEMP_PREFIX = ".upload-"
+_PIN_RE = re.compile(r"^\.pin-([0-9a-f]{64})-[0-9a-f]{32}$")
+
+
+class Upload:
+    def __init__(self, digest, size, data=None, path=None):
+        self.digest = digest
+        self.size = size
+        self.data = data  # bytes for in-memory uploads
+        self.path = path  # content-addressed file once on disk
+
+
+class UploadStore:
+    def __init__(self, root, memory_max_bytes=4 * 1024 * 1024, max_age=24 * 3600, max_total_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.memory_max_bytes = memory_max_bytes
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        os.makedirs(root, exist_ok=True)
+        self._sweeper = None
+
+    def path_for(self, digest):
+        return os.path.join(self.root, f"{digest}.pdf")
+
+    def receive(self, stream):
+        """Hash and buffer an upload stream; returns an Upload."""
+        sha = hashlib.sha256()
+        buf = io.BytesIO()
+        spill = None
+        size = 0
+        try:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                size += len(chunk)
+                if spill is None and size > self.memory_max_bytes:
+                    spill = tempfile.NamedTemporaryFile(dir=self.root, prefix=_TEMP_PREFIX, suffix=".tmp", delete=False)
+                    spill.write(buf.getvalue())
+                    buf = None
+                (spill or buf).write(chunk)
+            digest = sha.hexdigest()
+            if spill is None:
+                return Upload(digest, size, data=buf.getvalue())
+            spill.close()
+            return Upload(digest, size, path=self._commit(spill.name, digest))
+        except BaseException:
+            if spill is not None:
+                spill.close()
+                _remove(spill.name)
+            raise
+
+    def persist(self, upload):
+        """Make sure the upload exists on disk and return its path."""
+        if upload.path is None:
+            fd, tmp = tempfile.mkstemp(dir=self.root, prefix=_TEMP_PREFIX, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(upload.data)
+            upload.path = self._commit(tmp, upload.digest)
+        return upload.path
+
+    def _commit(self, tmp_path, digest):
+        path = self.path_for(digest)
+        try:
+            os.utime(path)  # reused content counts as fresh for the sweeper
+        except FileNotFoundError:
+            # New content, or the sweeper removed the old copy just now
+            os.replace(tmp_path, path)
+        else:
+            _remove(tmp_path)
+        return path
+
+    def pin(self, digest):
+        """Keep <digest>.pdf from being swept until unpin(token); returns the token."""
+        token = os.path.join(self.root, f".pin-{digest}-{uuid.uuid4().hex}")
+        with open(token, "x"):
+            pass
+        return token
+
+    def unpin(self, token):
+        _remove(token)
+
+    def sweep(self):
+        """Delete unpinned stored files past max_age, then the oldest until under max_total_bytes.
+
+        Other files in the directory are left alone.
+        """
+        now = time.time()
+        files = []
+        pinned = set()
+        pinned_bytes = 0
+        entries = []
+        for entry in os.scandir(self.root):
+            pin = _PIN_RE.match(entry.name)
+            if pin is None:
+                entries.append(entry)
+                continue
+            try:
+                if now - entry.stat().st_mtime > self.max_age:
+                    _remove(entry.path)
+                else:
+                    pinned.add(pin.group(1))
+            except FileNotFoundError:
+                continue
+        for entry in entries:
+            is_temp = entry.name.startswith(_TEMP_PREFIX)
+            if not entry.is_file() or not (is_temp or _STORED_RE.match(entry.name)):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if not is_temp and entry.name[:-len(".pdf")] in pinned:
+                pinned_bytes += st.st_size  # counts toward the bound, never deleted
+                continue
+            if now - st.st_mtime > (self.max_age if not is_temp else min(self.max_age, 3600)):
+                _remove(entry.path)
+            elif not is_temp:
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = pinned_bytes + sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_total_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def start_sweeper(self, interval=300):
+        if self._sweeper is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sweep()
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        self._sweeper = threading.Thread(target=loop, name="upload-sweeper", daemon=True)
+        self._sweeper.start()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
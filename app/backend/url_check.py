@@ -0,0 +1,133 @@
+"""Concurrent hospital website verification with a TTL cache.
+
+All URLs from one search are checked in parallel on a bounded pool under an
+overall deadline. Results are cached per URL (positive and negative, with
+separate TTLs); connection-level failures are also cached per host so one
+dead domain doesn't cost a timeout for every page on it. Checks still
+running at the deadline report "timeout" and keep going in the background,
+so their result is cached for the next search. Both caches are LRUs of at
+most max_entries, and expired entries are dropped as new ones arrive.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+STATUS_OK = "ok"
+STATUS_UNREACHABLE = "unreachable"
+STATUS_TIMEOUT = "timeout"
+STATUS_INVALID = "invalid"
+
+
+class _HostDown(Exception):
+    pass
+
+
+def check_url(url, timeout=3.0, http=None):
+    """Return True if the URL answers with a non-error status.
+
+    http is anything with requests-style head/get (a pooled UpstreamClient
+    in the server; plain requests by default). Raises _HostDown for
+    connection-level failures (DNS, refused, TLS).
+    """
+    import requests
+
+    http = http or requests
+    try:
+        r = http.head(url, allow_redirects=True, timeout=timeout)
+        if r.status_code in (403, 405, 501):
+            # Plenty of sites reject HEAD; confirm with a GET that skips the body
+            r = http.get(url, allow_redirects=True, timeout=timeout, stream=True)
+            r.close()
+        return r.status_code < 400
+    except (requests.ConnectionError, requests.exceptions.SSLError) as e:
+        raise _HostDown(str(e))
+    except requests.RequestException:
+        return False
+
+
+class UrlVerifier:
+    def __init__(
+        self, workers=8, timeout=3.0, ok_ttl=6 * 3600, fail_ttl=900, check=check_url, http=None, max_entries=4096
+    ):
+        self.timeout = timeout
+        self.http = http
+        self.ok_ttl = ok_ttl
+        self.fail_ttl = fail_ttl
+        self.max_entries = max_entries
+        self._check = check
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="url-check")
+        self._lock = threading.Lock()
+        self._url_cache = OrderedDict()  # url -> (status, expires_at)
+        self._host_cache = OrderedDict()  # host -> (unreachable, expires_at) for hosts that refused connections
+        self._inflight = {}  # url -> Future, so concurrent searches share one check
+
+    def _cached(self, url, host, now):
+        for cache, key in ((self._url_cache, url), (self._host_cache, host)):
+            hit = cache.get(key)
+            if hit and hit[1] > now:
+                cache.move_to_end(key)
+                return hit[0]
+        return None
+
+    def _store(self, cache, key, status, ttl, now):
+        """Insert as most recent; over the cap, drop expired entries first, then the least recently used."""
+        cache[key] = (status, now + ttl)
+        cache.move_to_end(key)
+        while cache and next(iter(cache.values()))[1] <= now:
+            cache.popitem(last=False)
+        if len(cache) > self.max_entries:
+            for k in [k for k, (_, expires_at) in cache.items() if expires_at <= now]:
+                del cache[k]
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def _run_check(self, url, host):
+        try:
+            status = STATUS_OK if self._check(url, self.timeout, self.http) else STATUS_UNREACHABLE
+            host_down = False
+        except _HostDown:
+            status, host_down = STATUS_UNREACHABLE, True
+        except Exception:
+            status, host_down = STATUS_UNREACHABLE, False
+        now = time.time()
+        with self._lock:
+            ttl = self.ok_ttl if status == STATUS_OK else self.fail_ttl
+            self._store(self._url_cache, url, status, ttl, now)
+            if host_down:
+                self._store(self._host_cache, host, STATUS_UNREACHABLE, self.fail_ttl, now)
+            self._inflight.pop(url, None)
+        return status
+
+    def verify_many(self, urls, deadline=6.0):
+        """Return {url: status} for every distinct URL, waiting at most `deadline` seconds."""
+        results = {}
+        pending = {}
+        now = time.time()
+        with self._lock:
+            for url in dict.fromkeys(u for u in urls if u):
+                parts = urlsplit(url)
+                if parts.scheme not in ("http", "https") or not parts.netloc:
+                    results[url] = STATUS_INVALID
+                    continue
+                host = parts.netloc.lower()
+                cached = self._cached(url, host, now)
+                if cached is not None:
+                    results[url] = cached
+                    continue
+                fut = self._inflight.get(url)
+                if fut is None:
+                    # Runs in the caller's context (request profiling spans follow it)
+                    fut = self._pool.submit(contextvars.copy_context().run, self._run_check, url, host)
+                    self._inflight[url] = fut
+                pending[url] = fut
+        if pending:
+            wait(pending.values(), timeout=deadline)
+        for url, fut in pending.items():
+            results[url] = fut.result() if fut.done() else STATUS_TIMEOUT
+        return results
+
+    def verify(self, url, deadline=None):
+        return self.verify_many([url], deadline or self.timeout * 2).get(url, STATUS_INVALID)
@@ -17,6 +17,10 @@ export default function DisputePage() {
   const [error, setError] = useState<string>("");
   const [aiResult, setAiResult] = useState<string>("");
   const [disputeLetter, setDisputeLetter] = useState<string>("");
+  // Letters are drafted on demand from the analysis' letter_url
+  const [letterUrl, setLetterUrl] = useState<string>("");
+  const [letterLoading, setLetterLoading] = useState<boolean>(false);
+  const [letterError, setLetterError] = useState<string>("");
   const [copied, setCopied] = useState<boolean>(false);
   const [parsedState, setParsedState] = useState<string>("");
   const [parsedDiscount, setParsedDiscount] = useState<string>("");
@@ -79,6 +83,8 @@ export default function DisputePage() {
     setError("");
     setAiResult("");
     setDisputeLetter("");
+    setLetterUrl("");
+    setLetterError("");
     setParsedState("");
     setParsedDiscount("");
     if (!file) {
@@ -110,6 +116,7 @@ export default function DisputePage() {
       const full: string = data.ai_result || "";
       setAiResult(full);
       setDisputeLetter(data.dispute_letter || "");
+      setLetterUrl(data.letter_url || "");
 
       // Prefer structured JSON when available
       const s: AiStructured | undefined = data.ai_structured;
@@ -158,6 +165,28 @@ export default function DisputePage() {
     }
   };
 
+  const handleDraftLetter = async () => {
+    if (!letterUrl) return;
+    setLetterError("");
+    setLetterLoading(true);
+    try {
+      const res = await fetch(`${BACKEND_URL}${letterUrl}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ patient_name: patientName || "John Doe" }),
+      });
+      const data = await res.json();
+      if (!res.ok) {
+        throw new Error(data?.error || "Request failed");
+      }
+      setDisputeLetter(data.dispute_letter || "");
+    } catch (e: any) {
+      setLetterError(e?.message || "Something went wrong.");
+    } finally {
+      setLetterLoading(false);
+    }
+  };
+
   const handleCopyLetter = useCallback(() => {
     if (!disputeLetter) return;
     navigator.clipboard.writeText(disputeLetter).then(() => {
@@ -393,7 +422,7 @@ export default function DisputePage() {
             </button>
             {file && (
               <button
-                onClick={() => { setFile(null); setRulesFile(null); setAiResult(""); setDisputeLetter(""); setError(""); setParsedDiscount(""); setParsedState(""); setDiscountExplanation(""); setOverchargeSection(""); setOvercharges([]); }}
+                onClick={() => { setFile(null); setRulesFile(null); setAiResult(""); setDisputeLetter(""); setLetterUrl(""); setLetterError(""); setError(""); setParsedDiscount(""); setParsedState(""); setDiscountExplanation(""); setOverchargeSection(""); setOvercharges([]); }}
                 className="inline-flex items-center gap-2 rounded-full bg-white text-slate-600 border border-slate-200 font-bold px-6 py-3 shadow-sm hover:shadow"
               >
                 Reset
@@ -493,6 +522,31 @@ export default function DisputePage() {
                   </div>
                 )}
               </div>
+              {/* Draft letter on demand */}
+              {!disputeLetter && letterUrl && overcharges.length > 0 && (
+                <div className="flex flex-col items-center gap-2">
+                  <button
+                    onClick={handleDraftLetter}
+                    disabled={letterLoading}
+                    className="group inline-flex items-center gap-2 rounded-full bg-teal-600 text-white font-bold px-6 py-3 shadow hover:shadow-md disabled:opacity-50 disabled:cursor-not-allowed"
+                  >
+                    {letterLoading ? (
+                      <>
+                        <span className="inline-block h-2 w-2 rounded-full bg-white animate-pulse"></span>
+                        Drafting letter...
+                      </>
+                    ) : (
+                      <>
+                        Draft dispute letter
+                        <span className="group-hover:translate-x-1 transition-transform">→</span>
+                      </>
+                    )}
+                  </button>
+                  {letterError && (
+                    <div className="text-red-600 font-semibold text-sm">{letterError}</div>
+                  )}
+                </div>
+              )}
               {/* Dispute Letter Panel */}
               {disputeLetter && (
                 <div className="bg-gradient-to-br from-white/95 to-white/80 backdrop-blur-md rounded-[2.25rem] p-6 md:p-8 shadow-xl border border-slate-100/60 relative">
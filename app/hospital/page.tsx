@@ -9,6 +9,7 @@ type HospitalResult = {
   address?: string | null;
   phone?: string | null;
   url?: string | null;
+  url_status?: "ok" | "unreachable" | "timeout" | "invalid" | null;
   latitude?: number | null;
   longitude?: number | null;
   distance_miles?: number | null;
@@ -321,7 +322,7 @@ export default function HospitalPage() {
                       )}
                     </div>
                     <div className="flex items-center gap-2 mt-3 md:mt-0">
-                      {r.url && (
+                      {r.url && r.url_status !== "unreachable" && r.url_status !== "invalid" && (
                         <a href={r.url} target="_blank" rel="noreferrer" className="px-4 py-2 text-sm font-bold rounded-xl border-2 border-slate-200 text-slate-600 hover:border-slate-300 hover:bg-slate-50 transition-all">
                           Website
                         </a>